@@ -0,0 +1,126 @@
+#Build the Alpine departments mask on the model grid
+import hashlib
+import os
+
+import numpy as np
+import xarray as xr
+
+from calculs_indicateurs.storage import atomic_to_netcdf
+
+# French departments (simplified geometries) and the Alpine departments of the study area
+DEPARTMENTS_URL = "https://raw.githubusercontent.com/gregoiredavid/france-geojson/master/departements-version-simplifiee.geojson"
+ALPINE_CODES = ['04', '05', '06', '26', '38', '73', '74', '84']
+
+# The mask cache lives next to Alpes_grid.nc (repository root)
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GRID_FILE = os.path.join(REPO_ROOT, 'Alpes_grid.nc')
+MASK_DIR = REPO_ROOT
+
+
+def load_departments(codes=ALPINE_CODES, source=DEPARTMENTS_URL):
+    """Return the GeoDataFrame of the requested departments."""
+    import geopandas as gpd
+
+    departments = gpd.read_file(source)
+    return departments[departments['code'].isin(codes)]
+
+
+def load_alpine_geometry(codes=ALPINE_CODES, source=DEPARTMENTS_URL):
+    """Return the union of the requested department polygons."""
+    return load_departments(codes, source).union_all()
+
+
+def grid_hash(lat, lon, codes=ALPINE_CODES):
+    """Hash of the lat/lon arrays (and department list) identifying a grid mask."""
+    h = hashlib.sha1()
+    for values in (lat, lon):
+        values = np.ascontiguousarray(np.asarray(values, dtype='float64'))
+        h.update(str(values.shape).encode())
+        h.update(values.tobytes())
+    h.update(','.join(sorted(codes)).encode())
+    return h.hexdigest()[:16]
+
+
+def build_mask(lat, lon, geometry):
+    """Vectorized point-in-polygon test of every grid point (one pass)."""
+    import shapely
+
+    lat = np.asarray(lat, dtype='float64')
+    lon = np.asarray(lon, dtype='float64')
+    shapely.prepare(geometry)
+    return shapely.contains_xy(geometry, lon, lat)
+
+
+def mask_path(lat, lon, codes=ALPINE_CODES, mask_dir=MASK_DIR):
+    return os.path.join(mask_dir, f"Alpes_mask_{grid_hash(lat, lon, codes)}.nc")
+
+
+def get_alpine_mask(ds, codes=ALPINE_CODES, mask_dir=MASK_DIR, geometry=None):
+    """Return the (y, x) boolean mask for the grid of `ds`, computed once per grid.
+
+    The mask is cached as `Alpes_mask_<hash>.nc`, the hash being computed from the
+    `lat`/`lon` arrays, so every file sharing the same grid reuses it.
+    """
+    lat = ds['lat'].values
+    lon = ds['lon'].values
+    path = mask_path(lat, lon, codes, mask_dir)
+
+    if os.path.exists(path):
+        with xr.open_dataset(path) as cached:
+            return cached['mask'].load().astype(bool)
+
+    if geometry is None:
+        geometry = load_alpine_geometry(codes)
+    values = build_mask(lat, lon, geometry)
+
+    mask = xr.DataArray(values, dims=ds['lat'].dims,
+                        coords={dim: ds.coords[dim] for dim in ds['lat'].dims if dim in ds.coords})
+    ds_mask = xr.Dataset({'mask': mask.astype('int8')})
+    ds_mask['mask'].attrs['long_name'] = 'Grid points inside the Alpine departments'
+    ds_mask.attrs['departments'] = ','.join(codes)
+    ds_mask.attrs['grid_hash'] = grid_hash(lat, lon, codes)
+    os.makedirs(mask_dir, exist_ok=True)
+    atomic_to_netcdf(ds_mask, path)
+    return mask
+
+
+def subset_bounds(mask):
+    """Bounds (valid_y, valid_x) of the grid points inside the mask."""
+    valid_y = np.where(mask.any(dim='x'))[0]
+    valid_x = np.where(mask.any(dim='y'))[0]
+    return valid_y, valid_x
+
+
+def apply_mask(ds, mask):
+    """Mask all data variables and crop to the bounding box of the mask."""
+    ds_masked = ds.where(mask, drop=False)
+
+    valid_y, valid_x = subset_bounds(mask)
+    if len(valid_y) > 0 and len(valid_x) > 0:
+        return ds_masked.isel(
+            y=slice(valid_y.min(), valid_y.max() + 1),
+            x=slice(valid_x.min(), valid_x.max() + 1)
+        )
+    return ds_masked
+
+
+def output_path(input_file, output_dir='.'):
+    """'tasAdjust_FR-Metro_..._day_19900101-19991231.nc' -> 'tasAdjust_alpes_day_19900101-19991231.nc'"""
+    basename = os.path.basename(input_file)
+    variable = basename.split('_')[0]
+    date_range = basename.split('_')[-1].replace('.nc', '')
+    return os.path.join(output_dir, f"{variable}_alpes_day_{date_range}.nc")
+
+
+def select_file(input_file, output_dir='.', mask_dir=MASK_DIR, time_chunk=None):
+    """Mask and crop one input file to the Alpine departments.
+
+    With `time_chunk`, the file is opened with dask and written block by block, so
+    only `time_chunk` days are held in memory at once.
+    """
+    output_file = output_path(input_file, output_dir)
+    chunks = {'time': time_chunk} if time_chunk else None
+    with xr.open_dataset(input_file, chunks=chunks) as ds:
+        mask = get_alpine_mask(ds, mask_dir=mask_dir)
+        atomic_to_netcdf(apply_mask(ds, mask), output_file)
+    return output_file
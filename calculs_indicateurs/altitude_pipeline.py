@@ -0,0 +1,222 @@
+#Chunked altitude statistics stage on a local dask.distributed cluster
+#
+#   python -m calculs_indicateurs.altitude_pipeline 'tasAdjust_alpes_day_*.nc' --variable tasAdjust \
+#       --season DJF --threshold 273.15 --buffer 0.5 --output isotherme_0_daily_altitude_DJF.nc --memory-limit 48GB
+#   python -m calculs_indicateurs.altitude_pipeline 'tasAdjust_alpes_day_*.nc' --variable tasAdjust \
+#       --season DJF --threshold 273.15 --buffer 0.5 --stats-csv isotherme_0_averaged_stats.csv
+import argparse
+import os
+from contextlib import contextmanager
+from glob import glob
+
+import netCDF4
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from calculs_indicateurs.altitude_stats import (PERIODS, STATS, above_threshold, daily_elevation_stats,
+                                                near_threshold, period_means)
+from calculs_indicateurs.elevation_index import ELEVATION_FILE, get_index
+from calculs_indicateurs.manifest import MANIFEST_NAME, Manifest, overlapping_files
+from calculs_indicateurs.seasons import SEASONS, file_season_ranges, wraps
+from calculs_indicateurs.storage import atomic_path, atomic_to_netcdf, parse_size
+
+# About one season of days per chunk
+SEASON_DAYS = 92
+# Copies of a chunk alive while a block is processed (read, condition, sorted hits, spare)
+CHUNK_COPIES = 4
+
+
+def file_layout(input_file, variable):
+    """Shape, item size and on-disk chunk shape of `variable` in `input_file`."""
+    with netCDF4.Dataset(input_file) as nc:
+        var = nc.variables[variable]
+        chunking = var.chunking()
+        disk_chunks = tuple(var.shape) if chunking == 'contiguous' else tuple(chunking)
+        return {'dims': var.dimensions, 'shape': tuple(var.shape),
+                'itemsize': var.dtype.itemsize, 'disk_chunks': disk_chunks}
+
+
+def chunk_plan(input_file, variable, memory_limit, n_workers=1):
+    """Dask chunks for the temperature archives: full (y, x) tiles, about one season of days.
+
+    The time chunk is a multiple of the on-disk time chunk (so no disk chunk is read
+    twice) and is reduced until CHUNK_COPIES chunks per worker fit in the memory limit.
+    """
+    layout = file_layout(input_file, variable)
+    time_dim = layout['dims'][0]
+    day_bytes = int(np.prod(layout['shape'][1:])) * layout['itemsize']
+    budget = parse_size(memory_limit) // max(n_workers, 1)
+    max_days = max(1, budget // (CHUNK_COPIES * day_bytes))
+
+    disk_days = layout['disk_chunks'][0]
+    days = min(SEASON_DAYS, max_days)
+    if disk_days < layout['shape'][0] and disk_days <= days:
+        days = days // disk_days * disk_days
+    chunks = {dim: -1 for dim in layout['dims'][1:]}
+    chunks[time_dim] = int(days)
+    return chunks
+
+
+def open_season(input_files, variable, season, chunks):
+    """Lazy (time, y, x) array of the `season` days only, with their `season_year` coordinate.
+
+    The season ranges come from the cached season index of each file. Every range is cut
+    from the lazily opened file before being chunked, so the dask tasks only read the
+    season slabs from disk. Returns the array and the open datasets (to be closed).
+    """
+    datasets = []
+    parts = []
+    for input_file in input_files:
+        ds = xr.open_dataset(input_file)
+        datasets.append(ds)
+        for r in file_season_ranges(input_file, season):
+            part = ds[variable].isel(time=slice(r.start, r.stop)).chunk(chunks)
+            parts.append(part.assign_coords(season_year=('time', np.full(r.stop - r.start, r.year))))
+    temp = xr.concat(parts, dim='time', coords='minimal', compat='override')
+    return temp, datasets
+
+
+def _block_stats(block, order, sorted_elevation, condition):
+    stats = daily_elevation_stats(condition(block), order, sorted_elevation)
+    return np.stack([stats[name] for name in STATS], axis=1).astype('float64')
+
+
+def compute_season_stats(temp, elevation_index, condition):
+    """Daily elevation statistics of the (season) days of `temp`, one dask task per time chunk."""
+    data = temp.data
+    result = data.map_blocks(
+        _block_stats, elevation_index.order, elevation_index.sorted_elevation, condition,
+        drop_axis=[1, 2], new_axis=1, chunks=(data.chunks[0], (len(STATS),)), dtype='float64'
+    ).compute()
+
+    daily_stats = xr.Dataset({name: ('time', result[:, i]) for i, name in enumerate(STATS)})
+    daily_stats['count_points'] = daily_stats['count_points'].astype('int64')
+    return daily_stats.assign_coords(time=temp['time'].values, season_year=('time', temp['season_year'].values))
+
+
+@contextmanager
+def local_client(memory_limit, n_workers, client=None):
+    """Local dask.distributed cluster sized on `memory_limit`, unless a client is given."""
+    if client is not None:
+        yield client
+        return
+    from dask.distributed import Client, LocalCluster
+
+    per_worker = parse_size(memory_limit) // n_workers
+    cluster = LocalCluster(n_workers=n_workers, threads_per_worker=1, memory_limit=per_worker)
+    client = Client(cluster)
+    try:
+        yield client
+    finally:
+        client.close()
+        cluster.close()
+
+
+def daily_season_stats(input_files, variable, season, condition, elevation_file=ELEVATION_FILE,
+                       memory_limit='48GB', n_workers=1):
+    """Read the season slabs of the archives with a chunk plan and compute the daily statistics."""
+    chunks = chunk_plan(input_files[0], variable, memory_limit, n_workers)
+    temp, datasets = open_season(input_files, variable, season, chunks)
+    try:
+        return compute_season_stats(temp, get_index(elevation_file), condition)
+    finally:
+        for ds in datasets:
+            ds.close()
+
+
+def run_altitude_stage(input_files, variable, season, condition, output_file,
+                       elevation_file=ELEVATION_FILE, memory_limit='48GB', n_workers=None,
+                       client=None, long_name=None):
+    """Compute and save the daily elevation statistics on a local dask.distributed cluster."""
+    n_workers = n_workers or os.cpu_count()
+    with local_client(memory_limit, n_workers, client):
+        daily_stats = daily_season_stats(input_files, variable, season, condition,
+                                         elevation_file, memory_limit, n_workers)
+    if long_name:
+        daily_stats['mean_elevation'].attrs['long_name'] = long_name
+    daily_stats['mean_elevation'].attrs['units'] = 'm'
+    atomic_to_netcdf(daily_stats, output_file)
+    return daily_stats
+
+
+def run_period_stats(input_files, variable, season, condition, params, csv_file, periods=PERIODS,
+                     elevation_file=ELEVATION_FILE, memory_limit='48GB', n_workers=None,
+                     client=None):
+    """Per-period means of the daily statistics, recomputing only the stale rows of `csv_file`.
+
+    Each row is recorded in the manifest of the CSV directory with the content hash of
+    the input files overlapping the period and the parameters (`params`, season, period).
+    Rows whose inputs and parameters did not change are kept from the existing CSV, so
+    adding a 2090s file only recomputes the periods that contain those years.
+    """
+    n_workers = n_workers or os.cpu_count()
+    manifest = Manifest(os.path.join(os.path.dirname(os.path.abspath(csv_file)), MANIFEST_NAME))
+    existing = pd.read_csv(csv_file, index_col=0) if os.path.exists(csv_file) else None
+
+    rows = {}
+    stale = []
+    for label, start, end in periods:
+        # The first winter of the period starts in December of the previous year
+        first_year = int(start[:4]) - wraps(SEASONS[season])
+        files = overlapping_files(input_files, first_year, int(end[:4]))
+        key = f"{os.path.abspath(csv_file)}#{label}"
+        row_params = dict(params, season=season, period=[label, start, end])
+        if (existing is not None and label in existing.index
+                and manifest.is_current(key, files, row_params, path=csv_file)):
+            rows[label] = existing.loc[label]
+        elif files:
+            stale.append((label, start, end, files, key, row_params))
+
+    if stale:
+        with local_client(memory_limit, n_workers, client):
+            for label, start, end, files, key, row_params in stale:
+                print(f"Computing {label} from {len(files)} files")
+                daily_stats = daily_season_stats(files, variable, season, condition,
+                                                 elevation_file, memory_limit, n_workers)
+                rows[label] = period_means(daily_stats, [(label, start, end)]).loc[label]
+
+    labels = [label for label, _, _ in periods if label in rows]
+    df = pd.DataFrame([rows[label] for label in labels], index=labels)
+    tmp_path = atomic_path(csv_file)
+    df.to_csv(tmp_path)
+    os.replace(tmp_path, csv_file)
+
+    for label, start, end, files, key, row_params in stale:
+        manifest.record(key, files, row_params)
+    manifest.save()
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Daily elevation statistics of threshold-crossing cells')
+    parser.add_argument('patterns', nargs='+', help='glob patterns of the *_alpes_day_*.nc files')
+    parser.add_argument('--variable', required=True)
+    parser.add_argument('--season', choices=sorted(SEASONS), required=True)
+    parser.add_argument('--threshold', type=float, required=True)
+    parser.add_argument('--buffer', type=float, help='keep cells within threshold +/- buffer '
+                                                     '(default: cells at or above threshold)')
+    parser.add_argument('--output', help='daily statistics NetCDF')
+    parser.add_argument('--stats-csv', help='per-period statistics CSV, updated incrementally')
+    parser.add_argument('--elevation-file', default=ELEVATION_FILE)
+    parser.add_argument('--memory-limit', default='48GB')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args(argv)
+
+    input_files = sorted(f for pattern in args.patterns for f in glob(pattern))
+    if args.buffer is None:
+        condition = above_threshold(args.threshold)
+    else:
+        condition = near_threshold(args.threshold, args.buffer)
+    if args.output:
+        run_altitude_stage(input_files, args.variable, args.season, condition, args.output,
+                           args.elevation_file, args.memory_limit, args.workers)
+    if args.stats_csv:
+        params = {'variable': args.variable, 'threshold': args.threshold, 'buffer': args.buffer}
+        run_period_stats(input_files, args.variable, args.season, condition, params, args.stats_csv,
+                         elevation_file=args.elevation_file, memory_limit=args.memory_limit,
+                         n_workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#Daily elevation statistics of the grid cells meeting a temperature condition
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from calculs_indicateurs.periods import ALTITUDE_PERIODS, as_dates
+from calculs_indicateurs.seasons import select_period
+
+STATS = ['mean_elevation', 'max_elevation', 'min_elevation', 'median_elevation', 'count_points']
+
+# Periods of the averaged statistics CSVs (label, start, end)
+PERIODS = as_dates(ALTITUDE_PERIODS)
+
+# Days processed per block by compute_daily_stats
+CHUNK_DAYS = 92
+
+
+def elevation_order(elevation):
+    """Flat indices of the grid cells sorted by elevation, and their sorted elevations.
+
+    Cells without elevation (NaN) are left out.
+    """
+    flat = np.asarray(elevation, dtype='float64').ravel()
+    cells = np.flatnonzero(~np.isnan(flat))
+    order = cells[np.argsort(flat[cells], kind='stable')]
+    return order, flat[order]
+
+
+def daily_elevation_stats(mask, order, sorted_elevation):
+    """Mean, max, min, median elevation and count of the True cells of each day.
+
+    `mask` is a (time, y, x) boolean array. The cells are reordered by elevation once
+    (`order` from elevation_order), so the hits of each day come out of np.nonzero
+    already sorted: min, max and median are rank lookups, no sort/partition per day.
+    """
+    n_days = len(mask)
+    hits = np.asarray(mask).reshape(n_days, -1)[:, order]
+    days, cells = np.nonzero(hits)
+
+    count = np.bincount(days, minlength=n_days)
+    total = np.bincount(days, weights=sorted_elevation[cells], minlength=n_days)
+    first = np.cumsum(count) - count
+
+    stats = {name: np.full(n_days, np.nan) for name in STATS[:-1]}
+    has = count > 0
+    start = first[has]
+    n = count[has]
+    stats['mean_elevation'][has] = total[has] / n
+    stats['min_elevation'][has] = sorted_elevation[cells[start]]
+    stats['max_elevation'][has] = sorted_elevation[cells[start + n - 1]]
+    stats['median_elevation'][has] = 0.5 * (sorted_elevation[cells[start + (n - 1) // 2]] +
+                                            sorted_elevation[cells[start + n // 2]])
+    stats['count_points'] = count
+    return stats
+
+
+def near_threshold(threshold, buffer):
+    """Condition: temperature within threshold +/- buffer."""
+    return lambda temp: (temp >= threshold - buffer) & (temp <= threshold + buffer)
+
+
+def above_threshold(threshold):
+    """Condition: temperature at or above threshold."""
+    return lambda temp: temp >= threshold
+
+
+def compute_daily_stats(temp, elevation, condition, chunk_days=CHUNK_DAYS):
+    """Daily elevation statistics of the cells where `condition(temp)` holds.
+
+    `temp` is a (time, y, x) DataArray, read `chunk_days` days at a time.
+    `elevation` is the (y, x) elevation array or a prebuilt ElevationIndex.
+    """
+    if hasattr(elevation, 'sorted_elevation'):
+        order, sorted_elevation = elevation.order, elevation.sorted_elevation
+    else:
+        order, sorted_elevation = elevation_order(elevation)
+    n_time = temp.sizes['time']
+    columns = {name: [] for name in STATS}
+    for start in range(0, n_time, chunk_days):
+        block = temp.isel(time=slice(start, start + chunk_days)).values
+        stats = daily_elevation_stats(condition(block), order, sorted_elevation)
+        for name in STATS:
+            columns[name].append(stats[name])
+
+    return xr.Dataset(
+        {name: ('time', np.concatenate(values)) for name, values in columns.items()},
+        coords={'time': temp['time'].values}
+    )
+
+
+def period_means(daily_stats, periods):
+    """Average the daily statistics over each (label, start, end) period (by season year if given)."""
+    averaged_stats = {}
+    for label, start, end in periods:
+        period_data = select_period(daily_stats, start, end)
+        mean_data = period_data.mean(dim='time', skipna=True)
+        averaged_stats[label] = {var: float(mean_data[var].values) for var in mean_data.data_vars}
+    return pd.DataFrame(averaged_stats).T
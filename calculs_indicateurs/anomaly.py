@@ -0,0 +1,125 @@
+#Anomaly and difference maps of the indicators against a cached reference climatology
+#
+#   python -m calculs_indicateurs.anomaly freezing_days tropical_days
+#   python -m calculs_indicateurs.anomaly tropical_days --reference 2021-2040 --periods 2061-2080 2081-2100
+#
+# Output: <data folder>/<indicator>_anomalies_vs_<reference>.nc, every period stacked along `period`
+# (variables: period_mean, anomaly, relative_anomaly in %, and reference_mean).
+import argparse
+import os
+
+import numpy as np
+import xarray as xr
+
+from calculs_indicateurs.compact import open_compact
+from calculs_indicateurs.indicator_store import DATA_FOLDERS, netcdf_files
+from calculs_indicateurs.manifest import MANIFEST_NAME, Manifest, overlapping_files
+from calculs_indicateurs.periods import ANOMALY_PERIODS, LATE, REFERENCE, Period, PeriodAggregator
+from calculs_indicateurs.storage import atomic_to_netcdf
+
+
+def parse_period(text):
+    """Period from a 'YYYY-YYYY' label (inclusive years)."""
+    start, end = (int(year) for year in text.split('-'))
+    return Period(text, start, end)
+
+
+def climatology_path(name, reference=REFERENCE, data_folder=None):
+    return os.path.join(data_folder or DATA_FOLDERS[name], f'{name}_climatology_{reference.label}.nc')
+
+
+def get_climatology(name, reference=REFERENCE, data_folder=None):
+    """Mean, std and count of valid years of `reference`, computed once and cached next to the data.
+
+    Only the years of the reference are read from the compact cube. The cache is rebuilt
+    when the per-year files covering those years change (manifest of the data folder);
+    open_compact checks the cube against the same files and exports it again first.
+    """
+    data_folder = data_folder or DATA_FOLDERS[name]
+    path = climatology_path(name, reference, data_folder)
+    manifest = Manifest(os.path.join(data_folder, MANIFEST_NAME))
+    inputs = overlapping_files(netcdf_files(name, data_folder), reference.start, reference.end)
+    params = {'indicator': name, 'reference': list(reference)}
+    if manifest.is_current(path, inputs, params):
+        with xr.open_dataset(path) as cached:
+            return cached.load()
+
+    cube = open_compact(name, data_folder)
+    keep = np.flatnonzero((cube.years >= reference.start) & (cube.years <= reference.end))
+    if len(keep) == 0:
+        raise ValueError(f"No year of {name} in the reference period {reference.label}")
+    aggregator = PeriodAggregator(cube.masked(slice(keep[0], keep[-1] + 1)), cube.years[keep])
+    dims = cube.dims[1:]
+    ds = xr.Dataset(
+        {'mean': (dims, aggregator.mean(reference)),
+         'std': (dims, aggregator.std(reference)),
+         'count': (dims, aggregator.count(reference).astype('int16'))},
+        coords={dim: cube.coord(dim) for dim in dims},
+        attrs={'indicator': name, 'reference': reference.label},
+    )
+    atomic_to_netcdf(ds, path)
+    # Reloaded: open_compact may have recorded a new export of the cube in the same manifest
+    manifest = Manifest(os.path.join(data_folder, MANIFEST_NAME))
+    manifest.record(path, inputs, params)
+    manifest.save()
+    return ds
+
+
+def anomalies(name, periods=ANOMALY_PERIODS, reference=REFERENCE, data_folder=None):
+    """Period means, anomalies and relative anomalies (%) of all `periods` against `reference`.
+
+    The period means of every period come from one PeriodAggregator over the compact
+    cube, stacked along `period`; the reference comes from the cached climatology, so
+    any baseline only costs its own years the first time. Relative anomalies are NaN
+    where the reference mean is 0 (e.g. no tropical day at altitude).
+    """
+    cube = open_compact(name, data_folder)
+    dims = cube.dims[1:]
+    aggregator = PeriodAggregator(cube.masked(), cube.years, dims, {dim: cube.coord(dim) for dim in dims})
+    means = aggregator.aggregate(periods, 'mean')
+    means = means.assign_coords(start=('period', [p.start for p in periods]),
+                                end=('period', [p.end for p in periods]))
+    reference_mean = get_climatology(name, reference, data_folder)['mean']
+
+    anomaly = means - reference_mean
+    with np.errstate(invalid='ignore', divide='ignore'):
+        relative = 100 * anomaly / reference_mean.where(reference_mean > 0)
+
+    ds = xr.Dataset({
+        'period_mean': means.rename(None),
+        'anomaly': anomaly.rename(None),
+        'relative_anomaly': relative.rename(None),
+        'reference_mean': reference_mean,
+    })
+    ds['period_mean'].attrs['units'] = 'days'
+    ds['anomaly'].attrs.update(units='days', long_name=f'{name} anomaly vs {reference.label}')
+    ds['relative_anomaly'].attrs.update(units='%', long_name=f'{name} relative anomaly vs {reference.label}')
+    ds['reference_mean'].attrs.update(units='days', long_name=f'{name} mean {reference.label}')
+    ds.attrs.update(indicator=name, reference=reference.label)
+    return ds
+
+
+def anomalies_path(name, reference=REFERENCE, data_folder=None):
+    return os.path.join(data_folder or DATA_FOLDERS[name], f'{name}_anomalies_vs_{reference.label}.nc')
+
+
+def export_anomalies(name, periods=ANOMALY_PERIODS + [LATE], reference=REFERENCE, data_folder=None):
+    """Write the anomaly and difference maps of all periods to one NetCDF file."""
+    ds = anomalies(name, periods, reference, data_folder)
+    path = anomalies_path(name, reference, data_folder)
+    atomic_to_netcdf(ds, path)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Anomaly and difference maps of the indicators')
+    parser.add_argument('names', nargs='+', choices=sorted(DATA_FOLDERS))
+    parser.add_argument('--reference', type=parse_period, default=REFERENCE)
+    parser.add_argument('--periods', nargs='+', type=parse_period, default=ANOMALY_PERIODS + [LATE])
+    args = parser.parse_args(argv)
+    for name in args.names:
+        print(f"Written {export_anomalies(name, args.periods, args.reference)}")
+
+
+if __name__ == '__main__':
+    main()
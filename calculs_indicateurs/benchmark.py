@@ -0,0 +1,363 @@
+#Benchmark of the pipeline stages on synthetic daily files shaped as the ALPX-3 grid (Alpes_grid.nc)
+#
+#   python -m calculs_indicateurs.benchmark --years 10 --scale 1 --work-dir benchmark_data
+#   python -m calculs_indicateurs.benchmark --years 30 --scale 2 --save-baseline
+#
+# Stages: masking, threshold counting, altitude statistics, period aggregation, anomaly computation,
+# matplotlib and plotly frame rendering. Each stage reports its time, peak RSS (process and workers)
+# and throughput in cell-days/second; results are compared against benchmark_baseline.json.
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import netCDF4
+import numpy as np
+import pandas as pd
+import psutil
+import xarray as xr
+
+from calculs_indicateurs import alpes_mask, indicators
+from calculs_indicateurs.altitude_stats import period_means
+from calculs_indicateurs.anomaly import anomalies
+from calculs_indicateurs.compact import open_compact
+from calculs_indicateurs.elevation_index import get_index
+from calculs_indicateurs.ensemble import ALTITUDE_STAGES, season_daily_stats, stage_condition
+from calculs_indicateurs.hyperslab import opened_readers
+from calculs_indicateurs.periods import Period, PeriodAggregator, as_dates
+from calculs_indicateurs.plotly_export import heatmap_animation, write_html
+from calculs_indicateurs.rendering import render_frames
+from calculs_indicateurs.storage import atomic_path, atomic_to_netcdf
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_FILE = os.path.join(REPO_ROOT, 'benchmark_baseline.json')
+
+# CNRM file naming of the synthetic inputs (same fields as the real FR-Metro files)
+FILE_NAME = '{variable}_FR-Metro_CNRM-ESM2-1_{experiment}_r1i1p1f1_CNRM-MF_CNRM-AROME46t1_v1-r1_MF-CDFt_day_{dates}.nc'
+VARIABLES = ['tasAdjust', 'tasminAdjust']
+STAGES = ['masking', 'counting', 'altitude', 'aggregation', 'anomaly', 'render_matplotlib', 'render_plotly']
+
+# Slower (or heavier) than the baseline by more than this fraction is a regression
+TOLERANCE = 0.25
+# Seconds between two RSS samples of the process tree
+SAMPLE_INTERVAL = 0.02
+
+
+# -----------------------------
+# Synthetic inputs
+# -----------------------------
+def synthetic_grid(scale=1, grid_file=alpes_mask.GRID_FILE):
+    """x, y, lat, lon of the Alpes_grid.nc grid, refined `scale` times in each direction."""
+    with xr.open_dataset(grid_file) as grid:
+        grid = grid[['lat', 'lon']].load()
+    if scale != 1:
+        ny, nx = grid.sizes['y'], grid.sizes['x']
+        y, x = grid['y'].values, grid['x'].values
+        grid = grid.interp(y=np.linspace(y[0], y[-1], (ny - 1) * scale + 1),
+                           x=np.linspace(x[0], x[-1], (nx - 1) * scale + 1))
+    return grid
+
+
+def synthetic_elevation(lat, lon):
+    """Elevation (m) of a smooth ridge running along the middle of the domain."""
+    lat = np.asarray(lat, dtype='float64')
+    lon = np.asarray(lon, dtype='float64')
+    lat0, lon0 = lat.mean(), lon.mean()
+    ridge = lon - lon0 + 0.6 * (lat - lat0)
+    return 200 + 3500 * np.exp(-(ridge / 0.6) ** 2) * np.exp(-((lat - lat0) / 1.5) ** 2)
+
+
+def synthetic_geometry(lat, lon):
+    """Ellipse over the centre of the grid, standing in for the Alpine departments (no download)."""
+    import shapely
+    from shapely import affinity
+
+    lat = np.asarray(lat)
+    lon = np.asarray(lon)
+    centre = shapely.Point(lon.mean(), lat.mean())
+    return affinity.scale(centre.buffer(1.0, quad_segs=32),
+                          0.4 * np.ptp(lon), 0.4 * np.ptp(lat))
+
+
+def synthetic_temperature(times, elevation, year_offset, rng):
+    """(time, y, x) float32 daily mean temperature (K): seasonal cycle, lapse rate, warming, weather."""
+    doy = times.dayofyear.values
+    seasonal = 10 * np.cos(2 * np.pi * (doy - 200) / 365.25)
+    weather = rng.normal(0, 3, len(times))
+    daily = 285.15 + 0.04 * year_offset + seasonal + weather
+    noise = rng.normal(0, 1, (len(times),) + elevation.shape)
+    return (daily[:, None, None] - 6.5e-3 * elevation[None] + noise).astype('float32')
+
+
+def write_synthetic_file(path, variable, grid, years, seed):
+    """One daily file of `years`, written year by year (peak memory: one year of the grid)."""
+    rng = np.random.default_rng(seed)
+    elevation = synthetic_elevation(grid['lat'], grid['lon'])
+    tmp_path = atomic_path(path)
+    try:
+        with netCDF4.Dataset(tmp_path, 'w') as nc:
+            nc.createDimension('time', None)
+            nc.createDimension('y', grid.sizes['y'])
+            nc.createDimension('x', grid.sizes['x'])
+            time_var = nc.createVariable('time', 'f8', ('time',))
+            time_var.units = 'days since 1950-01-01'
+            time_var.calendar = 'standard'
+            for dim in ('y', 'x'):
+                nc.createVariable(dim, 'f8', (dim,))[:] = grid[dim].values
+            for coord in ('lat', 'lon'):
+                nc.createVariable(coord, 'f8', ('y', 'x'))[:] = grid[coord].values
+            var = nc.createVariable(variable, 'f4', ('time', 'y', 'x'), fill_value=np.float32(1e20),
+                                    chunksizes=(1, grid.sizes['y'], grid.sizes['x']))
+            var.units = 'K'
+            var.coordinates = 'lat lon'
+
+            offset = 0
+            for year in years:
+                times = pd.date_range(f'{year}-01-01', f'{year}-12-31')
+                temp = synthetic_temperature(times, elevation, year - years[0], rng)
+                if variable == 'tasminAdjust':
+                    temp -= 5
+                time_var[offset:offset + len(times)] = netCDF4.date2num(
+                    times.to_pydatetime(), time_var.units, time_var.calendar)
+                var[offset:offset + len(times)] = temp
+                offset += len(times)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def generate_inputs(input_dir, start, n_years, years_per_file, scale=1):
+    """Synthetic tasAdjust/tasminAdjust files of `n_years` from `start` (existing files kept)."""
+    os.makedirs(input_dir, exist_ok=True)
+    grid = synthetic_grid(scale)
+    files = []
+    for first in range(start, start + n_years, years_per_file):
+        years = list(range(first, min(first + years_per_file, start + n_years)))
+        dates = f'{years[0]}0101-{years[-1]}1231'
+        experiment = 'historical' if years[-1] <= 2014 else 'ssp370'
+        for i, variable in enumerate(VARIABLES):
+            path = os.path.join(input_dir, FILE_NAME.format(variable=variable, experiment=experiment, dates=dates))
+            if not os.path.exists(path):
+                write_synthetic_file(path, variable, grid, years, seed=1000 * i + first)
+            files.append(path)
+    return files, grid
+
+
+def split_periods(start, n_years, n_periods=4):
+    """Consecutive periods covering the synthetic years: the first is the anomaly reference."""
+    bounds = np.linspace(start, start + n_years, n_periods + 1).round().astype(int)
+    return [Period(f'{a}-{b - 1}', int(a), int(b - 1)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+# -----------------------------
+# Measurements
+# -----------------------------
+def tree_rss(process):
+    """Resident memory (bytes) of a process and all its children (e.g. the rendering workers)."""
+    total = 0
+    for proc in [process] + process.children(recursive=True):
+        try:
+            total += proc.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+
+@contextmanager
+def measure(result, interval=SAMPLE_INTERVAL):
+    """Fill `result` with the wall time and the peak RSS of the process tree of the block."""
+    process = psutil.Process()
+    peak = [tree_rss(process)]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(interval):
+            peak[0] = max(peak[0], tree_rss(process))
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result['seconds'] = time.perf_counter() - start
+        done.set()
+        sampler.join()
+        result['peak_rss_mb'] = max(peak[0], tree_rss(process)) / 2 ** 20
+
+
+def cell_days(files, variable=None):
+    """Grid cells x days of the daily `files` (of `variable` only, if given)."""
+    total = 0
+    for path in files:
+        if variable and not os.path.basename(path).startswith(variable + '_'):
+            continue
+        with netCDF4.Dataset(path) as nc:
+            total += len(nc.dimensions['time']) * len(nc.dimensions['y']) * len(nc.dimensions['x'])
+    return total
+
+
+# -----------------------------
+# Stages
+# -----------------------------
+def run_benchmark(input_files, periods, stage_dir, workers=None):
+    """Run every stage once on the synthetic files; {stage: {seconds, peak_rss_mb, cell_days, ...}}."""
+    if os.path.exists(stage_dir):
+        shutil.rmtree(stage_dir)
+    masked_dir = os.path.join(stage_dir, 'alpes')
+    data_folder = os.path.join(stage_dir, 'indicators')
+    os.makedirs(data_folder)
+    reference, projections = periods[0], periods[1:]
+    results = {stage: {} for stage in STAGES}
+
+    with measure(results['masking']):
+        with xr.open_dataset(input_files[0]) as ds:
+            alpes_mask.get_alpine_mask(ds, mask_dir=stage_dir, geometry=synthetic_geometry(ds['lat'], ds['lon']))
+        masked = [alpes_mask.select_file(f, masked_dir, mask_dir=stage_dir) for f in input_files]
+    results['masking']['cell_days'] = cell_days(input_files)
+
+    with measure(results['counting']):
+        for f in masked:
+            indicators.process_file(f, output_dir=data_folder)
+    results['counting']['cell_days'] = cell_days(masked)
+
+    # Elevation file of the cropped grid, as Alpes_grid_ESM2.nc
+    with xr.open_dataset(masked[0]) as ds:
+        elevation = synthetic_elevation(ds['lat'], ds['lon'])
+    elevation_file = os.path.join(stage_dir, 'Alpes_grid_synthetic.nc')
+    atomic_to_netcdf(xr.Dataset({'elevation': (('y', 'x'), elevation)}), elevation_file)
+
+    daily = {}
+    with measure(results['altitude']):
+        index = get_index(elevation_file)
+        with opened_readers(masked) as readers:
+            for stage, params in ALTITUDE_STAGES.items():
+                daily[stage] = season_daily_stats(readers, params['variable'], params['season'],
+                                                  stage_condition(params), index)
+    results['altitude']['bytes_read'] = sum(reader.bytes_read for reader in readers)
+    results['altitude']['cell_days'] = sum(len(d['time']) for d in daily.values()) * int(np.isfinite(elevation).sum())
+
+    maps = {}
+    with measure(results['aggregation']):
+        for ind in indicators.INDICATORS:
+            cube = open_compact(ind.name, data_folder)
+            maps[ind.name] = (cube, PeriodAggregator(cube.masked(), cube.years).aggregate(periods, 'mean'))
+        for stats in daily.values():
+            period_means(stats, as_dates(periods))
+    results['aggregation']['cell_days'] = cell_days(masked)
+
+    with measure(results['anomaly']):
+        for ind in indicators.INDICATORS:
+            anomalies(ind.name, projections, reference, data_folder)
+    results['anomaly']['cell_days'] = cell_days(masked)
+
+    cube, _ = maps['freezing_days']
+    frames = cube.masked()
+    titles = [f'Jours de gel - Année {year}' for year in cube.years]
+    with measure(results['render_matplotlib']):
+        render_frames(cube.x, cube.y, frames, titles, cmap='Blues', label='Jours de gel', workers=workers)
+    with measure(results['render_plotly']):
+        fig = heatmap_animation(cube.x, cube.y, frames, [str(year) for year in cube.years],
+                                title='Jours de gel', colorbar_title='Jours de gel', colorscale='Blues',
+                                slider_prefix='Année: ', duration=200)
+        write_html(fig, os.path.join(stage_dir, 'freezing_days_animation.html'))
+    for stage in ('render_matplotlib', 'render_plotly'):
+        results[stage]['cell_days'] = cell_days(masked, 'tasAdjust')
+        results[stage]['frames'] = len(frames)
+
+    for result in results.values():
+        result['cell_days_per_s'] = result['cell_days'] / result['seconds'] if result['seconds'] else None
+    return results
+
+
+# -----------------------------
+# Baseline
+# -----------------------------
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Regressions of `results` against `baseline`: throughput lower or peak RSS higher than tolerated."""
+    regressions = []
+    for stage, result in results['stages'].items():
+        base = baseline['stages'].get(stage)
+        if base is None:
+            continue
+        if result['cell_days_per_s'] < base['cell_days_per_s'] / (1 + tolerance):
+            regressions.append(f"{stage}: {result['cell_days_per_s']:.3g} cell-days/s "
+                               f"(baseline {base['cell_days_per_s']:.3g})")
+        if result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{stage}: peak RSS {result['peak_rss_mb']:.0f} MB "
+                               f"(baseline {base['peak_rss_mb']:.0f} MB)")
+    return regressions
+
+
+def print_table(results, baseline=None):
+    print(f"{'stage':<18}{'seconds':>10}{'cell-days/s':>14}{'peak RSS MB':>13}{'vs baseline':>13}")
+    for stage, result in results['stages'].items():
+        ratio = ''
+        if baseline and stage in baseline['stages']:
+            ratio = f"x{result['cell_days_per_s'] / baseline['stages'][stage]['cell_days_per_s']:.2f}"
+        print(f"{stage:<18}{result['seconds']:>10.2f}{result['cell_days_per_s']:>14.3g}"
+              f"{result['peak_rss_mb']:>13.0f}{ratio:>13}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the pipeline stages on synthetic data')
+    parser.add_argument('--start', type=int, default=1990, help='first synthetic year')
+    parser.add_argument('--years', type=int, default=10, help='number of synthetic years')
+    parser.add_argument('--years-per-file', type=int, default=5)
+    parser.add_argument('--scale', type=int, default=1, help='grid refinement factor of Alpes_grid.nc')
+    parser.add_argument('--workers', type=int, default=None, help='rendering processes (default: all CPUs)')
+    parser.add_argument('--work-dir', help='folder of the synthetic inputs, kept between runs (default: temporary)')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        input_dir = os.path.join(work_dir, f'inputs_scale{args.scale}')
+        input_files, grid = generate_inputs(input_dir, args.start, args.years, args.years_per_file, args.scale)
+        periods = split_periods(args.start, args.years)
+        stages = run_benchmark(input_files, periods, os.path.join(work_dir, 'stages'), args.workers)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    config = {'start': args.start, 'years': args.years, 'years_per_file': args.years_per_file,
+              'scale': args.scale, 'grid': [grid.sizes['y'], grid.sizes['x']], 'workers': args.workers}
+    results = {'config': config, 'stages': stages,
+               'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                           'cpus': os.cpu_count(), 'memory_gb': psutil.virtual_memory().total / 2 ** 30}}
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['config'] != config:
+            print(f"Baseline {args.baseline} was measured with {baseline['config']}, not compared")
+            baseline = None
+    print_table(results, baseline)
+
+    for path in filter(None, [args.output, args.baseline if args.save_baseline else None]):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Written {path}")
+
+    regressions = compare(results, baseline, args.tolerance) if baseline else []
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
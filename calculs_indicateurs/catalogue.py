@@ -0,0 +1,229 @@
+#Declarative catalogue of climate indicators, evaluated together in one streaming pass over the files
+#
+#   python -m calculs_indicateurs.run_pipeline catalogue 'tasAdjust_alpes_day_*.nc' 'tasminAdjust_alpes_day_*.nc' \
+#       --output-dir catalogue_data
+#
+# Each indicator declares its input variable, season (months) and reduction; the indicators of a
+# variable share every block read from the files, streamed in date order. Output:
+# <indicator>_per_year_<dates>.nc per input file.
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import xarray as xr
+
+from calculs_indicateurs import indicators
+from calculs_indicateurs.indicators import CHUNK_DAYS, COMPARISONS, _year_segments, date_range, output_path
+from calculs_indicateurs.seasons import season_years, wraps
+from calculs_indicateurs.spells import SpellCounter
+from calculs_indicateurs.storage import atomic_to_netcdf, count_encoding
+
+# Daily temperature range assumed by the hours proxies (K): no sub-daily data in the inputs
+DIURNAL_RANGE = 8.0
+
+# Reductions of the daily values over the (season) days of each year, with the unit of the result
+UNITS = {
+    'count': 'days',
+    'max_spell': 'days',
+    'degree_days': 'K days',
+    'hours_below': 'hours',
+}
+# Reductions stored as int16 day counts (see count_encoding)
+DAY_COUNTS = ('count', 'max_spell')
+
+
+@dataclass(frozen=True)
+class ClimateIndicator:
+    name: str
+    variable: str
+    reduction: str
+    threshold: float
+    long_name: str
+    comparison: str = '<'
+    season: tuple = None
+
+    @property
+    def prefix(self):
+        return f"{self.name}_per_year"
+
+    @property
+    def units(self):
+        return UNITS[self.reduction]
+
+
+def _from_threshold(ind):
+    return ClimateIndicator(ind.name, ind.variable, 'count', ind.threshold, ind.long_name, ind.comparison)
+
+
+CATALOGUE = [_from_threshold(ind) for ind in indicators.INDICATORS] + [
+    ClimateIndicator('frost_days', 'tasminAdjust', 'count', 273.15,
+                     'Count of days with min daily temperature below 273.15K'),
+    ClimateIndicator('ice_days', 'tasmaxAdjust', 'count', 273.15,
+                     'Count of days with max daily temperature below 273.15K'),
+    ClimateIndicator('summer_days', 'tasmaxAdjust', 'count', 298.15,
+                     'Count of days with max daily temperature above 298.15K', comparison='>'),
+    ClimateIndicator('growing_degree_days', 'tasAdjust', 'degree_days', 278.15,
+                     'Sum of daily temperature excess above 278.15K'),
+    ClimateIndicator('frost_spell_max', 'tasminAdjust', 'max_spell', 273.15,
+                     'Longest run of consecutive days with min daily temperature below 273.15K, '
+                     'ending in the year'),
+    ClimateIndicator('snowmaking_hours', 'tasminAdjust', 'hours_below', 271.15,
+                     'Hours below 271.15K from November to March (daily minimum and '
+                     f'{DIURNAL_RANGE:g}K diurnal range), proxy of the snowmaking hours',
+                     season=(11, 12, 1, 2, 3)),
+]
+CATALOGUE_BY_NAME = {ind.name: ind for ind in CATALOGUE}
+
+
+def hours_below(tmin, threshold, diurnal_range=DIURNAL_RANGE):
+    """Hours of the day below `threshold`, for a sinusoidal cycle rising from `tmin` by `diurnal_range`."""
+    with np.errstate(invalid='ignore'):
+        c = np.clip(1 - 2 * (threshold - tmin) / diurnal_range, -1, 1)
+    return np.nan_to_num(24 / np.pi * np.arccos(c))
+
+
+def daily_values(ind, block):
+    """Per-day values of `ind` over a (time, y, x) block, before the yearly reduction."""
+    if ind.reduction in DAY_COUNTS:
+        return COMPARISONS[ind.comparison](block, ind.threshold)
+    if ind.reduction == 'degree_days':
+        # fmax ignores NaN: missing days add nothing
+        return np.fmax(block - ind.threshold, 0)
+    if ind.reduction == 'hours_below':
+        return hours_below(block, ind.threshold)
+    raise ValueError(f"Unknown reduction: {ind.reduction}")
+
+
+def season_year_index(years, calendar_years, months, season):
+    """Position in `years` of the year each day counts for: its season year for a season over the new year."""
+    if season:
+        calendar_years = season_years(calendar_years, months, season)
+    return np.searchsorted(years, calendar_years)
+
+
+def compute_files(input_files, catalogue=CATALOGUE, chunk_days=CHUNK_DAYS):
+    """Stream the files in date order and evaluate every catalogue indicator of their variables.
+
+    Each variable is read once per block; the indicators using it reduce that same block
+    (season days only). Days count for their season year (November and December of a
+    November-March season go with the following winter) and the spells are carried from
+    one file to the next by spells.SpellCounter, so a winter or a spell crossing a file
+    boundary is counted once. Returns ({indicator name: (year, y, x) float array, NaN
+    without data}, years, x, y).
+    """
+    input_files = sorted(input_files, key=date_range)
+    calendar_years = set()
+    variables = set()
+    for input_file in input_files:
+        with xr.open_dataset(input_file) as ds:
+            calendar_years.update(ds['time'].dt.year.values.tolist())
+            variables.update(ds.data_vars)
+            x, y = ds['x'].values, ds['y'].values
+    catalogue = [ind for ind in catalogue if ind.variable in variables]
+    if not catalogue:
+        return {}, np.array([], dtype=int), None, None
+    # One more year for the season years of the last November-December days
+    years = np.arange(min(calendar_years), max(calendar_years) + 2)
+    shape = (len(years), len(y), len(x))
+    seasons = {ind.season for ind in catalogue}
+
+    totals = {}
+    for ind in catalogue:
+        if ind.reduction == 'max_spell':
+            totals[ind.name] = SpellCounter(len(years), shape[1:])
+        else:
+            totals[ind.name] = np.zeros(shape, dtype='int16' if ind.reduction in DAY_COUNTS else 'float64')
+    valid = {(ind.variable, ind.season): np.zeros(shape, dtype='int16') for ind in catalogue}
+
+    last_day = {}
+    for input_file in input_files:
+        with xr.open_dataset(input_file) as ds:
+            file_variables = sorted({ind.variable for ind in catalogue if ind.variable in ds})
+            times = ds['time'].values
+            months = ds['time'].dt.month.values
+            year_index = {season: season_year_index(years, ds['time'].dt.year.values, months, season)
+                          for season in seasons}
+            in_season = {season: np.isin(months, season) if season else np.ones(len(months), bool)
+                         for season in seasons}
+            for var in file_variables:
+                # A gap in the dates closes the spells in progress
+                if var in last_day and times[0] - last_day[var] != np.timedelta64(1, 'D'):
+                    for ind in catalogue:
+                        if ind.variable == var and ind.reduction == 'max_spell':
+                            totals[ind.name].flush()
+                last_day[var] = times[-1]
+
+            n_time = len(times)
+            for start in range(0, n_time, chunk_days):
+                stop = min(start + chunk_days, n_time)
+                segments = {season: _year_segments(year_index[season], start, stop) for season in seasons}
+                for var in file_variables:
+                    block = ds[var].isel(time=slice(start, stop)).values
+                    present = ~np.isnan(block)
+                    for (valid_var, season), count in valid.items():
+                        if valid_var == var:
+                            days = in_season[season][start:stop]
+                            for iy, seg in segments[season]:
+                                count[iy] += present[seg][days[seg]].sum(axis=0, dtype='int16')
+                    for ind in catalogue:
+                        if ind.variable != var:
+                            continue
+                        values = daily_values(ind, block)
+                        # Days outside the season add nothing (and break the spells)
+                        values[~in_season[ind.season][start:stop]] = 0
+                        if ind.reduction == 'max_spell':
+                            totals[ind.name].add(values, year_index[ind.season][start:stop])
+                        else:
+                            for iy, seg in segments[ind.season]:
+                                totals[ind.name][iy] += values[seg].sum(axis=0, dtype=totals[ind.name].dtype)
+
+    results = {}
+    for ind in catalogue:
+        total = totals[ind.name]
+        if ind.reduction == 'max_spell':
+            total.flush()
+            total = total.max_spell
+        values = total.astype(float)
+        values[valid[(ind.variable, ind.season)] == 0] = np.nan
+        results[ind.name] = values
+    return results, years, x, y
+
+
+def process_files(input_files, catalogue=CATALOGUE, output_dir='.', chunk_days=CHUNK_DAYS, overwrite=True):
+    """Evaluate the catalogue over `input_files` and write the years of each file, one NetCDF per indicator.
+
+    Each file gets its calendar years, with the values of the season years for seasons over
+    the new year. With overwrite=False, indicators whose outputs all exist are skipped.
+    """
+    file_info = {}
+    for input_file in input_files:
+        with xr.open_dataset(input_file) as ds:
+            file_info[input_file] = (set(ds.data_vars), np.unique(ds['time'].dt.year.values))
+    if not overwrite:
+        catalogue = [ind for ind in catalogue
+                     if not all(os.path.exists(output_path(ind, f, output_dir))
+                                for f, (variables, _) in file_info.items() if ind.variable in variables)]
+        if not catalogue:
+            return []
+
+    results, years, x, y = compute_files(input_files, catalogue, chunk_days)
+    written = []
+    for input_file, (variables, file_years) in file_info.items():
+        keep = np.searchsorted(years, file_years)
+        for ind in catalogue:
+            if ind.name not in results or ind.variable not in variables:
+                continue
+            ds_output = xr.Dataset({ind.name: (['year', 'y', 'x'], results[ind.name][keep])},
+                                   coords={'year': file_years.astype(int), 'y': y, 'x': x})
+            ds_output[ind.name].attrs.update(long_name=ind.long_name, units=ind.units,
+                                             threshold=f'{ind.threshold}K', reduction=ind.reduction)
+            ds_output['year'].attrs['long_name'] = 'year'
+            if ind.season:
+                ds_output[ind.name].attrs['season_months'] = ','.join(str(m) for m in ind.season)
+                if wraps(ind.season):
+                    ds_output['year'].attrs['long_name'] = 'season year (year of the end of the season)'
+            path = output_path(ind, input_file, output_dir)
+            encoding = count_encoding([ind.name]) if ind.reduction in DAY_COUNTS else {ind.name: {'dtype': 'float32'}}
+            atomic_to_netcdf(ds_output, path, encoding=encoding)
+            written.append(path)
+    return written
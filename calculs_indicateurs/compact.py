@@ -0,0 +1,138 @@
+#Compact memory-mapped indicator cubes: int16 day counts, a fill value and a validity bitmap
+#
+#   python -m calculs_indicateurs.compact freezing_days tropical_days
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+import xarray as xr
+
+from calculs_indicateurs.indicator_store import DATA_FOLDERS, is_current_export, open_indicator, record_export
+from calculs_indicateurs.storage import COUNT_DTYPE, FILL_VALUE
+
+
+def compact_path(name, data_folder=None):
+    data_folder = data_folder or DATA_FOLDERS[name]
+    return os.path.join(data_folder, f'{name}_per_year.compact')
+
+
+def write_compact(da, path):
+    """Write a (year, y, x) day-count DataArray as counts.npy, valid.npy and meta.json.
+
+    counts.npy holds the int16 counts (FILL_VALUE where there is no data) and
+    valid.npy the validity of each (y, x) cell of each year, packed 8 cells per byte.
+    """
+    values = np.asarray(da.values, dtype='float64')
+    valid = ~np.isnan(values)
+    counts = np.where(valid, values, FILL_VALUE).astype(COUNT_DTYPE)
+    bitmap = np.packbits(valid.reshape(len(values), -1), axis=1)
+    lead, y_dim, x_dim = da.dims
+    meta = {
+        'name': da.name,
+        'dims': [lead, y_dim, x_dim],
+        'shape': list(values.shape),
+        'fill_value': FILL_VALUE,
+        lead: da[lead].values.tolist(),
+        y_dim: da[y_dim].values.tolist(),
+        x_dim: da[x_dim].values.tolist(),
+        'attrs': {k: str(v) for k, v in da.attrs.items()},
+    }
+
+    tmp_path = f'{path}.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, 'counts.npy'), counts)
+    np.save(os.path.join(tmp_path, 'valid.npy'), bitmap)
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    return path
+
+
+class CompactCube:
+    """Memory-mapped view of a compact indicator cube.
+
+    `counts` is the on-disk int16 array itself (np.load with mmap_mode='r'): indexing
+    a year or a cell reads only those bytes and copies nothing. The validity of a
+    slice is unpacked from the bitmap on demand.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.counts = np.load(os.path.join(path, 'counts.npy'), mmap_mode='r')
+        self.bitmap = np.load(os.path.join(path, 'valid.npy'), mmap_mode='r')
+        self.name = self.meta['name']
+        self.dims = self.meta['dims']
+        self.fill_value = self.meta['fill_value']
+
+    def __len__(self):
+        return len(self.counts)
+
+    def coord(self, dim):
+        return np.asarray(self.meta[dim])
+
+    @property
+    def years(self):
+        return self.coord(self.dims[0])
+
+    @property
+    def y(self):
+        return self.coord(self.dims[1])
+
+    @property
+    def x(self):
+        return self.coord(self.dims[2])
+
+    def valid(self, index=slice(None)):
+        """Boolean validity of the years `index` (an int gives one (y, x) map)."""
+        shape = self.counts.shape[1:]
+        bits = np.unpackbits(self.bitmap[index], axis=-1, count=int(np.prod(shape)))
+        return bits.reshape(bits.shape[:-1] + shape).astype(bool)
+
+    def masked(self, index=slice(None)):
+        """Masked array over the memory-mapped counts (no copy of the data)."""
+        return np.ma.MaskedArray(self.counts[index], mask=~self.valid(index))
+
+    def to_dataarray(self, dtype='float32'):
+        """In-memory DataArray with NaN for missing data, for xarray-based consumers."""
+        values = self.masked().astype(dtype).filled(np.nan)
+        return xr.DataArray(values, dims=self.dims, name=self.name, attrs=self.meta['attrs'],
+                            coords={dim: self.coord(dim) for dim in self.dims})
+
+
+def export_compact(name, data_folder=None):
+    """Write the compact cube of an indicator from its Zarr store (or per-year NetCDF files).
+
+    The cube is recorded with the hashes of the NetCDF files in the manifest of the data folder.
+    """
+    da = open_indicator(name, access='map', data_folder=data_folder).load()
+    path = write_compact(da, compact_path(name, data_folder))
+    record_export(name, path, 'compact', data_folder)
+    return path
+
+
+def open_compact(name, data_folder=None):
+    """Memory-map the compact cube of an indicator, exported again when the per-year files changed."""
+    path = compact_path(name, data_folder)
+    if not is_current_export(name, path, 'compact', data_folder):
+        export_compact(name, data_folder)
+    return CompactCube(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export the indicator cubes to the compact int16 format')
+    parser.add_argument('names', nargs='+', choices=sorted(DATA_FOLDERS))
+    args = parser.parse_args(argv)
+    for name in args.names:
+        print(f"Written {export_compact(name)}")
+
+
+if __name__ == '__main__':
+    main()
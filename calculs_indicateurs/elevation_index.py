@@ -0,0 +1,153 @@
+#Grid cells sorted by elevation, with elevation bands, shared by the altitude indicators
+import hashlib
+import os
+
+import numpy as np
+import xarray as xr
+
+from calculs_indicateurs.altitude_stats import elevation_order
+from calculs_indicateurs.manifest import HASH_BLOCK
+from calculs_indicateurs.storage import atomic_path
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ELEVATION_FILE = os.path.join(REPO_ROOT, 'Alpes_grid_ESM2.nc')
+BAND_WIDTH = 100
+
+
+class ElevationIndex:
+    """Valid grid cells sorted by elevation, split into contiguous elevation bands.
+
+    `order` holds the flat (y*x) indices of the cells by increasing elevation and
+    `band_start` the position in `order` of the first cell of each band, so any
+    per-band reduction is a reduceat over contiguous slices of the sorted cells.
+    """
+
+    def __init__(self, shape, order, sorted_elevation, band_edges, band_start):
+        self.shape = tuple(int(n) for n in shape)
+        self.order = order
+        self.sorted_elevation = sorted_elevation
+        self.band_edges = band_edges
+        self.band_start = band_start
+
+    @classmethod
+    def build(cls, elevation, band_width=BAND_WIDTH):
+        elevation = np.asarray(elevation, dtype='float64')
+        order, sorted_elevation = elevation_order(elevation)
+        low = np.floor(sorted_elevation[0] / band_width) * band_width
+        high = (np.floor(sorted_elevation[-1] / band_width) + 1) * band_width
+        band_edges = np.arange(low, high + band_width / 2, band_width)
+        band_start = np.searchsorted(sorted_elevation, band_edges[:-1], side='left')
+        return cls(elevation.shape, order, sorted_elevation, band_edges, band_start)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['shape'], data['order'], data['sorted_elevation'],
+                       data['band_edges'], data['band_start'])
+
+    def save(self, path):
+        """Write the index next to `path` and rename it in place: a concurrent load never sees a partial file."""
+        tmp_path = atomic_path(path)
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, shape=np.array(self.shape), order=self.order,
+                     sorted_elevation=self.sorted_elevation,
+                     band_edges=self.band_edges, band_start=self.band_start)
+        os.replace(tmp_path, path)
+        return path
+
+    @property
+    def band_centers(self):
+        return 0.5 * (self.band_edges[:-1] + self.band_edges[1:])
+
+    def _sorted(self, values):
+        """(..., y, x) array -> (n, cells) array in elevation order."""
+        values = np.asarray(values)
+        values = values.reshape((-1, self.shape[0] * self.shape[1]))
+        return values[:, self.order]
+
+    def quantiles(self, mask, q):
+        """Elevation quantiles `q` of the True cells of each (y, x) slice of `mask`.
+
+        The hits of each slice are read in elevation order, so a quantile is the
+        (interpolated) value at a rank given by the cumulative hit count.
+        Returns an array (len(q), n) (NaN where no cell is True).
+        """
+        q = np.atleast_1d(np.asarray(q, dtype='float64'))
+        hits = self._sorted(mask).astype(bool)
+        rows, cells = np.nonzero(hits)
+        count = np.bincount(rows, minlength=len(hits))
+        first = np.cumsum(count) - count
+
+        result = np.full((len(q), len(hits)), np.nan)
+        has = count > 0
+        for i, qi in enumerate(q):
+            rank = qi * (count[has] - 1)
+            lo = np.floor(rank).astype(int)
+            hi = np.ceil(rank).astype(int)
+            low_value = self.sorted_elevation[cells[first[has] + lo]]
+            high_value = self.sorted_elevation[cells[first[has] + hi]]
+            result[i, has] = low_value + (rank - lo) * (high_value - low_value)
+        return result
+
+    def _reduce_bands(self, values):
+        """Sum of the sorted `values` over each band (0 for bands without cells)."""
+        sums = np.add.reduceat(values, self.band_start, axis=1)
+        band_size = np.diff(np.append(self.band_start, len(self.order)))
+        sums[:, band_size == 0] = 0
+        return sums
+
+    def band_counts(self, mask):
+        """Number of True cells per elevation band, for each (y, x) slice: (n, bands)."""
+        return self._reduce_bands(self._sorted(mask).astype('int32'))
+
+    def band_means(self, values):
+        """NaN-aware mean of `values` per elevation band, for each (y, x) slice: (n, bands)."""
+        values = self._sorted(values).astype('float64')
+        present = ~np.isnan(values)
+        total = self._reduce_bands(np.where(present, values, 0.0))
+        count = self._reduce_bands(present.astype('int32'))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, total / count, np.nan)
+
+    def band_series(self, da, reduction='mean'):
+        """Per-band time series of a (year, y, x) indicator, e.g. freezing days per 100 m band."""
+        func = self.band_means if reduction == 'mean' else self.band_counts
+        values = func(da.values)
+        lead = da.dims[0]
+        return xr.DataArray(values, dims=(lead, 'elevation_band'),
+                            coords={lead: da[lead].values, 'elevation_band': self.band_centers},
+                            name=da.name)
+
+
+def index_path(elevation_file=ELEVATION_FILE, band_width=BAND_WIDTH):
+    digest = hashlib.sha1()
+    with open(elevation_file, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    digest = digest.hexdigest()[:16]
+    root = os.path.splitext(elevation_file)[0]
+    return f"{root}_index_{band_width}m_{digest}.npz"
+
+
+def get_index(elevation_file=ELEVATION_FILE, band_width=BAND_WIDTH):
+    """Load the elevation index of `elevation_file`, building and saving it the first time."""
+    path = index_path(elevation_file, band_width)
+    if os.path.exists(path):
+        return ElevationIndex.load(path)
+    with xr.open_dataset(elevation_file) as ds_topo:
+        index = ElevationIndex.build(ds_topo['elevation'].values, band_width)
+    index.save(path)
+    return index
+
+
+def export_band_curves(da, index, output_file):
+    """Write the per-band series of `da` as a long CSV (year, band_min, band_max, value)."""
+    series = index.band_series(da)
+    lead = da.dims[0]
+    df = series.to_dataframe(name='value').reset_index()
+    half = (index.band_edges[1] - index.band_edges[0]) / 2
+    df['band_min'] = df['elevation_band'] - half
+    df['band_max'] = df['elevation_band'] + half
+    df = df[[lead, 'band_min', 'band_max', 'value']]
+    df.to_csv(output_file, index=False)
+    return df
@@ -0,0 +1,343 @@
+#Ensemble mode: every GCM/RCM/scenario member through the pipeline stages, reduced across members
+#
+#   python -m calculs_indicateurs.ensemble 'tasAdjust_FR-Metro_*.nc' 'tasminAdjust_FR-Metro_*.nc' \
+#       --output-dir ensemble --workers 8 --memory-per-worker 4GB
+#
+# Layout: <output-dir>/runs/<model>_<experiment>/    Alpine files, per-year indicators, daily altitude statistics
+#         <output-dir>/<scenario>/<indicator>_ensemble.nc          (year, y, x): mean, spread, p10, p50, p90
+#         <output-dir>/<scenario>/<indicator>_ensemble_periods.nc  (period, y, x): same, of the period means
+#         <output-dir>/<scenario>/<stage>_ensemble_stats.csv       per period: <stat>_mean, <stat>_p10, ...
+import argparse
+import os
+import re
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from calculs_indicateurs import alpes_mask, indicators
+from calculs_indicateurs.altitude_stats import (CHUNK_DAYS, PERIODS, STATS, above_threshold,
+                                                daily_elevation_stats, near_threshold, period_means)
+from calculs_indicateurs.elevation_index import ELEVATION_FILE, get_index
+from calculs_indicateurs.hyperslab import opened_readers, season_columns
+from calculs_indicateurs.indicator_store import netcdf_files, open_netcdf
+from calculs_indicateurs.periods import ANOMALY_PERIODS, REFERENCE, PeriodAggregator
+from calculs_indicateurs.run_pipeline import days_per_block, expand, max_workers
+from calculs_indicateurs.seasons import select_period
+from calculs_indicateurs.storage import atomic_path, atomic_to_netcdf, parse_size
+
+# '<variable>_<domain>_<gcm>_<experiment>_<member>_<institute>_<rcm>_..._<frequency>_<YYYYMMDD-YYYYMMDD>.nc'
+FILE_NAME = re.compile(r'^(?P<variable>[A-Za-z]+)_(?P<run>.+)_(?P<frequency>[a-z]+)_(?P<dates>\d{8}-\d{8})\.nc$')
+EXPERIMENT = re.compile(r'^(historical|ssp\d{3}|rcp\d{2})$')
+
+# Altitude statistics of every member, as the averaged statistics CSVs of the ridge scripts
+ALTITUDE_STAGES = {
+    'isotherme_0': {'variable': 'tasAdjust', 'season': 'DJF', 'threshold': 273.15, 'buffer': 0.5},
+    'tropical': {'variable': 'tasminAdjust', 'season': 'JJA', 'threshold': 293.15, 'buffer': None},
+}
+ENSEMBLE_PERIODS = [REFERENCE] + ANOMALY_PERIODS
+PERCENTILES = (10, 50, 90)
+
+# Model chain (GCM, RCM, bias adjustment...) and experiment of a set of files
+Run = namedtuple('Run', ['model', 'experiment'])
+# Model chain under one scenario: its historical run followed by its scenario run
+Member = namedtuple('Member', ['model', 'scenario'])
+
+
+def run_id(run):
+    return f'{run.model}_{run.experiment}'
+
+
+def member_id(member):
+    return f'{member.model}_{member.scenario}'
+
+
+def parse_file(input_file):
+    """(variable, model chain, experiment) of a model output file name ('run' without experiment)."""
+    match = FILE_NAME.match(os.path.basename(input_file))
+    if match is None:
+        raise ValueError(f"Unexpected file name: {input_file}")
+    tokens = match['run'].split('_')
+    experiments = [token for token in tokens if EXPERIMENT.match(token)]
+    experiment = experiments[0] if experiments else 'run'
+    model = '_'.join(token for token in tokens if token != experiment)
+    return match['variable'], model, experiment
+
+
+def discover(patterns):
+    """Runs {Run: input files} of the files matching `patterns`, and members {Member: [Run]}.
+
+    The historical run of a model chain is processed once and shared by all its
+    scenarios, so each member covers the whole 1990-2100 range. A historical run
+    without any scenario is a member of its own.
+    """
+    runs = defaultdict(list)
+    for input_file in expand(patterns):
+        _, model, experiment = parse_file(input_file)
+        runs[Run(model, experiment)].append(input_file)
+    runs = {run: sorted(files) for run, files in sorted(runs.items())}
+
+    members = {}
+    for run in runs:
+        if run.experiment != 'historical':
+            history = [r for r in runs if r == Run(run.model, 'historical')]
+            members[Member(run.model, run.experiment)] = history + [run]
+    for run in runs:
+        if run.experiment == 'historical' and not any(m.model == run.model for m in members):
+            members[Member(run.model, 'historical')] = [run]
+    return runs, dict(sorted(members.items()))
+
+
+# -----------------------------
+# Per-run stages
+# -----------------------------
+def season_daily_stats(readers, variable, season, condition, index, chunk_days=CHUNK_DAYS):
+    """Daily elevation statistics of the season days, read as hyperslabs from the open files."""
+    def block_stats(block):
+        return daily_elevation_stats(condition(block), index.order, index.sorted_elevation)
+
+    columns, dates, season_years = season_columns(readers, variable, season, block_stats, chunk_days)
+    return xr.Dataset({name: ('time', columns[name]) for name in STATS},
+                      coords={'time': dates, 'season_year': ('time', season_years)})
+
+
+def stage_condition(params):
+    if params['buffer'] is None:
+        return above_threshold(params['threshold'])
+    return near_threshold(params['threshold'], params['buffer'])
+
+
+def altitude_path(stage, run_dir):
+    return os.path.join(run_dir, f'{stage}_daily_altitude.nc')
+
+
+def run_stages(input_files, run_dir, memory_per_worker, elevation_file=ELEVATION_FILE,
+               stages=ALTITUDE_STAGES):
+    """Alpine selection, indicators and daily altitude statistics of one run (existing outputs kept)."""
+    os.makedirs(run_dir, exist_ok=True)
+    selected = []
+    for input_file in input_files:
+        output_file = alpes_mask.output_path(input_file, run_dir)
+        if not os.path.exists(output_file):
+            alpes_mask.select_file(input_file, run_dir,
+                                   time_chunk=days_per_block(input_file, memory_per_worker))
+        selected.append(output_file)
+
+    for input_file in selected:
+        indicators.process_file(input_file, output_dir=run_dir, overwrite=False,
+                                chunk_days=days_per_block(input_file, memory_per_worker))
+
+    stages = {stage: params for stage, params in stages.items()
+              if not os.path.exists(altitude_path(stage, run_dir))}
+    if os.path.exists(elevation_file) and stages:
+        index = get_index(elevation_file)
+        # One handle per file, shared by every stage (and season) reading it
+        with opened_readers(selected) as readers:
+            for stage, params in stages.items():
+                if not any(params['variable'] in reader for reader in readers):
+                    continue
+                daily_stats = season_daily_stats(readers, params['variable'], params['season'],
+                                                 stage_condition(params), index)
+                atomic_to_netcdf(daily_stats, altitude_path(stage, run_dir))
+    return run_dir
+
+
+# -----------------------------
+# Reductions across members
+# -----------------------------
+class EnsembleReducer:
+    """Streaming mean and spread across members, one member at a time.
+
+    Mean and spread (sample std) use Welford's update, NaN-aware per cell. The members
+    are also appended to an on-disk float32 stack (memory-mapped .npy), from which the
+    percentiles are taken one slab of the first axis at a time, so no more than one
+    member, or one slab of every member, is in memory.
+    """
+
+    def __init__(self, shape, n_members, stack_path):
+        self.shape = tuple(shape)
+        self.count = np.zeros(self.shape, dtype='int32')
+        self.mean = np.zeros(self.shape)
+        self.m2 = np.zeros(self.shape)
+        self.stack_path = stack_path
+        self.stack = np.lib.format.open_memmap(stack_path, mode='w+', dtype='float32',
+                                               shape=(n_members,) + self.shape)
+        self.n = 0
+
+    def add(self, values):
+        values = np.asarray(values, dtype='float64')
+        present = ~np.isnan(values)
+        self.count += present
+        delta = np.where(present, values - self.mean, 0.0)
+        self.mean += delta / np.maximum(self.count, 1)
+        self.m2 += np.where(present, delta * (values - self.mean), 0.0)
+        self.stack[self.n] = values
+        self.n += 1
+
+    def result(self, percentiles=PERCENTILES):
+        """{'mean', 'spread', 'p10', ...: arrays of `shape`, 'members': valid member count}."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = {'mean': np.where(self.count > 0, self.mean, np.nan),
+                      'spread': np.where(self.count > 1, np.sqrt(self.m2 / (self.count - 1)), np.nan)}
+        slabs = np.full((len(percentiles),) + self.shape, np.nan)
+        for i in range(self.shape[0]):
+            slab = np.asarray(self.stack[:self.n, i], dtype='float64')
+            has = (~np.isnan(slab)).any(axis=0)
+            slabs[:, i][:, has] = np.nanpercentile(slab[:, has], percentiles, axis=0)
+        for q, values in zip(percentiles, slabs):
+            result[f'p{q}'] = values
+        result['members'] = self.count
+        return result
+
+    def close(self):
+        del self.stack
+        os.remove(self.stack_path)
+
+
+def _dataset(result, dims, coords, attrs):
+    ds = xr.Dataset({key: (dims, values) for key, values in result.items()}, coords=coords, attrs=attrs)
+    ds['spread'].attrs['long_name'] = 'Standard deviation across members'
+    return ds
+
+
+def reduce_indicator(name, members, scenario_dir, periods=ENSEMBLE_PERIODS, percentiles=PERCENTILES):
+    """Ensemble statistics of the per-year cubes and of the period means of an indicator.
+
+    `members` maps each member id to its run directories (historical and scenario).
+    """
+    files = {member: [f for run_dir in run_dirs for f in netcdf_files(name, run_dir)]
+             for member, run_dirs in members.items()}
+    files = {member: member_files for member, member_files in files.items() if member_files}
+    if not files:
+        return []
+    years = set()
+    for member_files in files.values():
+        with open_netcdf(name, input_files=member_files) as ds:
+            years.update(ds['year'].values.tolist())
+            y, x = ds['y'].values, ds['x'].values
+    years = np.array(sorted(years))
+
+    shape = (len(years), len(y), len(x))
+    cube = EnsembleReducer(shape, len(files), os.path.join(scenario_dir, f'.{name}_stack.npy'))
+    period = EnsembleReducer((len(periods), len(y), len(x)), len(files),
+                             os.path.join(scenario_dir, f'.{name}_periods_stack.npy'))
+    try:
+        for member, member_files in files.items():
+            with open_netcdf(name, input_files=member_files) as ds:
+                da = ds[name].load()
+            if da.shape[1:] != shape[1:]:
+                raise ValueError(f"{member}: grid {da.shape[1:]} differs from {shape[1:]}")
+            values = da.reindex(year=years).values
+            cube.add(values)
+            period.add(PeriodAggregator(values, years).aggregate(periods, 'mean').values)
+
+        attrs = {'indicator': name, 'members': ','.join(files)}
+        outputs = [os.path.join(scenario_dir, f'{name}_ensemble.nc'),
+                   os.path.join(scenario_dir, f'{name}_ensemble_periods.nc')]
+        atomic_to_netcdf(_dataset(cube.result(percentiles), ('year', 'y', 'x'),
+                                  {'year': years, 'y': y, 'x': x}, attrs), outputs[0])
+        atomic_to_netcdf(_dataset(period.result(percentiles), ('period', 'y', 'x'),
+                                  {'period': [p.label for p in periods], 'y': y, 'x': x}, attrs), outputs[1])
+        return outputs
+    finally:
+        cube.close()
+        period.close()
+
+
+def reduce_altitude(stage, members, scenario_dir, percentiles=PERCENTILES):
+    """Ensemble statistics of the per-period altitude statistics: <stat>_<mean|spread|pXX> columns.
+
+    The period means of a member are taken over the daily statistics of all its runs,
+    so a period spanning the historical/scenario boundary uses both.
+    """
+    labels = [label for label, _, _ in PERIODS]
+    member_files = {member: [altitude_path(stage, d) for d in run_dirs if os.path.exists(altitude_path(stage, d))]
+                    for member, run_dirs in members.items()}
+    member_files = {member: files for member, files in member_files.items() if files}
+    if not member_files:
+        return None
+    reducer = EnsembleReducer((len(labels), len(STATS)), len(member_files),
+                              os.path.join(scenario_dir, f'.{stage}_stack.npy'))
+    try:
+        for files in member_files.values():
+            daily = [xr.open_dataset(f) for f in files]
+            try:
+                daily_stats = xr.concat(daily, dim='time').sortby('time')
+                periods = [p for p in PERIODS if select_period(daily_stats, p[1], p[2]).sizes['time'] > 0]
+                stats = period_means(daily_stats, periods)
+            finally:
+                for ds in daily:
+                    ds.close()
+            reducer.add(stats.reindex(index=labels, columns=STATS).values.astype('float64'))
+        result = reducer.result(percentiles)
+    finally:
+        reducer.close()
+
+    columns = {f'{stat}_{key}': values[:, j] for key, values in result.items() for j, stat in enumerate(STATS)}
+    df = pd.DataFrame(columns, index=labels)
+    df = df[df[[f'{stat}_members' for stat in STATS]].max(axis=1) > 0]
+    output_file = os.path.join(scenario_dir, f'{stage}_ensemble_stats.csv')
+    tmp_path = atomic_path(output_file)
+    df.to_csv(tmp_path)
+    os.replace(tmp_path, output_file)
+    return output_file
+
+
+def run_ensemble(patterns, output_dir='ensemble', workers=os.cpu_count(), memory_per_worker='4GB',
+                 elevation_file=ELEVATION_FILE):
+    """Run the stages of every run in a process pool, then reduce the members of each scenario."""
+    runs, members = discover(patterns)
+    print(f"Found {len(members)} members: {', '.join(member_id(m) for m in members)}")
+    if not members:
+        return {}
+    memory_per_worker = parse_size(memory_per_worker)
+    workers = max(1, min(max_workers(workers, memory_per_worker), len(runs)))
+
+    # Build the grid mask and the elevation index once, before the workers need them
+    with xr.open_dataset(next(iter(runs.values()))[0]) as ds:
+        alpes_mask.get_alpine_mask(ds)
+    get_index(elevation_file)
+
+    run_dirs = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_stages, files, os.path.join(output_dir, 'runs', run_id(run)),
+                               memory_per_worker, elevation_file): run
+                   for run, files in runs.items()}
+        for future in as_completed(futures):
+            run = futures[future]
+            run_dirs[run] = future.result()
+            print(f"{run_id(run)}: done")
+
+    outputs = {}
+    for scenario in sorted({m.scenario for m in members}):
+        scenario_dir = os.path.join(output_dir, scenario)
+        os.makedirs(scenario_dir, exist_ok=True)
+        scenario_members = {member_id(m): [run_dirs[run] for run in member_runs]
+                            for m, member_runs in members.items() if m.scenario == scenario}
+        written = []
+        for ind in indicators.INDICATORS:
+            written += reduce_indicator(ind.name, scenario_members, scenario_dir)
+        for stage in ALTITUDE_STAGES:
+            csv_file = reduce_altitude(stage, scenario_members, scenario_dir)
+            if csv_file:
+                written.append(csv_file)
+        outputs[scenario] = written
+        print(f"{scenario} ({len(scenario_members)} members): {', '.join(written)}")
+    return outputs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Ensemble of model chains and scenarios')
+    parser.add_argument('patterns', nargs='+', help='glob patterns of the model output files')
+    parser.add_argument('--output-dir', default='ensemble')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--memory-per-worker', default='4GB', help="e.g. 512MB, 4GB")
+    parser.add_argument('--elevation-file', default=ELEVATION_FILE)
+    args = parser.parse_args(argv)
+    run_ensemble(args.patterns, args.output_dir, args.workers, args.memory_per_worker, args.elevation_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#Season slabs read straight from the NetCDF files: contiguous (time range, Alpine box) hyperslabs, one handle per file
+import os
+from contextlib import contextmanager
+
+import cftime
+import netCDF4
+import numpy as np
+import xarray as xr
+
+from calculs_indicateurs.alpes_mask import MASK_DIR, get_alpine_mask, subset_bounds
+from calculs_indicateurs.seasons import file_season_ranges
+
+
+def alpine_box(input_file, mask_dir=MASK_DIR):
+    """(y slice, x slice) bounding box of the Alpine mask and the mask cropped to it.
+
+    The bounds are those of the Alpine selection (subset_bounds: valid_y, valid_x), so a
+    full FR-Metro file read through the box gives the cells of the *_alpes_day_* files.
+    """
+    with xr.open_dataset(input_file) as ds:
+        mask = get_alpine_mask(ds, mask_dir=mask_dir)
+    valid_y, valid_x = subset_bounds(mask)
+    box = (slice(int(valid_y.min()), int(valid_y.max()) + 1), slice(int(valid_x.min()), int(valid_x.max()) + 1))
+    return box, mask.values[box]
+
+
+def decode_times(values, units, calendar):
+    """datetime64 dates of CF time values (cftime dates for non-standard calendars)."""
+    try:
+        dates = cftime.num2date(values, units, calendar, only_use_cftime_datetimes=False,
+                                only_use_python_datetimes=True)
+        return np.array(dates, dtype='datetime64[ns]')
+    except ValueError:
+        return cftime.num2date(values, units, calendar)
+
+
+class SlabReader:
+    """netCDF4 handle on one daily file, reading hyperslabs of the season days.
+
+    Every read is one contiguous [start:stop, y box, x box] slab; cells outside `mask`
+    (if given, cropped to the box) and fill values come back as NaN. The handle stays open
+    across variables and seasons; `bytes_read` counts the data read.
+    """
+
+    def __init__(self, input_file, box=None, mask=None):
+        self.input_file = input_file
+        self.nc = netCDF4.Dataset(input_file)
+        self.box = box or (slice(None), slice(None))
+        self.outside = None if mask is None else ~np.asarray(mask, dtype=bool)
+        self.bytes_read = 0
+        time = self.nc.variables['time']
+        self._time = (np.ma.getdata(time[:]), time.units, getattr(time, 'calendar', 'standard'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.nc.close()
+
+    def __contains__(self, variable):
+        return variable in self.nc.variables
+
+    def times(self, start, stop):
+        values, units, calendar = self._time
+        return decode_times(values[start:stop], units, calendar)
+
+    def read(self, variable, start, stop):
+        """(time, y, x) float array of the days [start, stop) inside the box."""
+        block = self.nc.variables[variable][start:stop, self.box[0], self.box[1]]
+        self.bytes_read += block.nbytes
+        block = np.ma.filled(block.astype('float32'), np.nan)
+        if self.outside is not None:
+            block[:, self.outside] = np.nan
+        return block
+
+    def season_blocks(self, variable, season, chunk_days):
+        """(season year, dates, block) of the `season` days, at most `chunk_days` days per block."""
+        for r in file_season_ranges(self.input_file, season):
+            for start in range(r.start, r.stop, chunk_days):
+                stop = min(start + chunk_days, r.stop)
+                yield r.year, self.times(start, stop), self.read(variable, start, stop)
+
+
+def close_readers(readers):
+    for reader in readers:
+        reader.close()
+
+
+def open_readers(input_files, mask_dir=MASK_DIR):
+    """One SlabReader per file; files not yet cropped (not *_alpes_*) are read through the Alpine box.
+
+    If a file fails to open, the handles already opened are closed before the error is raised.
+    """
+    readers = []
+    try:
+        for input_file in input_files:
+            if os.path.basename(input_file).split('_')[1] == 'alpes':
+                readers.append(SlabReader(input_file))
+            else:
+                box, mask = alpine_box(input_file, mask_dir)
+                readers.append(SlabReader(input_file, box, mask))
+    except Exception:
+        close_readers(readers)
+        raise
+    return readers
+
+
+@contextmanager
+def opened_readers(input_files, mask_dir=MASK_DIR):
+    """open_readers for a `with` block: every handle is closed on exit."""
+    readers = open_readers(input_files, mask_dir)
+    try:
+        yield readers
+    finally:
+        close_readers(readers)
+
+
+def season_columns(readers, variable, season, block_stats, chunk_days):
+    """Concatenated `block_stats(block)` columns of the season days of all readers holding `variable`.
+
+    Returns ({name: (day, ...) array}, dates, season years).
+    """
+    columns = {}
+    dates = []
+    season_years = []
+    for reader in readers:
+        if variable not in reader:
+            continue
+        for year, block_dates, block in reader.season_blocks(variable, season, chunk_days):
+            for name, values in block_stats(block).items():
+                columns.setdefault(name, []).append(values)
+            dates.append(block_dates)
+            season_years.append(np.full(len(block_dates), year))
+    return ({name: np.concatenate(values) for name, values in columns.items()},
+            np.concatenate(dates), np.concatenate(season_years))
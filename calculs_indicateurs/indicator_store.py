@@ -0,0 +1,136 @@
+#Single consolidated Zarr store per indicator, replacing the glob + concat of the per-year NetCDF files
+#
+#   python -m calculs_indicateurs.indicator_store freezing_days tropical_days
+import argparse
+import os
+import shutil
+from glob import glob
+
+import xarray as xr
+
+from calculs_indicateurs.manifest import MANIFEST_NAME, Manifest
+from calculs_indicateurs.storage import count_encoding
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Folder of the per-year NetCDF files of each indicator
+DATA_FOLDERS = {
+    'freezing_days': os.path.join(REPO_ROOT, 'Isotherme0_data'),
+    'tropical_days': os.path.join(REPO_ROOT, 'Tropical_data'),
+}
+
+# Spatial tile of the time-series copy (all years of 32 x 32 cells per chunk)
+TILE = 32
+
+
+def netcdf_files(name, data_folder=None):
+    data_folder = data_folder or DATA_FOLDERS[name]
+    return sorted(glob(os.path.join(data_folder, f'{name}_per_year_*.nc')))
+
+
+def store_path(name, data_folder=None):
+    data_folder = data_folder or DATA_FOLDERS[name]
+    return os.path.join(data_folder, f'{name}_per_year.zarr')
+
+
+def series_name(name):
+    return f'{name}_series'
+
+
+def data_manifest(name, data_folder=None):
+    return Manifest(os.path.join(data_folder or DATA_FOLDERS[name], MANIFEST_NAME))
+
+
+def export_params(name, export_format):
+    return {'indicator': name, 'format': export_format}
+
+
+def is_current_export(name, path, export_format, data_folder=None):
+    """True when the export at `path` was written from the current per-year NetCDF files.
+
+    Without any NetCDF file (e.g. only the export was copied), an existing export is used as is.
+    """
+    input_files = netcdf_files(name, data_folder)
+    if not input_files:
+        return os.path.exists(path)
+    return data_manifest(name, data_folder).is_current(path, input_files, export_params(name, export_format))
+
+
+def record_export(name, path, export_format, data_folder=None):
+    """Record in the manifest of the data folder the NetCDF files `path` was exported from."""
+    manifest = data_manifest(name, data_folder)
+    manifest.record(path, netcdf_files(name, data_folder), export_params(name, export_format))
+    manifest.save()
+
+
+def open_netcdf(name, data_folder=None, input_files=None):
+    """(year, y, x) cube of the per-year NetCDF files (those of `data_folder` by default), values in days."""
+    input_files = input_files or netcdf_files(name, data_folder)
+    if not input_files:
+        raise FileNotFoundError(f"No {name}_per_year_*.nc file in {data_folder or DATA_FOLDERS[name]}")
+    # decode_timedelta=False: the 'days' units would otherwise turn the counts into timedeltas
+    return xr.open_mfdataset(input_files, combine='nested', concat_dim='year',
+                             decode_times=False, decode_timedelta=False,
+                             data_vars='minimal', coords='minimal', compat='override')
+
+
+def export_zarr(name, data_folder=None, store=None, tile=TILE):
+    """Write the indicator cube once to a consolidated Zarr store.
+
+    The store holds the cube twice, with two chunk layouts:
+    `name` with one chunk per year (a map reads a single chunk) and
+    `name_series` with all years of `tile` x `tile` cells per chunk (a time
+    series at a point or over a small area reads one or a few chunks).
+    The store is written next to its final path and moved in place at the end, then
+    recorded with the hashes of the NetCDF files in the manifest of the data folder.
+    """
+    store = store or store_path(name, data_folder)
+    with open_netcdf(name, data_folder) as ds:
+        ds = ds.load()
+    da = ds[name]
+    n_years, ny, nx = da.shape
+    out = xr.Dataset({name: da, series_name(name): da.copy()})
+    for var in out.data_vars:
+        out[var].encoding = {}
+    # int16 day counts with a fill value, decoded back to floats with NaN on read
+    encoding = count_encoding([name, series_name(name)])
+    encoding[name]['chunks'] = (1, ny, nx)
+    encoding[series_name(name)]['chunks'] = (n_years, min(tile, ny), min(tile, nx))
+
+    tmp_store = f'{store}.tmp'
+    if os.path.exists(tmp_store):
+        shutil.rmtree(tmp_store)
+    out.to_zarr(tmp_store, mode='w', encoding=encoding, consolidated=True)
+    if os.path.exists(store):
+        shutil.rmtree(store)
+    os.replace(tmp_store, store)
+    record_export(name, store, 'zarr', data_folder)
+    return store
+
+
+def open_indicator(name, access='map', data_folder=None):
+    """Lazy (year, y, x) DataArray of an indicator, in days.
+
+    `access='map'` reads the one-year chunks (maps, animations), `access='series'`
+    the all-years spatial tiles (time series, trends). Falls back to the per-year
+    NetCDF files when the Zarr store has not been exported, or was exported from
+    files that have changed since (manifest of the data folder).
+    """
+    store = store_path(name, data_folder)
+    if not is_current_export(name, store, 'zarr', data_folder):
+        return open_netcdf(name, data_folder)[name]
+    ds = xr.open_zarr(store, consolidated=True, decode_timedelta=False)
+    var = series_name(name) if access == 'series' else name
+    return ds[var].rename(name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export the per-year indicator files to Zarr stores')
+    parser.add_argument('names', nargs='+', choices=sorted(DATA_FOLDERS))
+    args = parser.parse_args(argv)
+    for name in args.names:
+        print(f"Written {export_zarr(name)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#Count, per year, the days above/below a threshold for several indicators in one read
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import xarray as xr
+
+from calculs_indicateurs.storage import atomic_to_netcdf, count_encoding
+
+COMPARISONS = {
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+}
+
+
+@dataclass(frozen=True)
+class Indicator:
+    name: str
+    variable: str
+    comparison: str
+    threshold: float
+    long_name: str
+
+    @property
+    def prefix(self):
+        return f"{self.name}_per_year"
+
+
+FREEZING_DAYS = Indicator('freezing_days', 'tasAdjust', '<', 273.15,
+                          'Count of days with temperature below 273.15K')
+TROPICAL_DAYS = Indicator('tropical_days', 'tasminAdjust', '>', 293.15,
+                          'Count of days with min daily temperature above 293.15K')
+
+INDICATORS = [FREEZING_DAYS, TROPICAL_DAYS]
+
+# Days per streamed block: one year keeps the peak memory to a single (time, y, x) slab
+CHUNK_DAYS = 366
+
+
+def date_range(input_file):
+    """'tasAdjust_alpes_day_19900101-19991231.nc' -> '19900101-19991231'"""
+    return os.path.basename(input_file).split('_')[-1].replace('.nc', '')
+
+
+def output_path(indicator, input_file, output_dir='.'):
+    return os.path.join(output_dir, f"{indicator.prefix}_{date_range(input_file)}.nc")
+
+
+def _year_segments(year_index, start, stop):
+    """Contiguous (year position, slice within the block) runs of days of the block."""
+    block_years = year_index[start:stop]
+    edges = np.flatnonzero(np.diff(block_years)) + 1
+    bounds = np.concatenate([[0], edges, [len(block_years)]])
+    return [(block_years[a], slice(a, b)) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def compute_file(input_file, indicators=INDICATORS, chunk_days=CHUNK_DAYS):
+    """Stream one file in time blocks and count all indicators of its variables.
+
+    Each variable is read once per block and shared by every indicator that uses it.
+    Returns a dict {indicator name: per-year Dataset}.
+    """
+    ds = xr.open_dataset(input_file)
+    try:
+        indicators = [ind for ind in indicators if ind.variable in ds]
+        if not indicators:
+            return {}
+        variables = sorted({ind.variable for ind in indicators})
+
+        years = ds['time'].dt.year.values
+        unique_years = np.unique(years)
+        year_index = np.searchsorted(unique_years, years)
+        shape = (len(unique_years),) + ds[variables[0]].shape[1:]
+
+        # Compact per-year accumulators (a year has at most 366 days)
+        counts = {ind.name: np.zeros(shape, dtype='int16') for ind in indicators}
+        valid = {var: np.zeros(shape, dtype='int16') for var in variables}
+
+        n_time = len(years)
+        for start in range(0, n_time, chunk_days):
+            stop = min(start + chunk_days, n_time)
+            segments = _year_segments(year_index, start, stop)
+            for var in variables:
+                block = ds[var].isel(time=slice(start, stop)).values
+                present = ~np.isnan(block)
+                for iy, seg in segments:
+                    valid[var][iy] += present[seg].sum(axis=0, dtype='int16')
+                for ind in indicators:
+                    if ind.variable != var:
+                        continue
+                    hits = COMPARISONS[ind.comparison](block, ind.threshold)
+                    for iy, seg in segments:
+                        counts[ind.name][iy] += hits[seg].sum(axis=0, dtype='int16')
+
+        results = {}
+        for ind in indicators:
+            # Floats in memory so NaNs mark grid cells/years without any data
+            # (written back as int16 with a fill value, see count_encoding)
+            values = counts[ind.name].astype(float)
+            values[valid[ind.variable] == 0] = np.nan
+
+            ds_output = xr.Dataset({ind.name: (['year', 'y', 'x'], values)})
+            ds_output = ds_output.assign_coords({
+                'year': unique_years.astype(int),
+                'x': ds.coords['x'],
+                'y': ds.coords['y']
+            })
+            ds_output[ind.name].attrs['long_name'] = ind.long_name
+            ds_output[ind.name].attrs['units'] = 'days'
+            ds_output[ind.name].attrs['threshold'] = f'{ind.threshold}K'
+            ds_output['year'].attrs['long_name'] = 'year'
+            results[ind.name] = ds_output
+        return results
+    finally:
+        ds.close()
+
+
+def process_file(input_file, indicators=INDICATORS, output_dir='.', chunk_days=CHUNK_DAYS,
+                 overwrite=True):
+    """Compute the indicators of one file and write one NetCDF per indicator.
+
+    With overwrite=False, indicators whose output already exists are skipped.
+    """
+    if not overwrite:
+        indicators = [ind for ind in indicators
+                      if not os.path.exists(output_path(ind, input_file, output_dir))]
+        if not indicators:
+            return []
+
+    written = []
+    results = compute_file(input_file, indicators, chunk_days)
+    for ind in indicators:
+        if ind.name not in results:
+            continue
+        path = output_path(ind, input_file, output_dir)
+        atomic_to_netcdf(results[ind.name], path, encoding=count_encoding([ind.name]))
+        written.append(path)
+    return written
@@ -0,0 +1,85 @@
+#Manifest of the inputs and parameters behind each output, for incremental recomputation
+import hashlib
+import json
+import os
+import re
+
+from calculs_indicateurs.storage import atomic_path
+
+MANIFEST_NAME = 'pipeline_manifest.json'
+HASH_BLOCK = 16 * 1024 ** 2
+
+
+def file_years(input_file):
+    """Years covered by a '..._YYYYMMDD-YYYYMMDD.nc' file, from its name."""
+    match = re.search(r'(\d{4})\d{4}-(\d{4})\d{4}\.nc$', os.path.basename(input_file))
+    if match is None:
+        raise ValueError(f"No date range in file name: {input_file}")
+    return int(match.group(1)), int(match.group(2))
+
+
+def overlapping_files(input_files, start_year, end_year):
+    """Input files sharing at least one year with [start_year, end_year]."""
+    selected = []
+    for input_file in input_files:
+        first, last = file_years(input_file)
+        if first <= end_year and last >= start_year:
+            selected.append(input_file)
+    return selected
+
+
+class Manifest:
+    """JSON record of the content hash of every input and of what produced every output.
+
+    Hashes are cached by (size, mtime), so unchanged files are not re-read.
+    An output is current when it exists and was produced from the same input hashes
+    and the same parameters.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.outputs = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.files = data.get('files', {})
+            self.outputs = data.get('outputs', {})
+
+    def file_hash(self, path):
+        key = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = self.files.get(key)
+        if cached and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime:
+            return cached['sha256']
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b''):
+                digest.update(block)
+        self.files[key] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': digest.hexdigest()}
+        return self.files[key]['sha256']
+
+    def _entry(self, inputs, params):
+        return {
+            'inputs': {os.path.abspath(f): self.file_hash(f) for f in sorted(inputs)},
+            'params': json.loads(json.dumps(params, sort_keys=True, default=str)),
+        }
+
+    def is_current(self, output, inputs, params, path=None):
+        """True when `output` exists and was recorded with the same inputs and parameters.
+
+        `output` is a key; `path` is the file to check for existence (defaults to `output`).
+        """
+        path = output if path is None else path
+        if not os.path.exists(path) or output not in self.outputs:
+            return False
+        return self.outputs[output] == self._entry(inputs, params)
+
+    def record(self, output, inputs, params):
+        self.outputs[output] = self._entry(inputs, params)
+
+    def save(self):
+        tmp_path = atomic_path(self.path)
+        with open(tmp_path, 'w') as f:
+            json.dump({'files': self.files, 'outputs': self.outputs}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
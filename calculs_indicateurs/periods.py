@@ -0,0 +1,161 @@
+#Period definitions and O(1) period statistics over per-year indicator cubes
+import warnings
+from collections import namedtuple
+
+import numpy as np
+import xarray as xr
+
+# Inclusive range of years, with the label used in the outputs
+Period = namedtuple('Period', ['label', 'start', 'end'])
+
+# Intervals of the map animations (each end year excluded, as in `years < end`)
+INTERVALS = [
+    Period('1990-2000', 1990, 1999),
+    Period('2000-2020', 2000, 2019),
+    Period('2020-2040', 2020, 2039),
+    Period('2040-2060', 2040, 2059),
+    Period('2060-2080', 2060, 2079),
+    Period('2080-2100', 2080, 2099),
+]
+
+# Reference and projection periods of the anomaly maps
+REFERENCE = Period('1990-2020', 1990, 2020)
+ANOMALY_PERIODS = [
+    Period('2020-2040', 2020, 2040),
+    Period('2041-2060', 2041, 2060),
+    Period('2061-2080', 2061, 2080),
+    Period('2081-2100', 2081, 2100),
+]
+
+# Late period of the difference maps
+LATE = Period('2080-2100', 2080, 2100)
+
+# Periods of the averaged altitude statistics CSVs
+ALTITUDE_PERIODS = [
+    Period('1990-2020', 1990, 2020),
+    Period('2021-2040', 2021, 2040),
+    Period('2041-2060', 2041, 2060),
+    Period('2061-2080', 2061, 2080),
+    Period('2081-2100', 2081, 2100),
+]
+
+
+def as_dates(periods):
+    """(label, 'YYYY-01-01', 'YYYY-12-31') tuples, to select daily data with .sel(time=slice(...))."""
+    return [(p.label, f'{p.start}-01-01', f'{p.end}-12-31') for p in periods]
+
+
+def sliding_windows(first, last, length, step=1):
+    """All `length`-year windows between `first` and `last` (inclusive), every `step` years."""
+    return [Period(f'{start}-{start + length - 1}', start, start + length - 1)
+            for start in range(first, last - length + 2, step)]
+
+
+class PeriodAggregator:
+    """Statistics of any year window of a (year, y, x) cube from cumulative sums.
+
+    The cube is read once: cumulative sums over years of the values, of their squares
+    and of the valid (non-NaN) counts give the mean and std of any window with two
+    lookups per cell. Min/max use sparse tables (two lookups per cell as well) built on
+    first use. Percentiles need the values and are computed from the window slice.
+    """
+
+    def __init__(self, values, years, dims=('y', 'x'), coords=None):
+        if np.ma.isMaskedArray(values):
+            # e.g. compact int16 cubes (compact.py): masked cells become NaN
+            values = values.astype('float64').filled(np.nan)
+        self.values = np.asarray(values, dtype='float64')
+        self.years = np.asarray(years)
+        self.dims = list(dims)
+        self.coords = coords or {}
+        valid = ~np.isnan(self.values)
+        filled = np.where(valid, self.values, 0.0)
+        zeros = np.zeros((1,) + self.values.shape[1:])
+        self.csum = np.concatenate([zeros, np.cumsum(filled, axis=0)])
+        self.csum2 = np.concatenate([zeros, np.cumsum(filled ** 2, axis=0)])
+        self.ccount = np.concatenate([zeros, np.cumsum(valid, axis=0)])
+        self._min_table = None
+        self._max_table = None
+
+    @classmethod
+    def from_dataarray(cls, da, dim='year'):
+        da = da.transpose(dim, ...)
+        dims = da.dims[1:]
+        return cls(da.values, da[dim].values, dims, {d: da[d].values for d in dims if d in da.coords})
+
+    def _bounds(self, period):
+        """Positions [i, j) of the years of `period` in the cube."""
+        i = np.searchsorted(self.years, period.start, side='left')
+        j = np.searchsorted(self.years, period.end, side='right')
+        return i, j
+
+    def count(self, period):
+        i, j = self._bounds(period)
+        return self.ccount[j] - self.ccount[i]
+
+    def mean(self, period):
+        i, j = self._bounds(period)
+        n = self.ccount[j] - self.ccount[i]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(n > 0, (self.csum[j] - self.csum[i]) / n, np.nan)
+
+    def std(self, period):
+        i, j = self._bounds(period)
+        n = self.ccount[j] - self.ccount[i]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = (self.csum[j] - self.csum[i]) / n
+            var = (self.csum2[j] - self.csum2[i]) / n - mean ** 2
+            return np.where(n > 0, np.sqrt(np.maximum(var, 0.0)), np.nan)
+
+    def _sparse_table(self, func):
+        table = [self.values]
+        span = 1
+        while 2 * span <= len(self.values):
+            previous = table[-1]
+            table.append(func(previous[:-span], previous[span:]))
+            span *= 2
+        return table
+
+    def _range_query(self, table, func, period):
+        i, j = self._bounds(period)
+        if j <= i:
+            return np.full(self.values.shape[1:], np.nan)
+        level = int(np.log2(j - i))
+        with np.errstate(invalid='ignore'):
+            return func(table[level][i], table[level][j - 2 ** level])
+
+    def min(self, period):
+        if self._min_table is None:
+            self._min_table = self._sparse_table(np.fmin)
+        return self._range_query(self._min_table, np.fmin, period)
+
+    def max(self, period):
+        if self._max_table is None:
+            self._max_table = self._sparse_table(np.fmax)
+        return self._range_query(self._max_table, np.fmax, period)
+
+    def percentile(self, period, q):
+        i, j = self._bounds(period)
+        if j <= i:
+            return np.full(self.values.shape[1:], np.nan)
+        with warnings.catch_warnings():
+            # All-NaN cells (outside the Alpine mask) give NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanpercentile(self.values[i:j], q, axis=0)
+
+    def aggregate(self, periods, stat='mean', q=None):
+        """One statistic for several periods, stacked along a `period` dimension."""
+        func = getattr(self, stat)
+        if stat == 'percentile':
+            stacked = np.stack([func(p, q) for p in periods])
+        else:
+            stacked = np.stack([func(p) for p in periods])
+        coords = dict(self.coords, period=[p.label for p in periods])
+        return xr.DataArray(stacked, dims=['period'] + self.dims, coords=coords, name=stat)
+
+    def summary(self, periods, stats=('mean', 'min', 'max', 'std'), percentiles=()):
+        """Dataset of several statistics (and percentiles) for all periods."""
+        ds = xr.Dataset({stat: self.aggregate(periods, stat) for stat in stats})
+        for q in percentiles:
+            ds[f'p{q:g}'] = self.aggregate(periods, 'percentile', q)
+        return ds
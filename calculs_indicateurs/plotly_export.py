@@ -0,0 +1,109 @@
+#Compact plotly heatmap animations: one base trace, frames carrying only z as base64 typed arrays
+import base64
+
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+
+# plotly.js is referenced, not inlined (typed arrays need plotly.js >= 2.28)
+PLOTLYJS_CDN = 'https://cdn.plot.ly/plotly-2.35.2.min.js'
+
+
+def typed_array(values):
+    """Base64 typed-array spec of a 2D array: uint8/int16 for day counts, float32 otherwise.
+
+    Masked or NaN cells are only possible in float32; integer encodings are used when
+    the missing cells are covered by the static mask trace (their value is then 0).
+    """
+    values = np.ma.masked_invalid(np.ma.asarray(values, dtype='float64'))
+    present = values.compressed()
+    if values.mask.any() or present.size == 0 or not np.all(present == np.round(present)):
+        data = values.filled(np.nan).astype('float32')
+        dtype = 'f4'
+    elif present.min() >= 0 and present.max() <= 255:
+        data = values.filled(0).astype('uint8')
+        dtype = 'u1'
+    elif present.min() >= -2 ** 15 and present.max() < 2 ** 15:
+        data = values.filled(0).astype('int16')
+        dtype = 'i2'
+    else:
+        data = values.filled(np.nan).astype('float32')
+        dtype = 'f4'
+    return {'dtype': dtype, 'bdata': base64.b64encode(np.ascontiguousarray(data).tobytes()).decode('ascii'),
+            'shape': ', '.join(str(n) for n in data.shape)}
+
+
+def static_mask(frames):
+    """Cells missing in every frame (outside the Alpine mask)."""
+    missing = None
+    for frame in frames:
+        frame_missing = np.ma.getmaskarray(np.ma.masked_invalid(np.ma.asarray(frame, dtype='float64')))
+        missing = frame_missing if missing is None else missing & frame_missing
+    return missing
+
+
+def heatmap_animation(x, y, frames, labels, title, colorbar_title, colorscale, slider_prefix,
+                      duration, vmin=None, vmax=None, width=800, height=600):
+    """Figure dict of a heatmap animation with frames holding only the z values.
+
+    Trace 0 (the data) carries x, y, the colorscale and the colorbar once. Trace 1 paints
+    the cells missing in every frame with the plot background, so the frames can use
+    uint8/int16 z arrays (0 under the mask) instead of NaN floats.
+    """
+    frames = [np.ma.masked_invalid(np.ma.asarray(f, dtype='float64')) for f in frames]
+    if vmin is None:
+        vmin = float(min(f.min() for f in frames))
+    if vmax is None:
+        vmax = float(max(f.max() for f in frames))
+    missing = static_mask(frames)
+    # Missing cells outside the static mask keep NaN (float32 frames)
+    frames = [np.ma.array(f.filled(0), mask=np.ma.getmaskarray(f) & ~missing) for f in frames]
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+
+    play = dict(frame=dict(duration=duration, redraw=True), transition=dict(duration=0),
+                fromcurrent=True, mode='immediate')
+    layout = go.Layout(
+        title=title,
+        xaxis_title='x',
+        yaxis_title='y',
+        width=width,
+        height=height,
+        sliders=[dict(
+            steps=[dict(method='animate',
+                        args=[[label], dict(mode='immediate', frame=dict(duration=duration, redraw=True),
+                                            transition=dict(duration=0))],
+                        label=label) for label in labels],
+            transition=dict(duration=0),
+            x=0, y=0, currentvalue=dict(prefix=slider_prefix, font=dict(size=16)),
+            len=1.0
+        )],
+        updatemenus=[dict(
+            type='buttons', showactive=False, y=1.05, x=1.05, xanchor='right', yanchor='top',
+            buttons=[
+                dict(label='Play', method='animate', args=[None, play]),
+                dict(label='Pause', method='animate',
+                     args=[[None], dict(frame=dict(duration=0, redraw=False), mode='immediate')]),
+            ]
+        )]
+    )
+    # Validated layout with the default template, traces and frames added as plain dicts
+    fig = go.Figure(layout=layout).to_dict()
+    background = fig['layout']['template']['layout'].get('plot_bgcolor', 'white')
+
+    fig['data'] = [
+        dict(type='heatmap', z=typed_array(frames[0]), x=x.tolist(), y=y.tolist(),
+             zmin=vmin, zmax=vmax, colorscale=colorscale, colorbar=dict(title=dict(text=colorbar_title))),
+        dict(type='heatmap', z=typed_array(missing.astype('uint8')), x=x.tolist(), y=y.tolist(),
+             zmin=0, zmax=1, colorscale=[[0, 'rgba(0,0,0,0)'], [1, background]],
+             showscale=False, hoverinfo='skip'),
+    ]
+    fig['frames'] = [dict(name=label, traces=[0], data=[dict(type='heatmap', z=typed_array(f))])
+                     for f, label in zip(frames, labels)]
+    return fig
+
+
+def write_html(fig, output_file, plotlyjs=PLOTLYJS_CDN):
+    """Write the figure dict as HTML, loading plotly.js from `plotlyjs` instead of inlining it."""
+    pio.write_html(fig, output_file, include_plotlyjs=plotlyjs, validate=False)
+    return output_file
@@ -0,0 +1,293 @@
+#Local query service over the per-year indicator cubes (ASGI app, lazy chunk reads, LRU caches)
+#
+#   uvicorn calculs_indicateurs.query_service:app --port 8000
+#
+#   GET  /point?indicator=freezing_days&lat=45.9&lon=6.87&start=2040&end=2060
+#   GET  /polygon?indicator=tropical_days&department=38&start=2041&end=2060
+#   POST /polygon  {"indicator": "tropical_days", "geometry": <GeoJSON>, "start": 2041, "end": 2060}
+#   GET  /map?indicator=freezing_days&year=2050   (or &start=2041&end=2060[&stat=mean|min|max])
+#   GET  /metrics
+import asyncio
+import json
+import threading
+import warnings
+from collections import Counter
+from functools import lru_cache
+from urllib.parse import parse_qs
+
+import numpy as np
+import xarray as xr
+from scipy.spatial import cKDTree
+
+from calculs_indicateurs.alpes_mask import GRID_FILE, build_mask, get_alpine_mask
+from calculs_indicateurs.indicator_store import DATA_FOLDERS, TILE, open_indicator
+from calculs_indicateurs.tiles import web_mercator
+
+# Decoded chunks: one-year maps (50 KB) and all-years 32 x 32 tiles (450 KB)
+CHUNK_CACHE_SIZE = 512
+AGGREGATE_CACHE_SIZE = 128
+STATS = {'mean': np.nanmean, 'min': np.nanmin, 'max': np.nanmax}
+
+
+# -----------------------------
+# Data access
+# -----------------------------
+@lru_cache(maxsize=None)
+def open_cube(name):
+    """Lazy map and series views of an indicator (nothing is read until a chunk is asked for)."""
+    if name not in DATA_FOLDERS:
+        raise ValueError(f"Unknown indicator: {name}")
+    maps = open_indicator(name, access='map')
+    series = open_indicator(name, access='series')
+    return {'map': maps, 'series': series, 'years': maps['year'].values.astype(int)}
+
+
+def _read_only(values):
+    values = np.asarray(values, dtype='float32')
+    values.setflags(write=False)
+    return values
+
+
+@lru_cache(maxsize=CHUNK_CACHE_SIZE)
+def map_chunk(name, year_index):
+    """(y, x) map of one year."""
+    return _read_only(open_cube(name)['map'][year_index].values)
+
+
+@lru_cache(maxsize=CHUNK_CACHE_SIZE)
+def series_chunk(name, tile_y, tile_x):
+    """(year, TILE, TILE) block of all years, as stored in the series layout."""
+    series = open_cube(name)['series']
+    block = series[:, tile_y * TILE:(tile_y + 1) * TILE, tile_x * TILE:(tile_x + 1) * TILE]
+    return _read_only(block.values)
+
+
+def year_positions(name, start=None, end=None):
+    years = open_cube(name)['years']
+    start = years[0] if start is None else start
+    end = years[-1] if end is None else end
+    positions = np.flatnonzero((years >= start) & (years <= end))
+    if len(positions) == 0:
+        raise ValueError(f"No year of {name} between {start} and {end}")
+    return positions
+
+
+@lru_cache(maxsize=AGGREGATE_CACHE_SIZE)
+def period_map(name, start, end, stat='mean'):
+    """(y, x) statistic over the years [start, end], from the cached year maps."""
+    if stat not in STATS:
+        raise ValueError(f"Unknown statistic: {stat}")
+    stack = np.stack([map_chunk(name, i) for i in year_positions(name, start, end)])
+    return _read_only(_nan_stat(STATS[stat], stack, axis=0))
+
+
+def _nan_stat(func, values, **kwargs):
+    # Cells outside the Alpine mask are NaN every year: no all-NaN warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return func(values, **kwargs)
+
+
+# -----------------------------
+# Grid and polygons
+# -----------------------------
+@lru_cache(maxsize=1)
+def grid():
+    with xr.open_dataset(GRID_FILE) as ds:
+        lat = ds['lat'].values
+        lon = ds['lon'].values
+        x, y = web_mercator(lon.ravel(), lat.ravel())
+        points = np.column_stack([x, y])
+        tree = cKDTree(points)
+        # Largest distance between a cell centre and its nearest neighbour: one grid spacing
+        spacing = float(tree.query(points, k=2)[0][:, 1].max())
+        return {'lat': lat, 'lon': lon, 'tree': tree, 'spacing': spacing,
+                'dataset': ds[['lat', 'lon']].load()}
+
+
+def nearest_cell(lat, lon):
+    """(y, x) indices of the grid cell nearest to a lat/lon point, within one grid spacing."""
+    g = grid()
+    x, y = web_mercator(lon, lat)
+    _, cell = g['tree'].query([x, y], distance_upper_bound=g['spacing'])
+    if cell == g['tree'].n:
+        raise ValueError("Point outside the grid")
+    return np.unravel_index(cell, g['lat'].shape)
+
+
+@lru_cache(maxsize=32)
+def department_mask(code):
+    """(y, x) mask of one department (cached on disk by alpes_mask as well)."""
+    return get_alpine_mask(grid()['dataset'], codes=[code]).values
+
+
+@lru_cache(maxsize=32)
+def geometry_mask(geojson):
+    import shapely.geometry
+
+    g = grid()
+    return build_mask(g['lat'], g['lon'], shapely.geometry.shape(json.loads(geojson)))
+
+
+# -----------------------------
+# Queries
+# -----------------------------
+def point_series(name, iy, ix, start=None, end=None):
+    positions = year_positions(name, start, end)
+    block = series_chunk(name, iy // TILE, ix // TILE)
+    return open_cube(name)['years'][positions], block[positions, iy % TILE, ix % TILE]
+
+
+def polygon_series(name, mask, start=None, end=None):
+    """Spatial mean over the True cells of `mask`, for each year, read tile by tile."""
+    positions = year_positions(name, start, end)
+    total = np.zeros(len(positions))
+    count = np.zeros(len(positions))
+    rows, cols = np.nonzero(mask)
+    if len(rows) == 0:
+        raise ValueError("The polygon contains no grid cell")
+    for tile_y, tile_x in sorted(set(zip(rows // TILE, cols // TILE))):
+        block = series_chunk(name, tile_y, tile_x)[positions]
+        sub = mask[tile_y * TILE:(tile_y + 1) * TILE, tile_x * TILE:(tile_x + 1) * TILE]
+        values = block[:, :sub.shape[0], :sub.shape[1]][:, sub]
+        present = ~np.isnan(values)
+        total += np.where(present, values, 0).sum(axis=1)
+        count += present.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return open_cube(name)['years'][positions], np.where(count > 0, total / count, np.nan)
+
+
+def _values(array):
+    """JSON-ready list with null for NaN."""
+    array = np.asarray(array, dtype='float64')
+    return np.where(np.isnan(array), None, np.round(array, 3)).tolist()
+
+
+class MissingParameter(ValueError):
+    def __init__(self, key):
+        super().__init__(f"Missing parameter: {key}")
+
+
+def _required(params, key):
+    if key not in params:
+        raise MissingParameter(key)
+    return params[key]
+
+
+def _year(params, key):
+    return int(params[key]) if key in params else None
+
+
+def handle_point(params, body):
+    name = _required(params, 'indicator')
+    iy, ix = nearest_cell(float(_required(params, 'lat')), float(_required(params, 'lon')))
+    years, values = point_series(name, iy, ix, _year(params, 'start'), _year(params, 'end'))
+    return {'indicator': name, 'y_index': int(iy), 'x_index': int(ix),
+            'lat': float(grid()['lat'][iy, ix]), 'lon': float(grid()['lon'][iy, ix]),
+            'years': years.tolist(), 'values': _values(values),
+            'mean': _values([_nan_stat(np.nanmean, values)])[0]}
+
+
+def handle_polygon(params, body):
+    if body:
+        params = dict(params, **json.loads(body))
+    name = _required(params, 'indicator')
+    if 'department' in params:
+        mask = department_mask(str(params['department']))
+    else:
+        mask = geometry_mask(json.dumps(_required(params, 'geometry'), sort_keys=True))
+    start, end = _year(params, 'start'), _year(params, 'end')
+    years, values = polygon_series(name, mask, start, end)
+    period = period_map(name, int(years[0]), int(years[-1]))
+    mean = _nan_stat(np.nanmean, period[mask])
+    return {'indicator': name, 'cells': int(mask.sum()), 'years': years.tolist(),
+            'values': _values(values), 'mean': _values([mean])[0]}
+
+
+def handle_map(params, body):
+    name = _required(params, 'indicator')
+    cube = open_cube(name)
+    if 'year' in params:
+        values = map_chunk(name, int(year_positions(name, int(params['year']), int(params['year']))[0]))
+    else:
+        positions = year_positions(name, _year(params, 'start'), _year(params, 'end'))
+        years = cube['years'][positions]
+        values = period_map(name, int(years[0]), int(years[-1]), params.get('stat', 'mean'))
+    return {'indicator': name, 'x': cube['map']['x'].values.tolist(), 'y': cube['map']['y'].values.tolist(),
+            'values': _values(values)}
+
+
+REQUESTS = Counter()
+_requests_lock = threading.Lock()
+
+
+def handle_metrics(params, body):
+    caches = {'map_chunk': map_chunk, 'series_chunk': series_chunk, 'period_map': period_map,
+              'department_mask': department_mask, 'geometry_mask': geometry_mask}
+    metrics = {}
+    for label, func in caches.items():
+        info = func.cache_info()
+        metrics[label] = {'hits': info.hits, 'misses': info.misses,
+                          'size': info.currsize, 'maxsize': info.maxsize}
+    with _requests_lock:
+        requests = dict(REQUESTS)
+    return {'caches': metrics, 'requests': requests}
+
+
+ROUTES = {
+    ('GET', '/point'): handle_point,
+    ('GET', '/polygon'): handle_polygon,
+    ('POST', '/polygon'): handle_polygon,
+    ('GET', '/map'): handle_map,
+    ('GET', '/metrics'): handle_metrics,
+}
+
+
+# -----------------------------
+# ASGI application
+# -----------------------------
+async def _send_json(send, status, payload):
+    body = json.dumps(payload).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def app(scope, receive, send):
+    """Each request runs in a worker thread, so slow chunk reads do not block the others."""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    handler = ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        await _send_json(send, 404, {'error': f"No route {scope['method']} {scope['path']}"})
+        return
+    with _requests_lock:
+        REQUESTS[scope['path']] += 1
+    params = {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode()).items()}
+    body = await _read_body(receive)
+    try:
+        payload = await asyncio.to_thread(handler, params, body)
+    except ValueError as e:
+        # Bad or missing (MissingParameter) request parameters; anything else is a server error
+        await _send_json(send, 400, {'error': str(e)})
+    else:
+        await _send_json(send, 200, payload)
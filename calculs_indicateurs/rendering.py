@@ -0,0 +1,122 @@
+#Render map animation frames once, in a process pool, and encode the same frames to MP4 and GIF
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+import numpy as np
+from PIL import Image
+
+FIGSIZE = (8, 6)
+DPI = 100
+
+# Figure of each worker process, drawn once and updated for every frame
+_figure = {}
+
+
+def _init_worker(x, y, shape, cmap, vmin, vmax, label, figsize, dpi):
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=figsize, dpi=dpi)
+    mesh = ax.pcolormesh(x, y, np.ma.masked_all(shape), shading='auto', cmap=cmap)
+    cbar = plt.colorbar(mesh, ax=ax)
+    cbar.set_label(label)
+    title = ax.set_title('')
+    ax.set_xlabel('x')
+    ax.set_ylabel('y')
+    mesh.set_clim(vmin, vmax)
+    # Axes, colorbar and labels never change: draw them once and only redraw the
+    # mesh and the title of each frame over a copy of this background
+    mesh.set_animated(True)
+    title.set_animated(True)
+    fig.canvas.draw()
+    background = fig.canvas.copy_from_bbox(fig.bbox)
+    _figure.update(fig=fig, mesh=mesh, title=title, background=background)
+
+
+def _render(frame):
+    values, text = frame
+    _figure['mesh'].set_array(np.ma.masked_invalid(values).ravel())
+    _figure['title'].set_text(text)
+    fig = _figure['fig']
+    canvas = fig.canvas
+    canvas.restore_region(_figure['background'])
+    fig.draw_artist(_figure['mesh'])
+    fig.draw_artist(_figure['title'])
+    return np.asarray(canvas.buffer_rgba())[..., :3].tobytes()
+
+
+def render_frames(x, y, frames, titles, cmap, label, vmin=None, vmax=None, workers=None,
+                  figsize=FIGSIZE, dpi=DPI):
+    """Render every (y, x) map of `frames` exactly once, as raw RGB buffers.
+
+    Each worker builds the figure (mesh, colorbar, labels) once and only updates
+    the mesh values and the title per frame, on the Agg backend.
+    Returns the frames and the (width, height) of the images.
+    """
+    frames = [np.ma.masked_invalid(np.ma.asarray(f, dtype='float32')) for f in frames]
+    if vmin is None:
+        vmin = float(min(f.min() for f in frames))
+    if vmax is None:
+        vmax = float(max(f.max() for f in frames))
+    size = (int(figsize[0] * dpi), int(figsize[1] * dpi))
+    workers = max(1, min(workers or os.cpu_count(), len(frames)))
+
+    initargs = (np.asarray(x, dtype=float), np.asarray(y, dtype=float), frames[0].shape,
+                cmap, vmin, vmax, label, figsize, dpi)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+        chunksize = max(1, len(frames) // (4 * workers))
+        # Masked values are sent as NaN (masked arrays pickle their full mask)
+        payload = ((f.filled(np.nan), text) for f, text in zip(frames, titles))
+        rgb_frames = list(pool.map(_render, payload, chunksize=chunksize))
+    return rgb_frames, size
+
+
+def write_mp4(rgb_frames, size, fps, output_file):
+    """Pipe the raw RGB frames to ffmpeg (H.264, yuv420p, as FFMpegWriter)."""
+    width, height = size
+    command = [
+        matplotlib.rcParams['animation.ffmpeg_path'], '-y', '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+        '-vcodec', 'h264', '-pix_fmt', 'yuv420p', output_file,
+    ]
+    with subprocess.Popen(command, stdin=subprocess.PIPE) as process:
+        for frame in rgb_frames:
+            process.stdin.write(frame)
+        process.stdin.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to write {output_file}")
+    return output_file
+
+
+def write_gif(rgb_frames, size, fps, output_file, palette_frames=4):
+    """Save the raw RGB frames as a looping GIF.
+
+    The frames are quantized to one palette built from a few frames spread over
+    the animation (the maps share one colormap), instead of one palette per frame.
+    """
+    images = [Image.frombytes('RGB', size, frame) for frame in rgb_frames]
+    sample_index = np.unique(np.linspace(0, len(images) - 1, palette_frames).astype(int))
+    sample = Image.fromarray(np.concatenate([np.asarray(images[i]) for i in sample_index]))
+    palette = sample.quantize(256, method=Image.Quantize.MEDIANCUT)
+    images = [image.quantize(palette=palette, dither=Image.Dither.NONE) for image in images]
+    images[0].save(output_file, save_all=True, append_images=images[1:],
+                   duration=int(1000 / fps), loop=0)
+    return output_file
+
+
+WRITERS = {
+    '.mp4': write_mp4,
+    '.gif': write_gif,
+}
+
+
+def render_animation(x, y, frames, titles, output_files, fps, cmap, label, vmin=None, vmax=None,
+                     workers=None):
+    """Render the frames once and encode them to every output (.mp4 and/or .gif)."""
+    rgb_frames, size = render_frames(x, y, frames, titles, cmap, label, vmin, vmax, workers)
+    for output_file in output_files:
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        WRITERS[os.path.splitext(output_file)[1]](rgb_frames, size, fps, output_file)
+    return output_files
@@ -0,0 +1,170 @@
+#Ridge profile animation: the ridge is drawn once, only the per-period altitude lines change
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from calculs_indicateurs.rendering import WRITERS
+
+FIGSIZE = (30, 12)
+DPI = 100
+SKI_COLOR = '#BDF4FF'
+
+# Horizontal altitude line: `label` is formatted with the period (e.g. '{key} {periode}')
+Line = namedtuple('Line', ['key', 'color', 'linestyle', 'label'])
+# Horizontal altitude band between a (low, high) pair of levels, e.g. an ensemble p10-p90 range
+Band = namedtuple('Band', ['key', 'color', 'label'])
+
+NUMERIC_COLUMNS = ['Altitude_Sommet', 'Altitude_Préfécture',
+                   'Altitude_basse_station de ski', 'Altitude_haute_station de ski']
+
+
+def load_ridge(csv_file):
+    """Summits of the ridge line (one row per summit), with prefectures and ski domains."""
+    df = pd.read_csv(csv_file, sep=';')
+    df = df[df['Altitude_Sommet'].notna()]
+    for col in NUMERIC_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df['Nom_station de ski'] = df['Nom_station de ski'].fillna('')
+    return df
+
+
+def read_levels(csv_file, columns):
+    """{period: {key: altitude}} from an averaged statistics CSV, `columns` mapping key -> column.
+
+    A tuple of columns gives a tuple of altitudes (the (low, high) levels of a Band).
+    """
+    stats = pd.read_csv(csv_file, index_col=0)
+    stats.columns = stats.columns.str.strip()
+    return {periode: {key: tuple(row[c] for c in column) if isinstance(column, tuple) else row[column]
+                      for key, column in columns.items()}
+            for periode, row in stats.iterrows()}
+
+
+def read_department_levels(csv_file, columns, ridge):
+    """{period: {key: altitude of each summit}} from a per-department statistics CSV (zonal.py).
+
+    Each summit takes the value of its department (code at the start of 'Département'),
+    so a line follows the ridge as steps from one department to the next.
+    """
+    stats = pd.read_csv(csv_file, dtype={'department': str})
+    codes = ridge['Département'].str[:2].values
+    levels = {}
+    for periode, rows in stats.groupby('period', sort=False):
+        rows = rows.set_index('department')
+        levels[periode] = {key: rows[column].reindex(codes).values.astype('float64')
+                           for key, column in columns.items()}
+    return levels
+
+
+class RidgeProfile:
+    """Persistent ridge profile figure.
+
+    The ridge fill, summit names, prefectures, ski-domain bars and axes are drawn
+    once into a background image. A frame restores that background and draws only
+    the altitude bands and lines, the legend and the title of its period.
+    """
+
+    def __init__(self, ridge, lines, title, levels, bands=(), figsize=FIGSIZE, dpi=DPI):
+        self.lines = lines
+        self.bands = bands
+        self.title_template = title
+        x = np.arange(len(ridge))
+        # Agg canvas of its own: no pyplot window, whatever the backend of the caller
+        self.fig = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(self.fig)
+        ax = self.fig.add_subplot()
+
+        ax.fill_between(x, ridge['Altitude_Sommet'], color='#C2C2C2', alpha=0.5)
+        ax.plot(x, ridge['Altitude_Sommet'], color='grey', marker='', label='Sommet', linewidth=2)
+        for xi, yi, nom in zip(x, ridge['Altitude_Sommet'], ridge['Nom_Sommet']):
+            ax.text(xi, yi + 80, nom, ha='center', va='bottom', fontsize=9)
+
+        ax.scatter(x, ridge['Altitude_Préfécture'], color='darkgrey', marker='x', s=100, label='Préfecture')
+        for xi, yi, nom in zip(x, ridge['Altitude_Préfécture'], ridge['Nom_prefecture']):
+            if not pd.isna(yi):
+                ax.text(xi, yi + 80, nom, ha='center', va='bottom', fontsize=8)
+
+        stations = (ridge['Nom_station de ski'] != '').values
+        for xi, yb, yh in zip(x[stations], ridge.loc[stations, 'Altitude_basse_station de ski'],
+                              ridge.loc[stations, 'Altitude_haute_station de ski']):
+            ax.plot([xi, xi], [yb, yh], color=SKI_COLOR, linestyle='-', linewidth=8)
+        ax.plot([], [], color=SKI_COLOR, linestyle='-', linewidth=8,
+                label='Espace couvert par le domaine skiable')
+
+        ax.set_xticks(x)
+        ax.set_xticklabels(ridge['Département'], rotation=45, ha='right')
+        ax.set_ylabel('Altitude (m)')
+        ax.grid(alpha=0.3)
+
+        # Same altitude axis for every period, so the frames line up
+        values = [v for stats in levels.values() for level in stats.values()
+                  for v in np.ravel(level) if not pd.isna(v)]
+        ax.update_datalim([(0, v) for v in values])
+        ax.autoscale_view()
+
+        first = next(iter(levels))
+        self.artists = {}
+        for band in bands:
+            low, high = levels[first][band.key]
+            self.artists[band.key] = ax.axhspan(low, high, color=band.color, alpha=0.35, linewidth=0,
+                                                label=band.label.format(key=band.key, periode=first))
+        for line in lines:
+            style = dict(color=line.color, linestyle=line.linestyle, linewidth=4,
+                         label=line.label.format(key=line.key, periode=first))
+            level = levels[first][line.key]
+            if np.ndim(level):
+                # One altitude per summit (per-department levels)
+                self.artists[line.key], = ax.plot(x, level, drawstyle='steps-mid', **style)
+            else:
+                self.artists[line.key] = ax.axhline(y=level, **style)
+        self.legend = ax.legend()
+        handles = ax.get_legend_handles_labels()[0]
+        texts = self.legend.get_texts()
+        self.legend_texts = {key: texts[handles.index(artist)] for key, artist in self.artists.items()}
+        self.title = ax.set_title(title.format(periode=first))
+        self.fig.tight_layout()
+
+        for artist in [*self.artists.values(), self.legend, self.title]:
+            artist.set_animated(True)
+        self.fig.canvas.draw()
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+
+    @property
+    def size(self):
+        return self.fig.canvas.get_width_height()
+
+    def frame(self, periode, stats):
+        """Raw RGB image of one period."""
+        for band in self.bands:
+            low, high = stats[band.key]
+            self.artists[band.key].set_y(low)
+            self.artists[band.key].set_height(high - low)
+            self.legend_texts[band.key].set_text(band.label.format(key=band.key, periode=periode))
+        for line in self.lines:
+            level = stats[line.key]
+            self.artists[line.key].set_ydata(level if np.ndim(level) else [level, level])
+            self.legend_texts[line.key].set_text(line.label.format(key=line.key, periode=periode))
+        self.title.set_text(self.title_template.format(periode=periode))
+
+        canvas = self.fig.canvas
+        canvas.restore_region(self.background)
+        for artist in [*self.artists.values(), self.legend, self.title]:
+            self.fig.draw_artist(artist)
+        return np.asarray(canvas.buffer_rgba())[..., :3].tobytes()
+
+    def render(self, levels):
+        return [self.frame(periode, stats) for periode, stats in levels.items()]
+
+
+def render_ridge_animation(ridge, lines, title, levels, output_files, fps=1, bands=()):
+    """Render one frame per period and encode the same frames to every output (.mp4/.gif)."""
+    profile = RidgeProfile(ridge, lines, title, levels, bands)
+    rgb_frames = profile.render(levels)
+    for output_file in output_files:
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        WRITERS[os.path.splitext(output_file)[1]](rgb_frames, profile.size, fps, output_file)
+    return output_files
@@ -0,0 +1,180 @@
+#Run the per-file stages (Alpine selection, indicators) in a process pool
+#
+#   python -m calculs_indicateurs.run_pipeline mask 'tasAdjust_FR-Metro_CNRM-ESM2-1*.nc' --workers 16
+#   python -m calculs_indicateurs.run_pipeline indicators 'tasAdjust_alpes_day_*.nc' 'tasminAdjust_alpes_day_*.nc' \
+#       --output-dir Isotherme0_data --memory-per-worker 4GB
+#   python -m calculs_indicateurs.run_pipeline catalogue 'tas*Adjust_alpes_day_*.nc' --output-dir catalogue_data
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict
+from glob import glob
+
+import xarray as xr
+
+from calculs_indicateurs import alpes_mask, catalogue, indicators
+from calculs_indicateurs.manifest import MANIFEST_NAME, Manifest
+from calculs_indicateurs.storage import parse_size
+
+# Working copies held per streamed day: the block read, its NaN mask and one comparison
+BLOCK_COPIES = 4
+
+
+def expand(patterns):
+    files = []
+    for pattern in patterns:
+        files.extend(sorted(glob(pattern)))
+    return files
+
+
+def days_per_block(input_file, memory_per_worker):
+    """Number of days of `input_file` that fit in the memory budget of one worker."""
+    with xr.open_dataset(input_file) as ds:
+        variables = [var for var in ds.data_vars if 'time' in ds[var].dims]
+        day_bytes = sum(ds[var].isel(time=0).size * ds[var].dtype.itemsize for var in variables)
+    return max(1, int(memory_per_worker // (BLOCK_COPIES * max(day_bytes, 1))))
+
+
+def max_workers(workers, memory_per_worker):
+    """Cap the worker count so that workers x budget fits in the available memory."""
+    try:
+        import psutil
+    except ImportError:
+        return workers
+    return max(1, min(workers, int(psutil.virtual_memory().available // memory_per_worker)))
+
+
+def mask_job(input_file, output_dir, memory_per_worker, overwrite=False):
+    output_file = alpes_mask.output_path(input_file, output_dir)
+    if os.path.exists(output_file) and not overwrite:
+        return f"Output file {output_file} already exists, skipping."
+    alpes_mask.select_file(input_file, output_dir,
+                           time_chunk=days_per_block(input_file, memory_per_worker))
+    return f"Saved to: {output_file}"
+
+
+def indicators_job(input_file, output_dir, memory_per_worker, overwrite=False):
+    written = indicators.process_file(input_file, output_dir=output_dir,
+                                      chunk_days=days_per_block(input_file, memory_per_worker),
+                                      overwrite=overwrite)
+    if not written:
+        return f"Outputs of {input_file} already exist, skipping."
+    return f"Saved to: {', '.join(written)}"
+
+
+def catalogue_job(input_files, output_dir, memory_per_worker, overwrite=False):
+    written = catalogue.process_files(input_files, output_dir=output_dir,
+                                      chunk_days=days_per_block(input_files[0], memory_per_worker),
+                                      overwrite=overwrite)
+    if not written:
+        return "Outputs already exist, skipping."
+    return f"Saved to: {', '.join(written)}"
+
+
+def mask_outputs(input_file, output_dir):
+    """{output file: parameters} of the mask job of `input_file`."""
+    return {alpes_mask.output_path(input_file, output_dir): {'departments': alpes_mask.ALPINE_CODES}}
+
+
+def indicators_outputs(input_file, output_dir):
+    """{output file: parameters} of the indicators computed from `input_file`."""
+    variable = os.path.basename(input_file).split('_')[0]
+    return {indicators.output_path(ind, input_file, output_dir): asdict(ind)
+            for ind in indicators.INDICATORS if ind.variable == variable}
+
+
+def catalogue_outputs(input_files, output_dir):
+    """{output file: parameters} of the catalogue indicators computed from the files of one variable."""
+    return {indicators.output_path(ind, input_file, output_dir): asdict(ind)
+            for input_file in input_files for ind in catalogue.CATALOGUE
+            if ind.variable == file_variable(input_file)}
+
+
+# Stages run over all the files of a variable at once, in date order (state carried between files)
+SEQUENTIAL = {'catalogue'}
+
+
+def file_variable(input_file):
+    return os.path.basename(input_file).split('_')[0]
+
+
+def variable_groups(input_files):
+    """Tuple of the files of each variable."""
+    groups = {}
+    for input_file in input_files:
+        groups.setdefault(file_variable(input_file), []).append(input_file)
+    return [tuple(files) for files in groups.values()]
+
+
+def unit_inputs(unit):
+    """Input files of a job unit: one file, or the files of a variable for the SEQUENTIAL stages."""
+    return list(unit) if isinstance(unit, tuple) else [unit]
+
+
+JOBS = {
+    'mask': (mask_job, mask_outputs),
+    'indicators': (indicators_job, indicators_outputs),
+    'catalogue': (catalogue_job, catalogue_outputs),
+}
+
+
+def run(stage, input_files, output_dir='.', workers=os.cpu_count(), memory_per_worker='4GB',
+        incremental=False):
+    """Run the jobs of `stage` over `input_files`.
+
+    With incremental=True, a manifest in `output_dir` records the content hash of each
+    input and the parameters of each output: only the files whose content or parameters
+    changed are recomputed (existing outputs are otherwise skipped as before). The
+    SEQUENTIAL stages get all the files of a variable per job, recomputed together.
+    """
+    memory_per_worker = parse_size(memory_per_worker)
+    workers = max_workers(workers, memory_per_worker)
+    os.makedirs(output_dir, exist_ok=True)
+    job, outputs = JOBS[stage]
+
+    units = variable_groups(input_files) if stage in SEQUENTIAL else input_files
+    manifest = None
+    if incremental:
+        manifest = Manifest(os.path.join(output_dir, MANIFEST_NAME))
+        stale = [u for u in units
+                 if not all(manifest.is_current(out, unit_inputs(u), params)
+                            for out, params in outputs(u, output_dir).items())]
+        print(f"{len(units) - len(stale)} jobs up to date")
+        units = stale
+    input_files = [f for u in units for f in unit_inputs(u)]
+    print(f"Found {len(input_files)} files to process in {len(units)} jobs with {workers} workers")
+
+    if stage == 'mask' and input_files:
+        # Build the grid mask once, before the workers need it
+        with xr.open_dataset(input_files[0]) as ds:
+            alpes_mask.get_alpine_mask(ds)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(job, u, output_dir, memory_per_worker, incremental): u
+                   for u in units}
+        for future in as_completed(futures):
+            unit = futures[future]
+            print(f"{', '.join(unit_inputs(unit))}: {future.result()}")
+            if manifest is not None:
+                for out, params in outputs(unit, output_dir).items():
+                    manifest.record(out, unit_inputs(unit), params)
+                manifest.save()
+    print("All files processed!")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the per-file pipeline stages in a process pool')
+    parser.add_argument('stage', choices=sorted(JOBS))
+    parser.add_argument('patterns', nargs='+', help='glob patterns of the input files')
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--memory-per-worker', default='4GB', help="e.g. 512MB, 4GB")
+    parser.add_argument('--incremental', action='store_true',
+                        help='only recompute outputs whose input content or parameters changed')
+    args = parser.parse_args(argv)
+    run(args.stage, expand(args.patterns), args.output_dir, args.workers, args.memory_per_worker,
+        args.incremental)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#Season index of the daily files: contiguous day ranges of each season, read from the time coordinate only
+import json
+import os
+from collections import namedtuple
+
+import cftime
+import netCDF4
+import numpy as np
+
+from calculs_indicateurs.storage import atomic_path
+
+SEASONS = {
+    'DJF': (12, 1, 2),
+    'MAM': (3, 4, 5),
+    'JJA': (6, 7, 8),
+    'SON': (9, 10, 11),
+}
+
+# Cache of the season ranges of the files of a folder, next to them
+INDEX_NAME = 'season_index.json'
+
+# Days [start, stop) of a file in one season; `year` is the season year (winter of December 1990 = 1991)
+SeasonRange = namedtuple('SeasonRange', ['year', 'start', 'stop'])
+
+
+def wraps(months):
+    """True for a season running over the new year (e.g. DJF)."""
+    return months[0] > months[-1]
+
+
+def season_years(years, months, season_months):
+    """Season year of each day: the months before the new year count for the following year."""
+    years = np.asarray(years)
+    if wraps(season_months):
+        return years + (np.asarray(months) >= season_months[0])
+    return years
+
+
+def season_ranges(years, months, season_months):
+    """Contiguous SeasonRange of the days in `season_months`, one per season year and run of days."""
+    in_season = np.isin(months, season_months)
+    key = np.where(in_season, season_years(years, months, season_months), -1)
+    bounds = np.flatnonzero(np.diff(key)) + 1
+    starts = np.concatenate([[0], bounds])
+    stops = np.concatenate([bounds, [len(key)]])
+    return [SeasonRange(int(key[a]), int(a), int(b)) for a, b in zip(starts, stops) if key[a] >= 0]
+
+
+def read_time(input_file, name='time'):
+    """Years and months of the time coordinate, decoded from its CF units and calendar (no data read)."""
+    with netCDF4.Dataset(input_file) as nc:
+        time = nc.variables[name]
+        values = np.ma.getdata(time[:])
+        units = time.units
+        calendar = getattr(time, 'calendar', 'standard')
+    dates = cftime.num2date(values, units, calendar)
+    years = np.fromiter((d.year for d in dates), dtype='int64', count=len(dates))
+    months = np.fromiter((d.month for d in dates), dtype='int64', count=len(dates))
+    return years, months
+
+
+def _load(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def file_index(input_file):
+    """{season: [SeasonRange]} of `input_file` for every season of SEASONS.
+
+    Computed from the time coordinate only, then cached in season_index.json in the folder
+    of the file, keyed by file name, size and mtime.
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(input_file)), INDEX_NAME)
+    key = os.path.basename(input_file)
+    stat = os.stat(input_file)
+    entry = _load(path).get(key)
+    if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+        years, months = read_time(input_file)
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'n_time': len(years),
+                 'seasons': {season: [list(r) for r in season_ranges(years, months, months_)]
+                             for season, months_ in SEASONS.items()}}
+        # Reloaded just before writing: other processes may have added their files
+        index = _load(path)
+        index[key] = entry
+        try:
+            tmp_path = atomic_path(path)
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f, indent=1)
+            os.replace(tmp_path, path)
+        except OSError:
+            # Read-only data folder: the ranges are recomputed on the next call
+            pass
+    return {season: [SeasonRange(*r) for r in ranges] for season, ranges in entry['seasons'].items()}
+
+
+def file_season_ranges(input_file, season):
+    """Cached SeasonRange list of `season` ('DJF', 'JJA'...) in `input_file`."""
+    return file_index(input_file)[season]
+
+
+def select_period(daily_stats, start, end):
+    """Days of the period [start, end] ('YYYY-MM-DD' bounds), by season year when the days have one.
+
+    With a `season_year` coordinate, the winter of December 2020 belongs to 2021, so a
+    period ending in 2020 keeps December 2019 and leaves out December 2020.
+    """
+    if 'season_year' in daily_stats.coords:
+        season_year = daily_stats['season_year'].values
+        keep = (season_year >= int(start[:4])) & (season_year <= int(end[:4]))
+        return daily_stats.isel(time=np.flatnonzero(keep))
+    return daily_stats.sel(time=slice(start, end))
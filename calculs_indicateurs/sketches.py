@@ -0,0 +1,281 @@
+#Mergeable quantile sketches (KLL) of the daily altitude statistics, per period and season, without the daily files
+#
+#   python -m calculs_indicateurs.sketches build 'tasAdjust_alpes_day_*.nc' --variable tasAdjust --season DJF \
+#       --threshold 273.15 --buffer 0.5 --sketch isotherme_0_DJF_sketches.json --csv isotherme_0_percentile_stats.csv
+#   python -m calculs_indicateurs.sketches merge member_*/isotherme_0_DJF_sketches.json --csv ensemble_percentiles.csv
+#
+# CSV: one row per (period, season), columns <stat>_mean, <stat>_min, <stat>_max and <stat>_pXX, where the
+# percentiles are over the days of the period (e.g. mean_elevation_p90: isotherm of a warm winter day).
+import argparse
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import glob
+
+import numpy as np
+import pandas as pd
+
+from calculs_indicateurs.altitude_stats import CHUNK_DAYS, PERIODS, STATS, daily_elevation_stats
+from calculs_indicateurs.elevation_index import ELEVATION_FILE, get_index
+from calculs_indicateurs.ensemble import stage_condition
+from calculs_indicateurs.hyperslab import opened_readers
+from calculs_indicateurs.seasons import SEASONS
+from calculs_indicateurs.storage import atomic_path
+
+# Items kept by the top compactor. Rank error measured on 200k values merged from 8 sketches:
+# about 0.15% of the count on average, 0.6% at worst (1.1% at worst with K = 200)
+K = 400
+PERCENTILES = (10, 50, 90)
+
+
+class KLLSketch:
+    """KLL quantile sketch: compactors of weight 2**level, mergeable and order-independent in size.
+
+    Values are appended to level 0; a level over its capacity is sorted and every other item
+    (random offset) moves one level up with twice the weight. Capacities shrink by 2/3 per
+    level below the top one, so the sketch holds O(K) items whatever the number of values.
+    Count, sum, min and max are kept exactly.
+    """
+
+    def __init__(self, k=K, seed=None):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.rng = np.random.default_rng(seed)
+
+    def capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, values):
+        values = np.asarray(values, dtype='float64').ravel()
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+        self.count += values.size
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # An odd item stays at its level; the others are halved into the next one
+                keep = items[:len(items) % 2]
+                pairs = items[len(items) % 2:]
+                promoted = pairs[self.rng.integers(2)::2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def merge(self, other):
+        """Add the values summarized by `other` (e.g. another worker or ensemble member)."""
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        """Approximate quantiles `q` (in [0, 1]); NaN for an empty sketch."""
+        q = np.atleast_1d(np.asarray(q, dtype='float64'))
+        if self.count == 0:
+            return np.full(len(q), np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items_), 2 ** level, dtype='float64')
+                                  for level, items_ in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        items = items[order]
+        cumulative = np.cumsum(weights[order])
+        rank = q * cumulative[-1]
+        result = items[np.minimum(np.searchsorted(cumulative, rank, side='left'), len(items) - 1)]
+        # The extremes are exact
+        result[q <= 0] = self.min
+        result[q >= 1] = self.max
+        return result
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else np.nan
+
+    def to_dict(self):
+        return {'k': self.k, 'count': self.count, 'total': self.total, 'min': self.min, 'max': self.max,
+                'levels': [items.tolist() for items in self.levels]}
+
+    @classmethod
+    def from_dict(cls, data, seed=None):
+        sketch = cls(data['k'], seed)
+        sketch.count = data['count']
+        sketch.total = data['total']
+        sketch.min = data['min']
+        sketch.max = data['max']
+        sketch.levels = [np.asarray(items, dtype='float64') for items in data['levels']]
+        return sketch
+
+
+class PeriodSketches:
+    """One KLL sketch per (period, season, statistic) of the daily altitude statistics.
+
+    Days are routed to the periods containing their season year, so a winter is counted
+    in one period. Sketch sets built on separate files, workers or ensemble members merge
+    into the sketches of their union.
+    """
+
+    def __init__(self, periods=PERIODS, stats=STATS, k=K):
+        self.periods = [tuple(p) for p in periods]
+        self.stats = list(stats)
+        self.k = k
+        self.sketches = {}
+
+    def sketch(self, label, season, stat):
+        key = (label, season, stat)
+        if key not in self.sketches:
+            self.sketches[key] = KLLSketch(self.k)
+        return self.sketches[key]
+
+    def add(self, columns, season_years, season):
+        """Add the daily statistics `columns` ({stat: (day,) array}) of days of `season`."""
+        season_years = np.asarray(season_years)
+        for label, start, end in self.periods:
+            days = (season_years >= int(start[:4])) & (season_years <= int(end[:4]))
+            if not days.any():
+                continue
+            for stat in self.stats:
+                self.sketch(label, season, stat).update(np.asarray(columns[stat], dtype='float64')[days])
+
+    def merge(self, other):
+        for (label, season, stat), sketch in other.sketches.items():
+            self.sketch(label, season, stat).merge(sketch)
+        return self
+
+    def table(self, percentiles=PERCENTILES):
+        """DataFrame (period, season) of the mean, min, max and percentiles of every statistic."""
+        labels = [label for label, _, _ in self.periods]
+        rows = {}
+        for label, season, stat in sorted(self.sketches, key=lambda key: labels.index(key[0])):
+            sketch = self.sketches[(label, season, stat)]
+            row = rows.setdefault((label, season), {})
+            row[f'{stat}_mean'] = sketch.mean
+            row[f'{stat}_min'] = sketch.min if sketch.count else np.nan
+            row[f'{stat}_max'] = sketch.max if sketch.count else np.nan
+            for q, value in zip(percentiles, sketch.quantile(np.asarray(percentiles) / 100)):
+                row[f'{stat}_p{q}'] = value
+        df = pd.DataFrame.from_dict(rows, orient='index')
+        df.index = pd.MultiIndex.from_tuples(df.index, names=['period', 'season'])
+        return df
+
+    def save(self, path):
+        data = {'periods': self.periods, 'stats': self.stats, 'k': self.k,
+                'sketches': [{'period': label, 'season': season, 'stat': stat, 'sketch': sketch.to_dict()}
+                             for (label, season, stat), sketch in self.sketches.items()]}
+        tmp_path = atomic_path(path)
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        sketches = cls(data['periods'], data['stats'], data['k'])
+        for entry in data['sketches']:
+            sketches.sketches[(entry['period'], entry['season'], entry['stat'])] = KLLSketch.from_dict(entry['sketch'])
+        return sketches
+
+
+def file_sketches(input_file, params, elevation_file=ELEVATION_FILE, periods=PERIODS, k=K,
+                  chunk_days=CHUNK_DAYS):
+    """PeriodSketches of one file: the daily statistics of its season days are sketched, never stored.
+
+    `params` holds the variable, season, threshold and buffer of the stage (ensemble.ALTITUDE_STAGES).
+    """
+    index = get_index(elevation_file)
+    condition = stage_condition(params)
+    sketches = PeriodSketches(periods, k=k)
+    with opened_readers([input_file]) as (reader,):
+        if params['variable'] in reader:
+            for year, _, block in reader.season_blocks(params['variable'], params['season'], chunk_days):
+                stats = daily_elevation_stats(condition(block), index.order, index.sorted_elevation)
+                sketches.add(stats, np.full(len(block), year), params['season'])
+    return sketches
+
+
+def build(input_files, params, elevation_file=ELEVATION_FILE, periods=PERIODS, k=K, workers=os.cpu_count()):
+    """Sketch every file in a process pool and merge the per-file sketches."""
+    sketches = PeriodSketches(periods, k=k)
+    # Built once, before the workers load it
+    get_index(elevation_file)
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(input_files)))) as pool:
+        futures = [pool.submit(file_sketches, f, params, elevation_file, periods, k) for f in input_files]
+        for future in as_completed(futures):
+            sketches.merge(future.result())
+    return sketches
+
+
+def write_table(sketches, csv_file, percentiles=PERCENTILES):
+    tmp_path = atomic_path(csv_file)
+    sketches.table(percentiles).to_csv(tmp_path)
+    os.replace(tmp_path, csv_file)
+    return csv_file
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Quantile sketches of the daily altitude statistics per period')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = sub.add_parser('build', help='sketch the season days of the daily files')
+    build_parser.add_argument('patterns', nargs='+', help='glob patterns of the daily files')
+    build_parser.add_argument('--variable', required=True)
+    build_parser.add_argument('--season', choices=sorted(SEASONS), required=True)
+    build_parser.add_argument('--threshold', type=float, required=True)
+    build_parser.add_argument('--buffer', type=float, help='keep cells within threshold +/- buffer '
+                                                           '(default: cells at or above threshold)')
+    build_parser.add_argument('--elevation-file', default=ELEVATION_FILE)
+    build_parser.add_argument('--k', type=int, default=K)
+    build_parser.add_argument('--workers', type=int, default=os.cpu_count())
+    build_parser.add_argument('--sketch', required=True, help='JSON file of the sketches')
+
+    merge_parser = sub.add_parser('merge', help='merge sketch files (workers, ensemble members)')
+    merge_parser.add_argument('sketches', nargs='+', help='glob patterns of the sketch files')
+    merge_parser.add_argument('--sketch', help='JSON file of the merged sketches')
+
+    for p in (build_parser, merge_parser):
+        p.add_argument('--csv', help='per-period statistics CSV')
+        p.add_argument('--percentiles', type=int, nargs='+', default=list(PERCENTILES))
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        params = {'variable': args.variable, 'season': args.season, 'threshold': args.threshold,
+                  'buffer': args.buffer}
+        input_files = sorted(f for pattern in args.patterns for f in glob(pattern))
+        sketches = build(input_files, params, args.elevation_file, k=args.k, workers=args.workers)
+    else:
+        paths = sorted(f for pattern in args.sketches for f in glob(pattern))
+        sketches = PeriodSketches.load(paths[0])
+        for path in paths[1:]:
+            sketches.merge(PeriodSketches.load(path))
+    if args.sketch:
+        print(f"Written {sketches.save(args.sketch)}")
+    if args.csv:
+        print(f"Written {write_table(sketches, args.csv, args.percentiles)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+#Run-length spells of the threshold indicators: longest spell, number of spells and state transitions per year
+#
+#   python -m calculs_indicateurs.spells 'tasAdjust_alpes_day_*.nc' 'tasminAdjust_alpes_day_*.nc' --output-dir Spells_data
+#
+# The files of a variable are streamed in date order with the current runs carried from one block
+# (and file) to the next, so a spell crossing a file boundary is counted once, with its full length.
+# Output per input file: <spell>_<statistic>_per_year_<dates>.nc with statistic in max_spell,
+# spell_count and transitions.
+import argparse
+import os
+from dataclasses import dataclass
+from glob import glob
+
+import numpy as np
+import xarray as xr
+
+from calculs_indicateurs.indicators import (CHUNK_DAYS, COMPARISONS, FREEZING_DAYS, TROPICAL_DAYS,
+                                            _year_segments, date_range)
+from calculs_indicateurs.storage import FILL_VALUE, atomic_to_netcdf
+
+STATISTICS = {
+    'max_spell': 'Length of the longest spell ending in the year',
+    'spell_count': 'Number of spells ending in the year',
+    'transitions': 'Number of day-to-day changes between the two states (e.g. freeze-thaw)',
+}
+
+
+@dataclass(frozen=True)
+class Spell:
+    name: str
+    indicator: object
+    min_length: int = 1
+
+
+SPELLS = [
+    Spell('freezing', FREEZING_DAYS),
+    Spell('tropical_nights', TROPICAL_DAYS),
+]
+
+
+def run_lengths(hits, carry):
+    """Length of the run of True days ending at each day of a (time, ...) block, 0 on False days.
+
+    `carry` is the run length ending the day before the block. The position of the last
+    False day is propagated with a cumulative max over the time axis, so the whole block
+    is computed without any loop over days or cells.
+    """
+    hits = np.asarray(hits, dtype=bool)
+    day = np.arange(len(hits)).reshape((-1,) + (1,) * (hits.ndim - 1))
+    last_false = np.maximum.accumulate(np.where(hits, -1, day), axis=0)
+    runs = day - last_false
+    return np.where(last_false < 0, runs + carry, runs)
+
+
+class SpellCounter:
+    """Per-year spell statistics of one condition, fed block by block in date order.
+
+    A spell is attributed to the year of its last day. The run in progress and the state
+    of the last day are carried between blocks, so spells and transitions across block or
+    file boundaries are counted as in one continuous series.
+    """
+
+    def __init__(self, n_years, shape, min_length=1):
+        self.min_length = min_length
+        self.max_spell = np.zeros((n_years,) + shape, dtype='int32')
+        self.spell_count = np.zeros((n_years,) + shape, dtype='int16')
+        self.transitions = np.zeros((n_years,) + shape, dtype='int16')
+        self.run = np.zeros(shape, dtype='int32')
+        self.last = None
+        self.last_year = None
+
+    def _record(self, iy, ended, lengths):
+        ended = ended & (lengths >= self.min_length)
+        np.maximum(self.max_spell[iy], np.where(ended, lengths, 0), out=self.max_spell[iy])
+        self.spell_count[iy] += ended
+
+    def add(self, hits, year_index):
+        """Add a (time, ...) boolean block; `year_index` gives the year position of each day."""
+        hits = np.asarray(hits, dtype=bool)
+        runs = run_lengths(hits, self.run)
+        if self.last is not None:
+            # Spells still running at the end of the previous block that stop on its first day
+            self._record(self.last_year, (self.run > 0) & ~hits[0], self.run)
+
+        ended = np.zeros_like(hits)
+        ended[:-1] = hits[:-1] & ~hits[1:]
+        changed = np.zeros_like(hits)
+        changed[1:] = hits[1:] != hits[:-1]
+        if self.last is not None:
+            changed[0] = hits[0] != self.last
+
+        for iy, seg in _year_segments(year_index, 0, len(hits)):
+            ended_seg = ended[seg] & (runs[seg] >= self.min_length)
+            np.maximum(self.max_spell[iy], np.where(ended_seg, runs[seg], 0).max(axis=0), out=self.max_spell[iy])
+            self.spell_count[iy] += ended_seg.sum(axis=0, dtype='int16')
+            self.transitions[iy] += changed[seg].sum(axis=0, dtype='int16')
+
+        self.run = runs[-1].astype('int32')
+        self.last = hits[-1]
+        self.last_year = year_index[-1]
+
+    def flush(self):
+        """Close the spells still running (end of the series, or a gap in the dates)."""
+        if self.last is not None:
+            self._record(self.last_year, self.run > 0, self.run)
+        self.run[:] = 0
+        self.last = None
+
+
+def compute_spells(input_files, spells=SPELLS, chunk_days=CHUNK_DAYS):
+    """Per-year spell statistics of every spell whose variable is in `input_files`.
+
+    The files are read in date order, each variable once per block for all its spells.
+    Returns ({spell name: {statistic: (year, y, x) float array, NaN without data}}, years, x, y).
+    """
+    input_files = sorted(input_files, key=date_range)
+    years = set()
+    for input_file in input_files:
+        with xr.open_dataset(input_file) as ds:
+            years.update(ds['time'].dt.year.values.tolist())
+            x, y = ds['x'].values, ds['y'].values
+    years = np.array(sorted(years))
+    shape = (len(y), len(x))
+
+    counters = {}
+    valid = {}
+    last_day = {}
+    for input_file in input_files:
+        with xr.open_dataset(input_file) as ds:
+            file_spells = [s for s in spells if s.indicator.variable in ds]
+            for spell in file_spells:
+                if spell.name not in counters:
+                    counters[spell.name] = SpellCounter(len(years), shape, spell.min_length)
+            times = ds['time'].values
+            year_index = np.searchsorted(years, ds['time'].dt.year.values)
+            for var in sorted({s.indicator.variable for s in file_spells}):
+                if var not in valid:
+                    valid[var] = np.zeros((len(years),) + shape, dtype='int16')
+                # A gap in the dates closes the spells in progress
+                if var in last_day and times[0] - last_day[var] != np.timedelta64(1, 'D'):
+                    for spell in file_spells:
+                        if spell.indicator.variable == var:
+                            counters[spell.name].flush()
+                last_day[var] = times[-1]
+
+                for start in range(0, len(times), chunk_days):
+                    stop = min(start + chunk_days, len(times))
+                    block = ds[var].isel(time=slice(start, stop)).values
+                    for iy, seg in _year_segments(year_index, start, stop):
+                        valid[var][iy] += (~np.isnan(block[seg])).sum(axis=0, dtype='int16')
+                    for spell in file_spells:
+                        if spell.indicator.variable == var:
+                            ind = spell.indicator
+                            counters[spell.name].add(COMPARISONS[ind.comparison](block, ind.threshold),
+                                                     year_index[start:stop])
+
+    results = {}
+    for spell in spells:
+        if spell.name not in counters:
+            continue
+        counter = counters[spell.name]
+        counter.flush()
+        missing = valid[spell.indicator.variable] == 0
+        results[spell.name] = {stat: np.where(missing, np.nan, getattr(counter, stat).astype(float))
+                               for stat in STATISTICS}
+    return results, years, x, y
+
+
+def output_path(spell, stat, input_file, output_dir='.'):
+    return os.path.join(output_dir, f"{spell.name}_{stat}_per_year_{date_range(input_file)}.nc")
+
+
+def process_files(input_files, spells=SPELLS, output_dir='.', chunk_days=CHUNK_DAYS):
+    """Compute the spells over all `input_files` and write the years of each file, one NetCDF per statistic."""
+    results, years, x, y = compute_spells(input_files, spells, chunk_days)
+    written = []
+    for input_file in input_files:
+        with xr.open_dataset(input_file) as ds:
+            file_years = np.unique(ds['time'].dt.year.values)
+            variables = set(ds.data_vars)
+        keep = np.searchsorted(years, file_years)
+        for spell in spells:
+            if spell.name not in results or spell.indicator.variable not in variables:
+                continue
+            for stat, long_name in STATISTICS.items():
+                name = f'{spell.name}_{stat}'
+                ds_output = xr.Dataset({name: (['year', 'y', 'x'], results[spell.name][stat][keep])},
+                                       coords={'year': file_years.astype(int), 'y': y, 'x': x})
+                ds_output[name].attrs.update(
+                    long_name=f'{long_name}: {spell.indicator.long_name}',
+                    units='days' if stat == 'max_spell' else 'count',
+                    min_length=spell.min_length)
+                ds_output['year'].attrs['long_name'] = 'year'
+                # A spell can last longer than 366 days (e.g. summits frozen all year): int32
+                encoding = {name: {'dtype': 'int32', '_FillValue': FILL_VALUE}}
+                path = output_path(spell, stat, input_file, output_dir)
+                atomic_to_netcdf(ds_output, path, encoding=encoding)
+                written.append(path)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Per-year spells of the threshold indicators')
+    parser.add_argument('patterns', nargs='+', help='glob patterns of the Alpine daily files')
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--chunk-days', type=int, default=CHUNK_DAYS)
+    args = parser.parse_args(argv)
+    os.makedirs(args.output_dir, exist_ok=True)
+    for path in process_files(sorted(f for p in args.patterns for f in glob(p)), output_dir=args.output_dir, chunk_days=args.chunk_days):
+        print(f"Written {path}")
+
+
+if __name__ == '__main__':
+    main()
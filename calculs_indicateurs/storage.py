@@ -0,0 +1,49 @@
+#Small I/O helpers shared by the pipeline stages
+import os
+import re
+import tempfile
+
+UNITS = {'': 1, 'B': 1}
+for _power, _prefix in enumerate('KMGT', start=1):
+    UNITS[_prefix] = UNITS[_prefix + 'B'] = 1024 ** _power
+
+# Day counts on disk: a year has at most 366 days, so int16 holds any count
+# and -1 marks the cells/years without data
+FILL_VALUE = -1
+COUNT_DTYPE = 'int16'
+
+
+def count_encoding(names):
+    """to_netcdf/to_zarr encoding storing the day-count variables `names` as int16."""
+    return {name: {'dtype': COUNT_DTYPE, '_FillValue': FILL_VALUE} for name in names}
+
+
+def parse_size(text):
+    """'4GB' -> 4294967296 (bytes)."""
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?B?)\s*', str(text).upper())
+    if match is None:
+        raise ValueError(f"Invalid size: {text!r}")
+    value, unit = match.groups()
+    return int(float(value) * UNITS[unit])
+
+
+def atomic_path(path):
+    """Temporary file in the directory of `path`, to be renamed over it once complete."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    os.close(fd)
+    return tmp_path
+
+
+def atomic_to_netcdf(ds, path, **kwargs):
+    """Write `ds` to a temp file then rename it, so `path` is never left half written."""
+    tmp_path = atomic_path(path)
+    try:
+        ds.to_netcdf(tmp_path, **kwargs)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
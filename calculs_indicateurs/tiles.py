@@ -0,0 +1,237 @@
+#Web Mercator tile pyramids of the indicator maps (years, period means and anomalies)
+#
+#   python -m calculs_indicateurs.tiles freezing_days tropical_days --output-dir tiles --max-zoom 10
+#
+# Layout: <output-dir>/<indicator>/<layer>/<z>/<x>/<y>.png, with <output-dir>/<indicator>/metadata.json
+# giving the layers and their colormap range (layers: '1990', ..., 'mean_2041-2060', 'anomaly_2041-2060').
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+import mercantile
+import numpy as np
+import xarray as xr
+from PIL import Image
+from scipy.spatial import cKDTree
+
+from calculs_indicateurs.compact import open_compact
+from calculs_indicateurs.indicator_store import DATA_FOLDERS, netcdf_files
+from calculs_indicateurs.manifest import MANIFEST_NAME, Manifest, overlapping_files
+from calculs_indicateurs.periods import ANOMALY_PERIODS, REFERENCE, PeriodAggregator
+from calculs_indicateurs.storage import atomic_path
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GRID_FILE = os.path.join(REPO_ROOT, 'Alpes_grid.nc')
+TILE_SIZE = 256
+MIN_ZOOM = 6
+MAX_ZOOM = 10
+EARTH_RADIUS = 6378137.0
+
+# Colormaps of the scripts (maps) and of the Anomaly notebook (anomalies)
+STYLES = {
+    'freezing_days': {'cmap': 'Blues', 'anomaly_cmap': 'coolwarm_r'},
+    'tropical_days': {'cmap': 'Reds', 'anomaly_cmap': 'coolwarm'},
+}
+
+
+def web_mercator(lon, lat):
+    """EPSG:3857 coordinates (m) of lon/lat arrays (degrees)."""
+    x = EARTH_RADIUS * np.radians(lon)
+    y = EARTH_RADIUS * np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+    return x, y
+
+
+def build_lookup(lon, lat, zooms, tile_size=TILE_SIZE):
+    """Grid cell shown by each pixel of each tile covering the grid.
+
+    Pixel centers are matched to the nearest grid cell center in Web Mercator, within
+    about one cell; pixels farther than that are outside the grid (-1).
+    Returns the (n, 3) array of tiles (z, x, y) and the (n, tile_size, tile_size) int32 index.
+    """
+    lon = np.asarray(lon, dtype='float64')
+    lat = np.asarray(lat, dtype='float64')
+    cell_x, cell_y = web_mercator(lon.ravel(), lat.ravel())
+    tree = cKDTree(np.column_stack([cell_x, cell_y]))
+    spacing = np.median(tree.query(np.column_stack([cell_x, cell_y]), k=2)[0][:, 1])
+    max_distance = 0.75 * spacing
+
+    bounds = (lon.min(), lat.min(), lon.max(), lat.max())
+    tiles = [tile for zoom in zooms for tile in mercantile.tiles(*bounds, zooms=zoom)]
+    index = np.empty((len(tiles), tile_size, tile_size), dtype='int32')
+    centers = (np.arange(tile_size) + 0.5) / tile_size
+    for i, tile in enumerate(tiles):
+        b = mercantile.xy_bounds(tile)
+        px, py = np.meshgrid(b.left + centers * (b.right - b.left),
+                             b.top - centers * (b.top - b.bottom))
+        distance, nearest = tree.query(np.column_stack([px.ravel(), py.ravel()]),
+                                       distance_upper_bound=max_distance)
+        nearest[~np.isfinite(distance)] = -1
+        index[i] = nearest.reshape(tile_size, tile_size)
+    return np.array([(t.z, t.x, t.y) for t in tiles], dtype='int32'), index
+
+
+def lookup_path(grid_file, zooms):
+    with open(grid_file, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:16]
+    root = os.path.splitext(grid_file)[0]
+    return f"{root}_tiles_z{min(zooms)}-{max(zooms)}_{digest}.npz"
+
+
+def get_lookup(grid_file=GRID_FILE, zooms=range(MIN_ZOOM, MAX_ZOOM + 1)):
+    """Load the pixel -> grid cell lookup of the tiles, building and saving it the first time."""
+    path = lookup_path(grid_file, zooms)
+    if not os.path.exists(path):
+        with xr.open_dataset(grid_file) as grid:
+            tiles, index = build_lookup(grid['lon'].values, grid['lat'].values, zooms)
+        tmp_path = atomic_path(path)
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, tiles=tiles, index=index)
+        os.replace(tmp_path, path)
+    return path
+
+
+def colormap_lut(cmap, n=256):
+    """(n, 4) uint8 RGBA table of a matplotlib colormap."""
+    return (matplotlib.colormaps[cmap](np.linspace(0, 1, n)) * 255).round().astype('uint8')
+
+
+def cell_colors(values, cmap, vmin, vmax):
+    """RGBA of every grid cell (transparent where NaN), plus a last transparent row for -1."""
+    values = np.asarray(values, dtype='float64').ravel()
+    lut = colormap_lut(cmap)
+    scaled = np.clip((values - vmin) / (vmax - vmin) if vmax > vmin else 0 * values, 0, 1)
+    colors = lut[np.nan_to_num(scaled * (len(lut) - 1)).round().astype(int)]
+    colors[np.isnan(values)] = 0
+    return np.vstack([colors, np.zeros((1, 4), dtype='uint8')])
+
+
+# Tile lookup of each worker process, loaded once
+_lookup = {}
+
+
+def _init_worker(lookup_file):
+    with np.load(lookup_file) as data:
+        _lookup.update(tiles=data['tiles'], index=data['index'])
+
+
+def render_layer(job):
+    """Write the PNG tiles of one layer into a temporary directory, then move it in place.
+
+    Fully transparent tiles are not written: a missing tile is empty.
+    """
+    values, style, layer_dir = job
+    colors = cell_colors(values, style['cmap'], style['vmin'], style['vmax'])
+    tmp_dir = f'{layer_dir}.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    written = 0
+    for (z, x, y), index in zip(_lookup['tiles'], _lookup['index']):
+        rgba = colors[index]
+        if not rgba[..., 3].any():
+            continue
+        tile_dir = os.path.join(tmp_dir, str(z), str(x))
+        os.makedirs(tile_dir, exist_ok=True)
+        Image.fromarray(rgba, 'RGBA').save(os.path.join(tile_dir, f'{y}.png'))
+        written += 1
+    if os.path.exists(layer_dir):
+        shutil.rmtree(layer_dir)
+    os.makedirs(tmp_dir, exist_ok=True)
+    os.replace(tmp_dir, layer_dir)
+    return layer_dir, written
+
+
+def indicator_layers(name, data_folder=None):
+    """{layer: (values, style, (first year, last year))} of the years, period means and anomalies.
+
+    Years and period means share the colormap range of the yearly maps (as the animation
+    scripts compute it); anomalies (vs REFERENCE) use a symmetric diverging range.
+    """
+    style = STYLES[name]
+    cube = open_compact(name, data_folder)
+    values = cube.masked()
+    years = cube.years
+    map_style = {'cmap': style['cmap'], 'vmin': float(values.min()), 'vmax': float(values.max())}
+
+    layers = {}
+    for i, year in enumerate(years):
+        layers[str(year)] = (values[i].astype('float32').filled(np.nan), map_style, (year, year))
+
+    aggregator = PeriodAggregator(values, years)
+    reference = aggregator.mean(REFERENCE)
+    for period in [REFERENCE] + ANOMALY_PERIODS:
+        layers[f'mean_{period.label}'] = (aggregator.mean(period), map_style, (period.start, period.end))
+
+    anomalies = {period: aggregator.mean(period) - reference for period in ANOMALY_PERIODS}
+    limit = float(max(np.nanmax(np.abs(a)) for a in anomalies.values()))
+    anomaly_style = {'cmap': style['anomaly_cmap'], 'vmin': -limit, 'vmax': limit}
+    for period, anomaly in anomalies.items():
+        years_used = (min(REFERENCE.start, period.start), max(REFERENCE.end, period.end))
+        layers[f'anomaly_{period.label}'] = (anomaly, anomaly_style, years_used)
+    return layers
+
+
+def build_pyramids(names, output_dir='tiles', zooms=range(MIN_ZOOM, MAX_ZOOM + 1), grid_file=GRID_FILE,
+                   workers=None, data_folders=None):
+    """Write the tile pyramids of the indicators, layers rendered in parallel.
+
+    A layer is rewritten only when the input files of its years, its values or its
+    style changed since it was last written (manifest in `output_dir`).
+    """
+    data_folders = data_folders or {}
+    lookup_file = get_lookup(grid_file, zooms)
+    manifest = Manifest(os.path.join(output_dir, MANIFEST_NAME))
+
+    jobs = []
+    records = {}
+    for name in names:
+        indicator_dir = os.path.join(output_dir, name)
+        layers = indicator_layers(name, data_folders.get(name))
+        files = netcdf_files(name, data_folders.get(name))
+        metadata = {'tile_size': TILE_SIZE, 'zooms': list(zooms), 'format': 'png', 'layers': {}}
+        for layer, (values, style, (first, last)) in layers.items():
+            metadata['layers'][layer] = style
+            layer_dir = os.path.join(indicator_dir, layer)
+            values = np.ascontiguousarray(values, dtype='float32')
+            inputs = overlapping_files(files, first, last) + [grid_file]
+            params = dict(style, zooms=list(zooms), values=hashlib.sha1(values.tobytes()).hexdigest())
+            if manifest.is_current(layer_dir, inputs, params):
+                continue
+            jobs.append((values, style, layer_dir))
+            records[layer_dir] = (inputs, params)
+
+        os.makedirs(indicator_dir, exist_ok=True)
+        tmp_path = atomic_path(os.path.join(indicator_dir, 'metadata.json'))
+        with open(tmp_path, 'w') as f:
+            json.dump(metadata, f, indent=1)
+        os.replace(tmp_path, os.path.join(indicator_dir, 'metadata.json'))
+
+    if jobs:
+        workers = max(1, min(workers or os.cpu_count(), len(jobs)))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(lookup_file,)) as pool:
+            for layer_dir, written in pool.map(render_layer, jobs):
+                print(f"{layer_dir}: {written} tiles")
+                manifest.record(layer_dir, *records[layer_dir])
+                manifest.save()
+    return [job[2] for job in jobs]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Web Mercator tile pyramids of the indicator maps')
+    parser.add_argument('names', nargs='+', choices=sorted(DATA_FOLDERS))
+    parser.add_argument('--output-dir', default='tiles')
+    parser.add_argument('--min-zoom', type=int, default=MIN_ZOOM)
+    parser.add_argument('--max-zoom', type=int, default=MAX_ZOOM)
+    parser.add_argument('--grid-file', default=GRID_FILE)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args(argv)
+    build_pyramids(args.names, args.output_dir, range(args.min_zoom, args.max_zoom + 1),
+                   args.grid_file, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#Per-cell trend maps of the indicators: closed-form OLS over the year axis, optional Mann-Kendall / Sen's slope
+#
+#   python -m calculs_indicateurs.trends freezing_days tropical_days --mann-kendall
+#   python -m calculs_indicateurs.trends tropical_days --start 2021 --end 2100
+#
+# Output: <data folder>/<indicator>_trends_<start>-<end>.nc with slope and sen_slope in days/decade.
+import argparse
+import os
+
+import numpy as np
+import xarray as xr
+from scipy import stats
+
+from calculs_indicateurs.compact import open_compact
+from calculs_indicateurs.indicator_store import DATA_FOLDERS
+from calculs_indicateurs.storage import atomic_to_netcdf
+
+# Cells per block of the Mann-Kendall test (pairs of 111 years: about 50 MB per block)
+CHUNK_CELLS = 1024
+
+
+def _as_float(values):
+    """(year, cells) float64 array with NaN for missing values."""
+    values = np.ma.asarray(values)
+    values = values.astype('float64').filled(np.nan)
+    return values.reshape(len(values), -1)
+
+
+def ols_trend(values, years):
+    """Least-squares slope, intercept, r, p and stderr of every cell, as scipy.stats.linregress.
+
+    `values` is a (year, ...) array (masked or NaN where missing). Every statistic comes
+    from per-cell sums over the year axis, computed for all cells at once; each cell only
+    uses its own valid years. Returns a dict of (...) arrays, NaN where fewer than 3 years.
+    """
+    shape = np.shape(values)[1:]
+    y = _as_float(values)
+    x = np.asarray(years, dtype='float64')[:, None]
+    present = ~np.isnan(y)
+    n = present.sum(axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = np.where(present, x, 0).sum(axis=0) / n
+        y_mean = np.nansum(y, axis=0) / n
+        dx = np.where(present, x - x_mean, 0)
+        dy = np.where(present, y - y_mean, 0)
+        sxx = (dx * dx).sum(axis=0)
+        syy = (dy * dy).sum(axis=0)
+        sxy = (dx * dy).sum(axis=0)
+
+        slope = sxy / sxx
+        intercept = y_mean - slope * x_mean
+        # Constant series: r = 0, as linregress
+        r = np.where(syy > 0, sxy / np.sqrt(sxx * syy), 0.0)
+        r = np.clip(r, -1, 1)
+        df = n - 2
+        t = r * np.sqrt(df / ((1 - r) * (1 + r)))
+        p = 2 * stats.t.sf(np.abs(t), df)
+        stderr = np.sqrt((1 - r * r) * syy / sxx / df)
+
+    enough = n >= 3
+    result = {'slope': slope, 'intercept': intercept, 'r': r, 'p': p, 'stderr': stderr}
+    return {key: np.where(enough, value, np.nan).reshape(shape) for key, value in result.items()}
+
+
+def mann_kendall(values, years, chunk_cells=CHUNK_CELLS):
+    """Mann-Kendall S, z and two-sided p, and Sen's slope of every cell.
+
+    All (i < j) pairs of years are differenced at once for a block of `chunk_cells`
+    cells: S is the sum of their signs, Sen's slope the median of their slopes.
+    The variance of S includes the correction for tied values (frequent with day counts).
+    NaN where fewer than 3 years.
+    """
+    shape = np.shape(values)[1:]
+    y = _as_float(values)
+    x = np.asarray(years, dtype='float64')
+    i, j = np.triu_indices(len(x), k=1)
+    pair_dx = x[j] - x[i]
+
+    n_cells = y.shape[1]
+    result = {key: np.full(n_cells, np.nan) for key in ['s', 'z', 'p', 'sen_slope']}
+    # Cells outside the Alpine mask (no data) are skipped
+    cells = np.flatnonzero((~np.isnan(y)).sum(axis=0) >= 3)
+    for start in range(0, len(cells), chunk_cells):
+        chunk = cells[start:start + chunk_cells]
+        block = y[:, chunk].T
+        diff = block[:, j] - block[:, i]
+        s = np.nansum(np.sign(diff), axis=1)
+        n = (~np.isnan(block)).sum(axis=1)
+
+        # Tie groups: each value of a group of size t adds (t - 1)(2t + 5), i.e. t(t-1)(2t+5) per group
+        ties = (block[:, :, None] == block[:, None, :]).sum(axis=2)
+        tie_term = np.where(np.isnan(block), 0, (ties - 1) * (2 * ties + 5)).sum(axis=1)
+        var = (n * (n - 1) * (2 * n + 5) - tie_term) / 18
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z = np.where(var > 0, (s - np.sign(s)) / np.sqrt(var), 0.0)
+
+        result['s'][chunk] = s
+        result['z'][chunk] = z
+        result['p'][chunk] = 2 * stats.norm.sf(np.abs(z))
+        result['sen_slope'][chunk] = np.nanmedian(diff / pair_dx, axis=1)
+    return {key: value.reshape(shape) for key, value in result.items()}
+
+
+def trend_dataset(values, years, dims, coords, mann_kendall_test=False, name=None):
+    """Dataset of the per-cell trends, slopes in days/decade."""
+    ols = ols_trend(values, years)
+    ds = xr.Dataset(coords=coords)
+    ds['slope'] = (dims, 10 * ols['slope'], {'units': 'days/decade', 'long_name': 'OLS slope'})
+    ds['intercept'] = (dims, ols['intercept'], {'units': 'days'})
+    ds['r'] = (dims, ols['r'])
+    ds['p'] = (dims, ols['p'], {'long_name': 'Two-sided p-value of the OLS slope (t test)'})
+    ds['stderr'] = (dims, 10 * ols['stderr'], {'units': 'days/decade'})
+    if mann_kendall_test:
+        mk = mann_kendall(values, years)
+        ds['sen_slope'] = (dims, 10 * mk['sen_slope'], {'units': 'days/decade', 'long_name': "Sen's slope"})
+        ds['mk_s'] = (dims, mk['s'])
+        ds['mk_z'] = (dims, mk['z'])
+        ds['mk_p'] = (dims, mk['p'], {'long_name': 'Two-sided p-value of the Mann-Kendall test'})
+    ds.attrs['indicator'] = name or ''
+    ds.attrs['years'] = f'{int(years[0])}-{int(years[-1])}'
+    return ds
+
+
+def trends_path(name, start, end, data_folder=None):
+    return os.path.join(data_folder or DATA_FOLDERS[name], f'{name}_trends_{start}-{end}.nc')
+
+
+def indicator_trends(name, start=None, end=None, mann_kendall_test=False, data_folder=None):
+    """Trend maps of one indicator over the years [start, end], written next to its cube."""
+    cube = open_compact(name, data_folder)
+    years = cube.years
+    start = years[0] if start is None else start
+    end = years[-1] if end is None else end
+    keep = np.flatnonzero((years >= start) & (years <= end))
+    if len(keep) == 0:
+        raise ValueError(f"No year of {name} between {start} and {end} (available: {years[0]}-{years[-1]})")
+    values = cube.masked(slice(keep[0], keep[-1] + 1))
+    years = years[keep]
+    coords = {dim: cube.coord(dim) for dim in cube.dims[1:]}
+    ds = trend_dataset(values, years, cube.dims[1:], coords, mann_kendall_test, name)
+    output_file = trends_path(name, years[0], years[-1], data_folder)
+    atomic_to_netcdf(ds, output_file)
+    return output_file
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Per-cell trend maps of the indicators')
+    parser.add_argument('names', nargs='+', choices=sorted(DATA_FOLDERS))
+    parser.add_argument('--start', type=int)
+    parser.add_argument('--end', type=int)
+    parser.add_argument('--mann-kendall', action='store_true', help="add the Mann-Kendall test and Sen's slope")
+    args = parser.parse_args(argv)
+    for name in args.names:
+        print(f"Written {indicator_trends(name, args.start, args.end, args.mann_kendall)}")
+
+
+if __name__ == '__main__':
+    main()
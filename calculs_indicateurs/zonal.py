@@ -0,0 +1,289 @@
+#Per-department zonal statistics: department label raster built once, one bincount pass per year
+#
+#   python -m calculs_indicateurs.zonal indicators freezing_days tropical_days
+#   python -m calculs_indicateurs.zonal altitude 'tasAdjust_alpes_day_*.nc' --variable tasAdjust \
+#       --season DJF --threshold 273.15 --buffer 0.5 --stats-csv isotherme_0_department_stats.csv
+#
+# Indicators: <data folder>/<indicator>_zonal_stats.csv, one row per (department, elevation band, year),
+# band 'all' for the whole department. Altitude: one row per (period, department), columns of altitude_stats.
+import argparse
+import os
+from glob import glob
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from calculs_indicateurs.alpes_mask import ALPINE_CODES, GRID_FILE, MASK_DIR, build_mask, grid_hash, load_departments
+from calculs_indicateurs.altitude_stats import CHUNK_DAYS, PERIODS, STATS
+from calculs_indicateurs.compact import open_compact
+from calculs_indicateurs.elevation_index import ELEVATION_FILE, get_index
+from calculs_indicateurs.ensemble import stage_condition
+from calculs_indicateurs.hyperslab import opened_readers, season_columns
+from calculs_indicateurs.indicator_store import DATA_FOLDERS
+from calculs_indicateurs.seasons import SEASONS, select_period
+from calculs_indicateurs.storage import atomic_path, atomic_to_netcdf
+
+PERCENTILES = (10, 50, 90)
+ALL_BANDS = 'all'
+
+
+# -----------------------------
+# Department label raster
+# -----------------------------
+def labels_path(lat, lon, codes=ALPINE_CODES, mask_dir=MASK_DIR):
+    return os.path.join(mask_dir, f"Alpes_departments_{grid_hash(lat, lon, codes)}.nc")
+
+
+def get_department_labels(ds, codes=ALPINE_CODES, mask_dir=MASK_DIR, departments=None):
+    """(y, x) int8 raster of the department of each cell (index in `codes`, -1 outside).
+
+    Built once per grid and cached next to the Alpine mask, as get_alpine_mask does.
+    """
+    lat = ds['lat'].values
+    lon = ds['lon'].values
+    path = labels_path(lat, lon, codes, mask_dir)
+
+    if os.path.exists(path):
+        with xr.open_dataset(path) as cached:
+            return cached['department'].load()
+
+    if departments is None:
+        departments = load_departments(codes)
+    values = np.full(lat.shape, -1, dtype='int8')
+    for i, code in enumerate(codes):
+        inside = build_mask(lat, lon, departments[departments['code'] == code].union_all())
+        # A cell on a shared border keeps its first department
+        values[inside & (values < 0)] = i
+
+    labels = xr.DataArray(values, dims=ds['lat'].dims,
+                          coords={dim: ds.coords[dim] for dim in ds['lat'].dims if dim in ds.coords})
+    ds_labels = xr.Dataset({'department': labels})
+    ds_labels['department'].attrs['long_name'] = 'Index of the department of the grid point (-1 outside)'
+    ds_labels.attrs['departments'] = ','.join(codes)
+    ds_labels.attrs['grid_hash'] = grid_hash(lat, lon, codes)
+    os.makedirs(mask_dir, exist_ok=True)
+    atomic_to_netcdf(ds_labels, path)
+    return labels
+
+
+def cell_bands(index):
+    """Elevation band of every flat grid cell of an ElevationIndex (-1 without elevation)."""
+    bands = np.full(index.shape[0] * index.shape[1], -1, dtype='int32')
+    band_size = np.diff(np.append(index.band_start, len(index.order)))
+    bands[index.order] = np.repeat(np.arange(len(band_size)), band_size)
+    return bands
+
+
+# -----------------------------
+# Indicator statistics
+# -----------------------------
+def histogram_stats(hist, percentiles=PERCENTILES):
+    """Count, mean, max and percentiles of integer values 0..n-1 given as a (zones, n) histogram.
+
+    Percentiles interpolate linearly between ranks, as np.percentile; the value at rank k
+    is the first value whose cumulative count exceeds k. NaN for empty zones.
+    """
+    count = hist.sum(axis=1)
+    cumulative = np.cumsum(hist, axis=1)
+    has = count > 0
+    stats = {'count': count}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats['mean'] = np.where(has, hist @ np.arange(hist.shape[1]) / count, np.nan)
+    last = hist.shape[1] - 1 - np.argmax(hist[:, ::-1] > 0, axis=1)
+    stats['max'] = np.where(has, last, np.nan)
+    for p in percentiles:
+        rank = p / 100 * np.maximum(count - 1, 0)
+        low = (cumulative <= np.floor(rank)[:, None]).sum(axis=1)
+        high = (cumulative <= np.ceil(rank)[:, None]).sum(axis=1)
+        stats[f'p{p}'] = np.where(has, low + (rank - np.floor(rank)) * (high - low), np.nan)
+    return stats
+
+
+def zonal_stats(values, years, labels, bands=None, n_bands=0, codes=ALPINE_CODES, band_edges=None,
+                percentiles=PERCENTILES):
+    """Per-department (and per-band) statistics of a (year, y, x) masked array of day counts.
+
+    Each cell belongs to one zone (department x elevation band, plus a slot for cells
+    without elevation). Each year is a single bincount of zone * n_values + value: the
+    (zones, values) histogram gives every statistic, and the department rows are the
+    sums of their band rows. Returns a long DataFrame.
+    """
+    values = np.ma.asarray(values)
+    labels = np.asarray(labels).ravel()
+    n_slots = n_bands + 1
+    if bands is None:
+        bands = np.full(labels.shape, -1)
+    zone = labels.astype('int64') * n_slots + np.where(bands >= 0, bands, n_bands)
+    cells = np.flatnonzero(labels >= 0)
+    n_zones = len(codes) * n_slots
+
+    present = values.compressed()
+    if present.size and (present.min() < 0 or not np.all(present == np.round(present))):
+        raise ValueError("zonal_stats expects non-negative integer values (day counts)")
+    n_values = int(present.max()) + 1 if present.size else 1
+
+    if band_edges is not None:
+        band_names = [f'{int(a)}-{int(b)}' for a, b in zip(band_edges[:-1], band_edges[1:])]
+    else:
+        band_names = []
+    rows = []
+    for year, year_values in zip(years, values.reshape(len(years), -1)):
+        valid = cells[~np.ma.getmaskarray(year_values)[cells]]
+        data = np.ma.getdata(year_values)[valid].astype('int64')
+        hist = np.bincount(zone[valid] * n_values + data, minlength=n_zones * n_values)
+        hist = hist.reshape(len(codes), n_slots, n_values)
+        tables = [(ALL_BANDS, hist.sum(axis=1))] + [(name, hist[:, b]) for b, name in enumerate(band_names)]
+        for band, table in tables:
+            stats = histogram_stats(table, percentiles)
+            for i, code in enumerate(codes):
+                if band != ALL_BANDS and stats['count'][i] == 0:
+                    continue
+                rows.append({'department': code, 'elevation_band': band, 'year': int(year),
+                             **{key: stat[i] for key, stat in stats.items()}})
+    return pd.DataFrame(rows)
+
+
+def zonal_stats_path(name, data_folder=None):
+    return os.path.join(data_folder or DATA_FOLDERS[name], f'{name}_zonal_stats.csv')
+
+
+def indicator_zonal_stats(name, data_folder=None, grid_file=GRID_FILE, elevation_file=ELEVATION_FILE,
+                          output_file=None):
+    """Zonal statistics CSV of one indicator (elevation bands only if the elevation file exists)."""
+    with xr.open_dataset(grid_file) as grid:
+        labels = get_department_labels(grid).values
+    cube = open_compact(name, data_folder)
+    if os.path.exists(elevation_file):
+        index = get_index(elevation_file)
+        bands = dict(bands=cell_bands(index), n_bands=len(index.band_start), band_edges=index.band_edges)
+    else:
+        bands = {}
+    df = zonal_stats(cube.masked(), cube.years, labels, **bands)
+    output_file = output_file or zonal_stats_path(name, data_folder)
+    tmp_path = atomic_path(output_file)
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, output_file)
+    return df
+
+
+# -----------------------------
+# Altitude statistics per department
+# -----------------------------
+def department_order(labels, elevation):
+    """Flat indices of the labelled cells sorted by (department, elevation), with their labels and elevations."""
+    labels = np.asarray(labels).ravel()
+    flat = np.asarray(elevation, dtype='float64').ravel()
+    cells = np.flatnonzero((labels >= 0) & ~np.isnan(flat))
+    order = cells[np.lexsort((flat[cells], labels[cells]))]
+    return order, labels[order].astype('int64'), flat[order]
+
+
+def department_elevation_stats(mask, order, sorted_labels, sorted_elevation, n_labels):
+    """Daily elevation statistics of the True cells of each department: {stat: (days, departments)}.
+
+    Same rank lookups as altitude_stats.daily_elevation_stats: with the cells ordered by
+    (department, elevation), the hits of a day come out of np.nonzero grouped by
+    department and sorted by elevation, so the (day, department) key is non-decreasing.
+    """
+    n_days = len(mask)
+    hits = np.asarray(mask).reshape(n_days, -1)[:, order]
+    days, cells = np.nonzero(hits)
+    key = days * n_labels + sorted_labels[cells]
+    n_keys = n_days * n_labels
+
+    count = np.bincount(key, minlength=n_keys)
+    total = np.bincount(key, weights=sorted_elevation[cells], minlength=n_keys)
+    first = np.cumsum(count) - count
+
+    stats = {name: np.full(n_keys, np.nan) for name in STATS[:-1]}
+    has = count > 0
+    start = first[has]
+    n = count[has]
+    stats['mean_elevation'][has] = total[has] / n
+    stats['min_elevation'][has] = sorted_elevation[cells[start]]
+    stats['max_elevation'][has] = sorted_elevation[cells[start + n - 1]]
+    stats['median_elevation'][has] = 0.5 * (sorted_elevation[cells[start + (n - 1) // 2]] +
+                                            sorted_elevation[cells[start + n // 2]])
+    stats['count_points'] = count
+    return {name: values.reshape(n_days, n_labels) for name, values in stats.items()}
+
+
+def department_daily_stats(input_files, variable, season, condition, labels, elevation, codes=ALPINE_CODES,
+                           chunk_days=CHUNK_DAYS):
+    """Daily per-department elevation statistics of the season days, read as hyperslabs file by file."""
+    order, sorted_labels, sorted_elevation = department_order(labels, elevation)
+
+    def block_stats(block):
+        return department_elevation_stats(condition(block), order, sorted_labels, sorted_elevation, len(codes))
+
+    with opened_readers(input_files) as readers:
+        columns, dates, season_years = season_columns(readers, variable, season, block_stats, chunk_days)
+    return xr.Dataset(
+        {name: (('time', 'department'), columns[name]) for name in STATS},
+        coords={'time': dates, 'season_year': ('time', season_years), 'department': list(codes)}
+    )
+
+
+def department_period_means(daily_stats, periods=PERIODS):
+    """Long DataFrame (period, department) of the period means of the daily statistics."""
+    frames = []
+    for label, start, end in periods:
+        period_data = select_period(daily_stats, start, end)
+        if period_data.sizes['time'] == 0:
+            continue
+        mean_data = period_data.mean(dim='time', skipna=True)
+        df = mean_data.to_dataframe()[list(STATS)].reset_index()
+        df.insert(0, 'period', label)
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def run_department_altitude(input_files, variable, season, condition, csv_file, grid_file=GRID_FILE,
+                            elevation_file=ELEVATION_FILE, periods=PERIODS):
+    with xr.open_dataset(grid_file) as grid:
+        labels = get_department_labels(grid).values
+    with xr.open_dataset(elevation_file) as ds_topo:
+        elevation = ds_topo['elevation'].values
+    daily_stats = department_daily_stats(input_files, variable, season, condition, labels, elevation)
+    df = department_period_means(daily_stats, periods)
+    tmp_path = atomic_path(csv_file)
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, csv_file)
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Per-department zonal statistics')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    indicators = commands.add_parser('indicators', help='per-year statistics of the indicators')
+    indicators.add_argument('names', nargs='+', choices=sorted(DATA_FOLDERS))
+    indicators.add_argument('--grid-file', default=GRID_FILE)
+    indicators.add_argument('--elevation-file', default=ELEVATION_FILE)
+
+    altitude = commands.add_parser('altitude', help='per-period elevation of threshold-crossing cells')
+    altitude.add_argument('patterns', nargs='+', help='glob patterns of the *_alpes_day_*.nc files')
+    altitude.add_argument('--variable', required=True)
+    altitude.add_argument('--season', choices=sorted(SEASONS), required=True)
+    altitude.add_argument('--threshold', type=float, required=True)
+    altitude.add_argument('--buffer', type=float, help='keep cells within threshold +/- buffer '
+                                                       '(default: cells at or above threshold)')
+    altitude.add_argument('--stats-csv', required=True)
+    altitude.add_argument('--grid-file', default=GRID_FILE)
+    altitude.add_argument('--elevation-file', default=ELEVATION_FILE)
+    args = parser.parse_args(argv)
+
+    if args.command == 'indicators':
+        for name in args.names:
+            df = indicator_zonal_stats(name, grid_file=args.grid_file, elevation_file=args.elevation_file)
+            print(f"{zonal_stats_path(name)}: {len(df)} rows")
+    else:
+        input_files = sorted(f for pattern in args.patterns for f in glob(pattern))
+        condition = stage_condition({'threshold': args.threshold, 'buffer': args.buffer})
+        run_department_altitude(input_files, args.variable, args.season, condition, args.stats_csv,
+                                args.grid_file, args.elevation_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import os
+
+from calculs_indicateurs.ridge import Band, Line, load_ridge, read_levels, render_ridge_animation
+
+# Scénario dont l'ensemble est tracé (dossier produit par calculs_indicateurs/ensemble.py)
+SCENARIO = "ssp370"
+ensemble_folder = os.path.join("ensemble", SCENARIO)
+
+# -----------------------------
+# Lecture des fichiers CSV
+# -----------------------------
+# Sommets de la ligne de crête, préfectures et stations de ski
+df = load_ridge("ligne_crete_cols.csv")
+
+# Isothermes 0°C par période : moyenne d'ensemble (lignes) et dispersion entre
+# modèles, du 10e au 90e centile (bandes)
+FROIDE = "Isotherme 0° pour l'année la plus froide sur la période"
+MOYEN = "Isotherme 0° moyen sur la période"
+CHAUDE = "Isotherme 0° pour l'année la plus chaude sur la période"
+colonnes = {}
+for cle, stat in [(FROIDE, "min_elevation"), (MOYEN, "mean_elevation"), (CHAUDE, "max_elevation")]:
+    colonnes[cle] = f"{stat}_mean"
+    colonnes[f"{cle} (p10-p90)"] = (f"{stat}_p10", f"{stat}_p90")
+isothermes = read_levels(os.path.join(ensemble_folder, "isotherme_0_ensemble_stats.csv"), colonnes)
+
+lignes = [
+    Line(FROIDE, "#2EA8FF", '--', '{key} {periode}'),
+    Line(MOYEN, "#8ACEFF", '-', '{key} {periode}'),
+    Line(CHAUDE, "#B3DFFF", '--', '{key} {periode}'),
+]
+bandes = [Band(f"{ligne.key} (p10-p90)", ligne.color, "{key}") for ligne in lignes]
+
+# -----------------------------
+# Animation
+# -----------------------------
+image_folder = "crete_animations"
+output_video = os.path.join(image_folder, f"crete_animation_ensemble_{SCENARIO}.mp4")
+output_gif = os.path.join(image_folder, f"crete_animation_ensemble_{SCENARIO}.gif")
+render_ridge_animation(df, lignes, f"Profil de crêtes avec altitudes de l'isotherme 0°C, ensemble {SCENARIO} ({{periode}})",
+                       isothermes, [output_video, output_gif], fps=1, bands=bandes)
+print(f"Vidéo créée : {output_video}")
+print(f"GIF créé : {output_gif}")
@@ -1,138 +1,55 @@
-import xarray as xr
-import numpy as np
-import glob
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation, PillowWriter, FFMpegWriter
-import os
-
-# -----------------------------
-# Charger tous les fichiers
-# -----------------------------
-data_folder = 'Isotherme0_data'
-input_pattern = os.path.join(data_folder, 'freezing_days_per_year_*.nc')
-input_files = sorted(glob.glob(input_pattern))
-
-datasets = [xr.open_dataset(f) for f in input_files]
-combined = xr.concat(datasets, dim='year')
-
-# Convertir freezing_days en nombre de jours
-freezing_days_in_days = combined['freezing_days'] / np.timedelta64(1, 'D')
-
-# Coordonnées
-x = combined['x'].values.astype(float)
-y = combined['y'].values.astype(float)
-if np.issubdtype(combined['year'].dtype, np.datetime64):
-    years = combined['year'].dt.year.values
-else:
-    years = combined['year'].values
-
-# -----------------------------
-# Créer la figure pour animation
-# -----------------------------
-fig, ax = plt.subplots(figsize=(8,6))
-mesh = ax.pcolormesh(x, y, freezing_days_in_days[0, :, :], shading='auto', cmap='Blues')
-cbar = plt.colorbar(mesh, ax=ax)
-cbar.set_label('Jours de gel')
-title = ax.set_title(f'Jours de gel - Année {years[0]}')
-ax.set_xlabel('x')
-ax.set_ylabel('y')
-
-# Définir limites couleurs pour stabilité visuelle
-vmin = np.nanmin(freezing_days_in_days.values)
-vmax = np.nanmax(freezing_days_in_days.values)
-mesh.set_clim(vmin, vmax)
-
-# -----------------------------
-# Fonction d’animation pour afficher toutes les années
-# -----------------------------
-def update(frame):
-    mesh.set_array(freezing_days_in_days[frame, :, :].values.ravel())
-    title.set_text(f'Jours de gel - Année {years[frame]}')
-    return mesh, title
-
-# -----------------------------
-# Créer l’animation
-# -----------------------------
-anim = FuncAnimation(fig, update, frames=len(years), blit=False)
-
-# -----------------------------
-# Sauvegarder directement la vidéo
-# -----------------------------
-output_video = 'isotherme_animations/freezing_days_evolution.mp4'
-writer = FFMpegWriter(fps=8)
-anim.save(output_video, writer=writer)
-print(f"Vidéo créée : {output_video}")
-
-# -----------------------------
-# Sauvegarder directement un GIF
-# -----------------------------
-output_gif = 'isotherme_animations/freezing_days_evolution.gif'
-gif_writer = PillowWriter(fps=8)
-anim.save(output_gif, writer=gif_writer)
-print(f"GIF créé : {output_gif}")
-
-# -----------------------------
-# Définir les intervalles
-# -----------------------------
-intervals = [
-    (1990, 2000),
-    (2000, 2020),
-    (2020, 2040),
-    (2040, 2060),
-    (2060, 2080),
-    (2080, 2100)
-]
-
-mean_slices = []
-interval_labels = []
-
-for start, end in intervals:
-    mask = (years >= start) & (years < end)
-    mean_slice = freezing_days_in_days[mask, :, :].mean(dim='year')
-    mean_slices.append(mean_slice)
-    interval_labels.append(f"{start}-{end}")
-
-mean_slices = xr.concat(mean_slices, dim='interval')
-
-
-fig, ax = plt.subplots(figsize=(8,6))
-mesh = ax.pcolormesh(x, y, mean_slices[0, :, :], shading='auto', cmap='Blues')
-cbar = plt.colorbar(mesh, ax=ax)
-cbar.set_label('Jours de gel')
-title = ax.set_title(f'Jours de gel - Intervalle {interval_labels[0]}')
-ax.set_xlabel('x')
-ax.set_ylabel('y')
-
-# Définir limites couleurs pour stabilité visuelle
-vmin = np.nanmin(mean_slices.values)
-vmax = np.nanmax(mean_slices.values)
-mesh.set_clim(vmin, vmax)
-
-# -----------------------------
-# Fonction d’animation pour afficher par intervalles
-# -----------------------------
-def update_intervals(frame):
-    mesh.set_array(mean_slices[frame, :, :].values.ravel())
-    title.set_text(f'Jours de gel - Intervalle {interval_labels[frame]}')
-    return mesh, title
-
-# -----------------------------
-# Créer l’animation
-# -----------------------------
-anim = FuncAnimation(fig, update_intervals, frames=len(mean_slices), blit=False)
-
-# -----------------------------
-# Sauvegarder directement la vidéo
-# -----------------------------
-output_video = 'isotherme_animations/freezing_days_intervals.mp4'
-writer = FFMpegWriter(fps=1)  # plus lent pour visualiser chaque intervalle
-anim.save(output_video, writer=writer)
-print(f"Vidéo créée : {output_video}")
-
-# -----------------------------
-# Sauvegarder directement un GIF
-# -----------------------------
-output_gif = 'isotherme_animations/freezing_days_intervals.gif'
-gif_writer = PillowWriter(fps=1)
-anim.save(output_gif, writer=gif_writer)
-print(f"GIF créé : {output_gif}")
\ No newline at end of file
+from calculs_indicateurs.compact import open_compact
+from calculs_indicateurs.periods import INTERVALS, PeriodAggregator
+from calculs_indicateurs.rendering import render_animation
+
+
+def main():
+    # -----------------------------
+    # Charger l'indicateur (cube compact int16 projeté en mémoire, voir calculs_indicateurs/compact.py)
+    # -----------------------------
+    # Export du cube : python -m calculs_indicateurs.compact freezing_days
+    data_folder = 'Isotherme0_data'
+    cube = open_compact('freezing_days', data_folder=data_folder)
+
+    # Nombre de jours, masqué là où il n'y a pas de données (vue sans copie du fichier)
+    freezing_days_in_days = cube.masked()
+
+    # Coordonnées
+    x = cube.x.astype(float)
+    y = cube.y.astype(float)
+    years = cube.years
+
+    # -----------------------------
+    # Moyennes par intervalle
+    # -----------------------------
+    # À partir des sommes cumulées par année (voir calculs_indicateurs/periods.py)
+    aggregator = PeriodAggregator(freezing_days_in_days, years)
+    mean_slices = aggregator.aggregate(INTERVALS, 'mean')
+    interval_labels = [period.label for period in INTERVALS]
+
+    # -----------------------------
+    # Créer les animations
+    # -----------------------------
+    # Chaque image est rendue une seule fois (processus parallèles, backend Agg), puis les
+    # mêmes images sont encodées en MP4 et en GIF (voir calculs_indicateurs/rendering.py)
+
+    # Toutes les années
+    output_video = 'isotherme_animations/freezing_days_evolution.mp4'
+    output_gif = 'isotherme_animations/freezing_days_evolution.gif'
+    render_animation(x, y, freezing_days_in_days, [f'Jours de gel - Année {year}' for year in years],
+                     [output_video, output_gif], fps=8, cmap='Blues', label='Jours de gel')
+    print(f"Vidéo créée : {output_video}")
+    print(f"GIF créé : {output_gif}")
+
+    # Par intervalles (plus lent pour visualiser chaque intervalle)
+    output_video = 'isotherme_animations/freezing_days_intervals.mp4'
+    output_gif = 'isotherme_animations/freezing_days_intervals.gif'
+    render_animation(x, y, mean_slices.values, [f'Jours de gel - Intervalle {interval}' for interval in interval_labels],
+                     [output_video, output_gif], fps=1, cmap='Blues', label='Jours de gel')
+    print(f"Vidéo créée : {output_video}")
+    print(f"GIF créé : {output_gif}")
+
+
+# Les processus de rendu (spawn) réimportent ce module : le chargement reste dans main()
+if __name__ == '__main__':
+    main()
@@ -1,192 +1,52 @@
-import xarray as xr
-import numpy as np
-import glob
 import os
-import plotly.graph_objects as go
-import imageio
+
+from calculs_indicateurs.compact import open_compact
+from calculs_indicateurs.periods import INTERVALS, PeriodAggregator
+from calculs_indicateurs.plotly_export import heatmap_animation, write_html
 
 # -----------------------------
-# Charger tous les fichiers
+# Charger l'indicateur (cube compact int16 projeté en mémoire, voir calculs_indicateurs/compact.py)
 # -----------------------------
 data_folder = 'Tropical_data'
-input_pattern = os.path.join(data_folder, 'tropical_days_per_year_*.nc')
-input_files = sorted(glob.glob(input_pattern))
-
-datasets = [xr.open_dataset(f) for f in input_files]
-combined = xr.concat(datasets, dim='year')
+cube = open_compact('tropical_days', data_folder=data_folder)
 
-# Convertir tropical_days en nombre de jours
-tropical_days_in_days = combined['tropical_days'] / np.timedelta64(1, 'D')
+# Nombre de jours, masqué là où il n'y a pas de données
+tropical_days_in_days = cube.masked()
 
 # Coordonnées
-x = combined['x'].values.astype(float)
-y = combined['y'].values.astype(float)
-if np.issubdtype(combined['year'].dtype, np.datetime64):
-    years = combined['year'].dt.year.values
-else:
-    years = combined['year'].values
+x = cube.x.astype(float)
+y = cube.y.astype(float)
+years = cube.years
 
-# Définir limites couleurs pour stabilité
-vmin = np.nanmin(tropical_days_in_days.values)
-vmax = np.nanmax(tropical_days_in_days.values)
+# Définir limites couleurs
+vmin = float(tropical_days_in_days.min())
+vmax = float(tropical_days_in_days.max())
 
 # -----------------------------
 # Animation par année
 # -----------------------------
-frames = []
-for i, year in enumerate(years):
-    frames.append(go.Frame(
-        data=[go.Heatmap(
-            z=tropical_days_in_days[i, :, :].values,
-            x=x,
-            y=y,
-            zmin=vmin,
-            zmax=vmax,
-            colorscale='Reds',
-            colorbar=dict(title='Nuits tropicales')
-        )],
-        name=str(year)
-    ))
-
-fig = go.Figure(
-    data=[go.Heatmap(
-        z=tropical_days_in_days[0, :, :].values,
-        x=x,
-        y=y,
-        zmin=vmin,
-        zmax=vmax,
-        colorscale='Reds',
-        colorbar=dict(title='Nuits tropicales')
-    )],
-    frames=frames
-)
-
-# Slider et boutons Play/Pause
-sliders = [dict(
-    steps=[dict(method='animate',
-                args=[[str(year)], dict(mode='immediate', frame=dict(duration=200, redraw=True), transition=dict(duration=0))],
-                label=str(year)) for year in years],
-    transition=dict(duration=0),
-    x=0, y=0, currentvalue=dict(prefix="Année: ", font=dict(size=16)),
-    len=1.0
-)]
-
-fig.update_layout(
-    title='Nuits tropicales - Évolution par année',
-    xaxis_title='x',
-    yaxis_title='y',
-    width=800,
-    height=600,
-    sliders=sliders,
-    updatemenus=[dict(
-        type='buttons',
-        showactive=False,
-        y=1.05,
-        x=1.05,
-        xanchor='right',
-        yanchor='top',
-        buttons=[
-            dict(label='Play', method='animate',
-                 args=[None, dict(frame=dict(duration=200, redraw=True),
-                                  transition=dict(duration=0),
-                                  fromcurrent=True,
-                                  mode='immediate')]),
-            dict(label='Pause', method='animate',
-                 args=[[None], dict(frame=dict(duration=0, redraw=False),
-                                    mode='immediate')])
-        ]
-    )]
-)
-
-# Créer dossier pour HTML
+# Une seule trace de base (x, y, échelle de couleurs) ; chaque image ne contient que z,
+# en tableau typé base64 (voir calculs_indicateurs/plotly_export.py)
+fig_years = heatmap_animation(x, y, tropical_days_in_days, [str(year) for year in years],
+                              title='Nuits tropicales - Évolution par année', colorbar_title='Nuits tropicales',
+                              colorscale='Reds', slider_prefix="Année: ", duration=200,
+                              vmin=vmin, vmax=vmax)
+
+# plotly.js est chargé depuis le CDN au lieu d'être inclus dans chaque fichier
 os.makedirs("tropical_animations_plotly", exist_ok=True)
-fig.write_html("tropical_animations_plotly/tropical_days_years_animation.html")
+write_html(fig_years, "tropical_animations_plotly/tropical_days_years_animation.html")
 
 # -----------------------------
 # Animation par intervalles
 # -----------------------------
-intervals = [
-    (1990, 2000),
-    (2000, 2020),
-    (2020, 2040),
-    (2040, 2060),
-    (2060, 2080),
-    (2080, 2100)
-]
-
-mean_slices = []
-interval_labels = []
-
-for start, end in intervals:
-    mask = (years >= start) & (years < end)
-    mean_slice = tropical_days_in_days[mask, :, :].mean(dim='year')
-    mean_slices.append(mean_slice)
-    interval_labels.append(f"{start}-{end}")
-
-mean_slices = xr.concat(mean_slices, dim='interval')
-
-frames_intervals = []
-for i, label in enumerate(interval_labels):
-    frames_intervals.append(go.Frame(
-        data=[go.Heatmap(
-            z=mean_slices[i, :, :].values,
-            x=x,
-            y=y,
-            zmin=vmin,
-            zmax=vmax,
-            colorscale='Reds',
-            colorbar=dict(title='Nuits tropicales')
-        )],
-        name=label
-    ))
-
-fig_intervals = go.Figure(
-    data=[go.Heatmap(
-        z=mean_slices[0, :, :].values,
-        x=x,
-        y=y,
-        zmin=vmin,
-        zmax=vmax,
-        colorscale='Reds',
-        colorbar=dict(title='Nuits tropicales')
-    )],
-    frames=frames_intervals
-)
-
-sliders_intervals = [dict(
-    steps=[dict(method='animate',
-                args=[[label], dict(mode='immediate', frame=dict(duration=1000, redraw=True), transition=dict(duration=0))],
-                label=label) for label in interval_labels],
-    transition=dict(duration=0),
-    x=0, y=0, currentvalue=dict(prefix="Intervalle: ", font=dict(size=16)),
-    len=1.0
-)]
+# Moyennes par intervalle, à partir des sommes cumulées par année (voir calculs_indicateurs/periods.py)
+aggregator = PeriodAggregator(tropical_days_in_days, years)
+mean_slices = aggregator.aggregate(INTERVALS, 'mean')
+interval_labels = [period.label for period in INTERVALS]
 
-fig_intervals.update_layout(
-    title='Nuits tropicales - Moyenne par intervalle',
-    xaxis_title='x',
-    yaxis_title='y',
-    width=800,
-    height=600,
-    sliders=sliders_intervals,
-    updatemenus=[dict(
-        type='buttons',
-        showactive=False,
-        y=1.05,
-        x=1.05,
-        xanchor='right',
-        yanchor='top',
-        buttons=[
-            dict(label='Play', method='animate',
-                 args=[None, dict(frame=dict(duration=1000, redraw=True),
-                                  transition=dict(duration=0),
-                                  fromcurrent=True,
-                                  mode='immediate')]),
-            dict(label='Pause', method='animate',
-                 args=[[None], dict(frame=dict(duration=0, redraw=False),
-                                    mode='immediate')])
-        ]
-    )]
-)
+fig_intervals = heatmap_animation(x, y, mean_slices.values, interval_labels,
+                                  title='Nuits tropicales - Moyenne par intervalle', colorbar_title='Nuits tropicales',
+                                  colorscale='Reds', slider_prefix="Intervalle: ", duration=1000,
+                                  vmin=vmin, vmax=vmax)
 
-fig_intervals.write_html("tropical_animations_plotly/tropical_days_intervals_animation.html")
+write_html(fig_intervals, "tropical_animations_plotly/tropical_days_intervals_animation.html")